@@ -38,6 +38,7 @@ export interface LabResult {
     id: string
     name: string
     value: string
+    unit?: string
     date: string
     status: string
     test?: string
@@ -47,6 +48,7 @@ export interface Vital {
     id: string
     type: string
     value: string
+    unit?: string
     date: string
     time: string
     systolic?: number
@@ -1,14 +1,21 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import json
 import os
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 import sys
+import time
 
 # Add the current directory to Python path to import local modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from context_selection import select_context, CONTEXT_CANDIDATE_FACTOR, CONTEXT_SELECTION
+from jobs import get_job_queue
+from response_cache import file_version, get_response_cache, patient_index_version
+from observation_store import ObservationTable
+from vocabulary import load_patient_record, save_patient_record
+
 # Try to import search functions, but handle if ChromaDB is not available
 try:
     from search import search_patient_data, get_db_collection
@@ -19,7 +26,11 @@ except ImportError as e:
 
 # Try to import search functions, but handle if not available
 try:
-    from search import search_patient_data, get_db_collection, search_patient_data_for_context
+    from search import (
+        search_patient_data, get_db_collection, search_patient_data_for_context, search_patient_data_batch,
+        get_collection_pool, get_index_pools, get_query_embedding_cache, get_patient_db_collection
+    )
+    from cohort_search import cohort_search, cohort_search_iter
     SEARCH_AVAILABLE = True
     print("Search functions imported successfully from search.py")
 except ImportError as e:
@@ -27,11 +38,18 @@ except ImportError as e:
     SEARCH_AVAILABLE = False
     search_patient_data = None
     get_db_collection = None
+    get_patient_db_collection = None
     search_patient_data_for_context = None
+    search_patient_data_batch = None
+    get_collection_pool = None
+    get_index_pools = None
+    get_query_embedding_cache = None
+    cohort_search = None
+    cohort_search_iter = None
 
 # Try to import embed functions for indexing
 try:
-    from embed import index_patient_data, flatten_patient_data
+    from embed import index_patient_data, flatten_patient_data, embed_texts
     EMBED_AVAILABLE = True
     print("Embed functions imported successfully from embed.py")
 except ImportError as e:
@@ -39,6 +57,7 @@ except ImportError as e:
     EMBED_AVAILABLE = False
     index_patient_data = None
     flatten_patient_data = None
+    embed_texts = None
 
 # Import ingester which should always be available
 try:
@@ -50,17 +69,25 @@ except ImportError as e:
 
 # Try to import Gemini integration
 try:
-    from gemini_integration import GeminiCopilot
+    from gemini_integration import GeminiCopilot, get_copilot
     GEMINI_AVAILABLE = True
     print("Gemini integration imported successfully")
 except ImportError as e:
     print(f"Warning: Gemini integration not available: {e}")
     GEMINI_AVAILABLE = False
     GeminiCopilot = None
+    get_copilot = None
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all domains on all routes
 
+# Limits of one /api/search/batch request
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "50"))
+MAX_BATCH_PATIENTS = int(os.getenv("MAX_BATCH_PATIENTS", "100"))
+# Limits of one /api/cohort/search request
+MAX_COHORT_RESULTS = int(os.getenv("MAX_COHORT_RESULTS", "100"))
+MAX_COHORT_HITS_PER_PATIENT = int(os.getenv("MAX_COHORT_HITS_PER_PATIENT", "20"))
+
 # Load patient data
 def load_patient_data():
     """Load the patient data from JSON file"""
@@ -71,13 +98,15 @@ def load_patient_data():
         print("Warning: patient_data.json not found")
         return {}
 
+def get_patient_file_path(patient_id: str) -> Path:
+    return Path(f'patient_data/{patient_id}.json')
+
 def load_patient_by_id(patient_id: str):
     """Load specific patient data by ID from the patient_data directory"""
-    patient_file_path = Path(f'patient_data/{patient_id}.json')
+    patient_file_path = get_patient_file_path(patient_id)
     if patient_file_path.exists():
         try:
-            with open(patient_file_path, 'r') as f:
-                return json.load(f)
+            return load_patient_record(str(patient_file_path))
         except Exception as e:
             print(f"Error loading patient {patient_id}: {e}")
     return None
@@ -91,6 +120,15 @@ def get_all_patient_files():
 
 # Global patient data
 patient_data = load_patient_data()
+# Bumped whenever the global patient data is replaced (its response cache version)
+patient_data_generation = 0
+
+def replace_patient_data(data: Dict[str, Any]) -> None:
+    """Make data the global patient data (nothing of the previous patient is kept)"""
+    global patient_data_generation
+    patient_data.clear()
+    patient_data.update(data)
+    patient_data_generation += 1
 
 @app.route('/api/patient', methods=['GET'])
 def get_patient():
@@ -189,10 +227,40 @@ def get_allergies():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Observation table of the global patient_data, rebuilt only when the data is replaced
+_observation_table_cache = (None, None)
+
+def get_observation_table(data: Dict[str, Any]) -> Optional[ObservationTable]:
+    """Return the structured observation table of patient data, or None for legacy data"""
+    global _observation_table_cache
+    columns = data.get('observation_table')
+    if not columns:
+        return None
+    cached_columns, table = _observation_table_cache
+    if cached_columns is not columns:
+        table = ObservationTable.from_dict(columns)
+        _observation_table_cache = (columns, table)
+    return table
+
 @app.route('/api/labs', methods=['GET'])
 def get_lab_results():
     """Get patient lab results"""
     try:
+        table = get_observation_table(patient_data)
+        if table is not None:
+            # Serve straight from the typed observation table
+            return jsonify([
+                {
+                    "id": f"lab-{i}",
+                    "name": table.name[i],
+                    "value": table.bare_value(i),
+                    "unit": table.unit[i],
+                    "date": table.date[i] or "2023-01-01",
+                    "status": "final"
+                }
+                for i in table.indices('laboratory')
+            ])
+        
         observations = patient_data.get('observations', [])
         # Filter for lab-like observations and transform
         formatted_labs = []
@@ -215,6 +283,21 @@ def get_lab_results():
 def get_vitals():
     """Get patient vital signs"""
     try:
+        table = get_observation_table(patient_data)
+        if table is not None:
+            # Serve straight from the typed observation table
+            return jsonify([
+                {
+                    "id": f"vital-{i}",
+                    "type": table.name[i],
+                    "value": table.bare_value(i),
+                    "unit": table.unit[i],
+                    "date": table.date[i] or "2023-01-01",
+                    "time": table.time[i] or "10:00 AM"
+                }
+                for i in table.indices('vital-signs')
+            ])
+        
         observations = patient_data.get('observations', [])
         # Filter for vital signs and transform
         formatted_vitals = []
@@ -313,32 +396,37 @@ def get_recommendations():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def is_empty_extraction(data: Dict[str, Any]) -> bool:
+    """True if processed FHIR data holds no patient and no clinical resources"""
+    for value in data.values():
+        # The observation table is a dict of (possibly empty) columns
+        if isinstance(value, dict) and any(value.values()):
+            return False
+        if not isinstance(value, dict) and value:
+            return False
+    return True
+
 @app.route('/upload_fhir', methods=['POST'])
 def upload_fhir():
     """Upload FHIR data and process it"""
     try:
-        # Get the raw JSON data from the request
-        fhir_data = request.get_json(force=True)
-        
-        if not fhir_data:
-            return jsonify({"error": "No FHIR data provided"}), 400
-        
-        # Validate that it's valid JSON (it should be if we got here)
-        if not isinstance(fhir_data, dict):
-            return jsonify({"error": "FHIR data must be a valid JSON object"}), 400
-        
-        print(f"Received FHIR data with keys: {list(fhir_data.keys())}")
-        
-        # If FHIR ingester is available, use it to process the data
+        # If FHIR ingester is available, stream the request body through it
         if INGESTER_AVAILABLE:
+            ingester = FHIRIngester()
+            # Bundle entries are parsed one resource at a time instead of building the whole dict
+            try:
+                processed_data = ingester.process_fhir_stream(request.stream)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                return jsonify({"error": f"Invalid FHIR JSON: {str(e)}"}), 400
+            
+            if is_empty_extraction(processed_data):
+                return jsonify({"error": "No patient or clinical resources found in FHIR data"}), 400
+            
             try:
-                ingester = FHIRIngester()
-                processed_data = ingester.process_fhir_data(fhir_data)
                 print(f"FHIR data processed successfully")
                 
-                # Update the global patient_data
-                global patient_data
-                patient_data.update(processed_data)
+                # Replace the global patient_data
+                replace_patient_data(processed_data)
                 
                 # Index the processed data for searching
                 if EMBED_AVAILABLE:
@@ -360,11 +448,22 @@ def upload_fhir():
                 })
             except Exception as e:
                 print(f"Error processing FHIR data: {e}")
-                # Fall back to storing raw data
-                pass
+                return jsonify({"error": f"FHIR processing error: {str(e)}"}), 500
+        
+        # Get the raw JSON data from the request
+        fhir_data = request.get_json(force=True)
+        
+        if not fhir_data:
+            return jsonify({"error": "No FHIR data provided"}), 400
+        
+        # Validate that it's valid JSON (it should be if we got here)
+        if not isinstance(fhir_data, dict):
+            return jsonify({"error": "FHIR data must be a valid JSON object"}), 400
+        
+        print(f"Received FHIR data with keys: {list(fhir_data.keys())}")
         
         # Fallback: just store the raw FHIR data
-        patient_data.update(fhir_data)
+        replace_patient_data(fhir_data)
         
         # Save to a file for persistence (optional)
         try:
@@ -409,38 +508,35 @@ def search_patient_vector():
         query = data['query']
         n_results = data.get('n_results', 5)
         filter_type = data.get('filter_type', None)
+        # Defaults to the patient of the current global patient data
+        patient_id = data.get('patient_id') or patient_data.get('patient_id')
+        if not patient_id:
+            return jsonify({"error": "patient_id parameter required"}), 400
+        patient_id = str(patient_id)
         
-        # Check if collection exists
-        collection = get_db_collection()
-        if not collection:
-            return jsonify({"error": "Patient data not indexed. Please upload and process FHIR data first."}), 404
+        # Check if the patient has been indexed
+        if get_patient_db_collection(patient_id) is None:
+            return jsonify({"error": f"Patient {patient_id} not indexed. Please upload and process their data first."}), 404
         
-        # Perform search
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results,
-            where={"type": filter_type} if filter_type else None
-        )
+        # Patient-specific search (filter_type queries search only that type's partition)
+        results = search_patient_data_for_context(query, n_results, filter_type, patient_id,
+                                                  retrieval=data.get('retrieval'))
         
         # Format results for frontend
-        formatted_results = []
-        if results["documents"][0]:
-            for i, (text, metadata, distance) in enumerate(zip(
-                results["documents"][0], 
-                results["metadatas"][0],
-                results["distances"][0]
-            )):
-                relevance = 1 - distance
-                formatted_results.append({
-                    "id": i + 1,
-                    "text": text,
-                    "type": metadata.get('type', 'unknown'),
-                    "relevance": round(relevance, 3),
-                    "distance": round(distance, 3)
-                })
+        formatted_results = [
+            {
+                "id": i + 1,
+                "text": result["text"],
+                "type": result["type"],
+                "relevance": result["relevance"],
+                "distance": result["distance"]
+            }
+            for i, result in enumerate(results)
+        ]
         
         return jsonify({
             "query": query,
+            "patient_id": patient_id,
             "results": formatted_results,
             "total_results": len(formatted_results)
         })
@@ -464,32 +560,60 @@ def copilot_query():
         n_results = data.get('n_results', 5)  # Number of context documents to retrieve
         filter_type = data.get('filter_type', None)  # Optional filter for specific data types
         patient_id = data.get('patient_id', None)  # Optional patient ID for patient-specific queries
+        retrieval = data.get('retrieval', None)  # Optional "vector" or "hybrid" retrieval mode
         
         # Determine which patient data to use
         current_patient_data = patient_data  # Default to global patient data
+        data_version = f"global:{patient_data_generation}"
         if patient_id:
+            # Stamp the file before reading it, so a concurrent save can only make the key older
+            file_data_version = file_version(str(get_patient_file_path(patient_id)))
             specific_patient_data = load_patient_by_id(patient_id)
             if specific_patient_data:
                 current_patient_data = specific_patient_data
+                data_version = f"file:{file_data_version}"
                 print(f"Using specific patient data for patient: {patient_id}")
             else:
                 print(f"Patient {patient_id} not found, using default patient data")
         
-        # Initialize Gemini copilot
+        # Identical questions about unchanged patient data are answered from the response cache
+        response_cache = get_response_cache()
+        cache_key = response_cache.make_key(
+            patient_id, data_version, query,
+            n_results=n_results, filter_type=filter_type, retrieval=retrieval,
+            index_version=patient_index_version(patient_id)
+        )
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            cached["query"] = query
+            cached["cache_hit"] = True
+            return jsonify(cached)
+        
+        # Get the shared Gemini copilot (created on first use)
         try:
-            copilot = GeminiCopilot()
+            copilot = get_copilot()
         except ValueError as e:
             return jsonify({"error": str(e)}), 503
         
         # Get context from vector search if available
         context_results = []
+        selection_stats = None
         if SEARCH_AVAILABLE:
             try:
                 # For patient-specific search, we need a patient_id
                 if patient_id:
                     # Search patient-specific database
-                    context_results = search_patient_data_for_context(query, n_results, filter_type, patient_id)
+                    # Over-fetch candidates and let context selection pick at most n_results of them
+                    candidates = n_results * CONTEXT_CANDIDATE_FACTOR if CONTEXT_SELECTION else n_results
+                    context_results = search_patient_data_for_context(query, candidates, filter_type, patient_id,
+                                                                      retrieval=retrieval)
                     print(f"Retrieved {len(context_results)} context results for patient {patient_id}")
+                    if CONTEXT_SELECTION and context_results:
+                        context_results, selection_stats = select_context(
+                            context_results, max_results=n_results,
+                            embed_fn=embed_texts if EMBED_AVAILABLE else None
+                        )
+                        print(f"Selected {len(context_results)} context results: {selection_stats}")
                 else:
                     print("No patient_id provided - cannot perform patient-specific search")
             except Exception as e:
@@ -499,11 +623,17 @@ def copilot_query():
         if context_results:
             # Use context-aware response generation with specific patient data
             response = copilot.generate_copilot_response(query, context_results, current_patient_data)
+            if selection_stats:
+                response["context_selection"] = selection_stats
         else:
             # Fallback to simple response with specific patient data
             response = copilot.generate_simple_response(query, current_patient_data)
             response["fallback_reason"] = "Vector search not available or no indexed data found"
         
+        # Fallback answers (no context retrieved) may be due to a transient search failure
+        if "error" not in response and "fallback_reason" not in response:
+            response_cache.put(cache_key, response)
+        response["cache_hit"] = False
         return jsonify(response)
         
     except Exception as e:
@@ -554,21 +684,36 @@ def health_check():
         "message": "Clinical Copilot API is running"
     })
 
+def make_indexing_job(patient_id: str, patient_filename: Optional[str], processed_data: Dict[str, Any]):
+    """
+    Build the indexing job for an upload. The job reads the saved patient file when it
+    starts, so a job merged with later uploads indexes the latest data.
+    """
+    def run(progress):
+        data = load_patient_record(patient_filename) if patient_filename else processed_data
+        return index_patient_data(data, patient_id, progress=progress)
+    return run
+
 @app.route('/api/upload-json', methods=['POST'])
 def upload_json():
     """Upload JSON data (either file or direct JSON) and process it with automatic indexing"""
     try:
         json_data = None
+        processed_data = None
         
         # Check if it's a file upload
         if 'file' in request.files:
             file = request.files['file']
             if file and file.filename.endswith('.json'):
                 try:
-                    content = file.read().decode('utf-8')
-                    json_data = json.loads(content)
+                    if INGESTER_AVAILABLE:
+                        # Walk the bundle one resource at a time instead of loading it whole
+                        processed_data = FHIRIngester().process_fhir_stream(file.stream)
+                    else:
+                        content = file.read().decode('utf-8')
+                        json_data = json.loads(content)
                     print(f"File upload successful: {file.filename}")
-                except json.JSONDecodeError:
+                except (json.JSONDecodeError, UnicodeDecodeError):
                     return jsonify({"error": "Invalid JSON format in uploaded file"}), 400
                 except Exception as e:
                     return jsonify({"error": f"Error reading file: {str(e)}"}), 400
@@ -577,8 +722,17 @@ def upload_json():
         
         # Check if it's direct JSON data
         elif request.is_json:
-            request_data = request.get_json()
+            if INGESTER_AVAILABLE:
+                top_level = {}
+                try:
+                    processed_data = FHIRIngester().process_fhir_stream(request.stream, top_level=top_level)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    return jsonify({"error": "Invalid JSON format"}), 400
+                request_data = top_level
+            else:
+                request_data = request.get_json()
             if 'jsonData' in request_data:
+                processed_data = None
                 try:
                     json_data = json.loads(request_data['jsonData'])
                     print("Direct JSON upload successful")
@@ -591,28 +745,32 @@ def upload_json():
         else:
             return jsonify({"error": "No JSON data provided. Send either a file upload or JSON data."}), 400
         
-        if not json_data:
-            return jsonify({"error": "No valid JSON data found"}), 400
-        
-        # Validate that it's valid JSON object
-        if not isinstance(json_data, dict):
-            return jsonify({"error": "JSON data must be a valid object"}), 400
-        
-        print(f"Processing JSON data with keys: {list(json_data.keys())}")
+        if processed_data is not None:
+            print(f"Streamed JSON data through FHIR ingester with keys: {list(processed_data.keys())}")
+        else:
+            if not json_data:
+                return jsonify({"error": "No valid JSON data found"}), 400
+            
+            # Validate that it's valid JSON object
+            if not isinstance(json_data, dict):
+                return jsonify({"error": "JSON data must be a valid object"}), 400
+            
+            print(f"Processing JSON data with keys: {list(json_data.keys())}")
+            
+            # Process the data using FHIR ingester if available
+            processed_data = json_data
+            
+            if INGESTER_AVAILABLE:
+                try:
+                    ingester = FHIRIngester()
+                    processed_data = ingester.process_fhir_data(json_data)
+                    print("JSON data processed through FHIR ingester successfully")
+                except Exception as e:
+                    print(f"Warning: FHIR processing failed, using raw data: {e}")
+                    processed_data = json_data
         
-        # Process the data using FHIR ingester if available
-        processed_data = json_data
         patient_id = None
         
-        if INGESTER_AVAILABLE:
-            try:
-                ingester = FHIRIngester()
-                processed_data = ingester.process_fhir_data(json_data)
-                print("JSON data processed through FHIR ingester successfully")
-            except Exception as e:
-                print(f"Warning: FHIR processing failed, using raw data: {e}")
-                processed_data = json_data
-        
         # Extract patient ID from the data
         patient_info = processed_data.get("patient", [])
         if patient_info and isinstance(patient_info, list) and len(patient_info) > 0:
@@ -627,9 +785,8 @@ def upload_json():
         
         print(f"Processing data for patient: {patient_id}")
         
-        # Update the global patient_data
-        global patient_data
-        patient_data.update(processed_data)
+        # Replace the global patient_data
+        replace_patient_data(processed_data)
         
         # Save the processed data to file for persistence
         try:
@@ -640,33 +797,33 @@ def upload_json():
             print(f"Warning: Could not save patient data to file: {e}")
         
         # Also save to patient-specific file in patient_data directory
+        patient_filename = None
         try:
             os.makedirs('patient_data', exist_ok=True)
-            patient_filename = f"patient_data/{patient_id}.json"
-            with open(patient_filename, 'w') as f:
-                json.dump(processed_data, f, indent=2)
+            patient_filename = str(get_patient_file_path(patient_id))
+            save_patient_record(patient_filename, processed_data)
+            get_response_cache().invalidate(patient_id)
             print(f"Patient data saved to {patient_filename}")
         except Exception as e:
+            patient_filename = None
             print(f"Warning: Could not save patient-specific data to file: {e}")
         
-        # Automatically index the data for searching with patient ID
-        indexing_success = False
+        # Queue indexing for search with patient ID instead of embedding inside the request
+        job_id = None
         if EMBED_AVAILABLE:
-            try:
-                index_patient_data(processed_data, patient_id)
-                indexing_success = True
-                print(f"Data indexed successfully for patient {patient_id}")
-            except Exception as e:
-                print(f"Warning: Could not index data for search: {e}")
-                indexing_success = True
-                print("Data indexed successfully for vector search")
-            except Exception as e:
-                print(f"Warning: Could not index data for search: {e}")
+            job_id = get_job_queue().submit(
+                patient_id, make_indexing_job(patient_id, patient_filename, processed_data)
+            )
+            print(f"Indexing job {job_id} queued for patient {patient_id}")
+        job = get_job_queue().get(job_id) if job_id else None
         
         return jsonify({
             "message": "JSON data uploaded and processed successfully",
             "processed": True,
-            "indexed": indexing_success,
+            "indexed": job is not None and job["status"] == "completed",
+            "indexing": job["status"] if job else "unavailable",
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}" if job_id else None,
             "patient_id": patient_id,
             "data_summary": {
                 "conditions": len(processed_data.get('conditions', [])),
@@ -683,6 +840,127 @@ def upload_json():
         print(f"Error processing JSON data: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Get status and progress of a background indexing job"""
+    job = get_job_queue().get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs', methods=['GET'])
+def get_job_queue_stats():
+    """Get counts of indexing jobs by status"""
+    return jsonify(get_job_queue().stats())
+
+@app.route('/api/search/batch', methods=['POST'])
+def search_patient_vector_batch():
+    """Run several queries against one or more patients in one request"""
+    start = time.perf_counter()
+    try:
+        if not SEARCH_AVAILABLE:
+            return jsonify({"error": "Search functionality not available"}), 503
+        
+        data = request.get_json()
+        if not data or not isinstance(data.get('queries'), list) or not data['queries']:
+            return jsonify({"error": "queries must be a non-empty list"}), 400
+        queries = data['queries']
+        if not all(isinstance(q, str) and q.strip() for q in queries):
+            return jsonify({"error": "Every query must be a non-empty string"}), 400
+        
+        patient_ids = data.get('patient_ids') or ([data['patient_id']] if data.get('patient_id') else [])
+        if not isinstance(patient_ids, list) or not patient_ids:
+            return jsonify({"error": "patient_id or a non-empty patient_ids list is required"}), 400
+        if len(queries) > MAX_BATCH_QUERIES or len(patient_ids) > MAX_BATCH_PATIENTS:
+            return jsonify({"error": f"Batches are limited to {MAX_BATCH_QUERIES} queries "
+                                     f"and {MAX_BATCH_PATIENTS} patients"}), 400
+        
+        n_results = data.get('n_results', 5)
+        filter_type = data.get('filter_type', None)
+        batch = search_patient_data_batch(queries, [str(p) for p in patient_ids], n_results, filter_type)
+        
+        grouped = {
+            patient_id: [
+                {"query": query, "results": results, "total_results": len(results)}
+                for query, results in zip(queries, per_query)
+            ]
+            for patient_id, per_query in batch["results"].items()
+        }
+        timings = dict(batch["timings_ms"])
+        timings["total"] = round((time.perf_counter() - start) * 1000, 2)
+        return jsonify({
+            "queries": queries,
+            "results": grouped,
+            "missing_patients": batch["missing_patients"],
+            "errors": batch["errors"],
+            "latency_ms": timings
+        })
+        
+    except Exception as e:
+        print(f"Error in batch search: {e}")
+        return jsonify({"error": f"Search error: {str(e)}"}), 500
+
+@app.route('/api/cohort/search', methods=['POST'])
+def search_cohort():
+    """
+    Find the patients whose data best matches a query across the whole panel
+    
+    With "stream": true the response is NDJSON: "partial" rankings while patient
+    stores are being searched, then a final "done" event.
+    """
+    try:
+        if not SEARCH_AVAILABLE:
+            return jsonify({"error": "Search functionality not available"}), 503
+        
+        data = request.get_json()
+        if not data or not isinstance(data.get('query'), str) or not data['query'].strip():
+            return jsonify({"error": "Query parameter required"}), 400
+        
+        patient_ids = data.get('patient_ids')
+        if patient_ids is not None and not isinstance(patient_ids, list):
+            return jsonify({"error": "patient_ids must be a list"}), 400
+        n_results = data.get('n_results', 10)
+        hits_per_patient = data.get('hits_per_patient', 3)
+        if not isinstance(n_results, int) or isinstance(n_results, bool) or not 1 <= n_results <= MAX_COHORT_RESULTS:
+            return jsonify({"error": f"n_results must be an integer between 1 and {MAX_COHORT_RESULTS}"}), 400
+        if (not isinstance(hits_per_patient, int) or isinstance(hits_per_patient, bool)
+                or not 1 <= hits_per_patient <= MAX_COHORT_HITS_PER_PATIENT):
+            return jsonify({"error": f"hits_per_patient must be an integer between 1 and "
+                                     f"{MAX_COHORT_HITS_PER_PATIENT}"}), 400
+        args = (
+            data['query'],
+            n_results,
+            hits_per_patient,
+            data.get('filter_type', None),
+            [str(p) for p in patient_ids] if patient_ids else None
+        )
+        
+        if data.get('stream'):
+            def generate():
+                for event in cohort_search_iter(*args):
+                    yield json.dumps(event) + "\n"
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+        
+        result = cohort_search(*args)
+        result.pop("event", None)
+        return jsonify(result)
+        
+    except Exception as e:
+        print(f"Error in cohort search: {e}")
+        return jsonify({"error": f"Search error: {str(e)}"}), 500
+
+@app.route('/api/search/stats', methods=['GET'])
+def get_search_cache_stats():
+    """Get hit counters of the collection and index pools, the query embedding cache and the copilot response cache"""
+    if not SEARCH_AVAILABLE:
+        return jsonify({"error": "Search functionality not available"}), 503
+    return jsonify({
+        "collection_pool": get_collection_pool().stats(),
+        **{name: pool.stats() for name, pool in get_index_pools().items()},
+        "query_embeddings": get_query_embedding_cache().stats(),
+        "copilot_responses": get_response_cache().stats()
+    })
+
 @app.route('/api/patients', methods=['GET'])
 def get_all_patients():
     """Get list of all available patients"""
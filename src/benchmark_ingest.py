@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Ingest benchmarks
+
+Usage:
+    python benchmark_ingest.py [bundle.json ...]
+        Compare the json.load path and the streaming parser on bundle files
+        (defaults to every bundle in ../fhir).
+
+    python benchmark_ingest.py --suite [--scales 100,1000,10000] [--save results.json]
+                               [--baseline results.json] [--tolerance 0.2]
+        Time FHIRIngester.process_fhir_data, flatten_patient_data and
+        index_patient_data on synthetic bundles of several sizes and report
+        throughput and peak memory. Indexing writes to a temporary vector
+        directory with the embedding cache disabled, so the suite neither
+        touches ./patient_vectors nor fills (or is sped up by) the real cache. With --baseline, exits non-zero when a
+        stage is slower or uses more memory than the baseline allows.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from generate_fhir import generate_bundle
+from ingester import FHIRIngester, extract_patient_data
+
+# embed.py needs chromadb; the suite skips the embedding stages without it
+try:
+    import embed
+    from embed import delete_patient_vectors, flatten_patient_data, index_patient_data
+    EMBED_AVAILABLE = True
+except ImportError as e:
+    print(f"Warning: Embed functions not available, skipping flatten/index stages: {e}")
+    EMBED_AVAILABLE = False
+
+def measure(func: Callable[[], Any]) -> Tuple[Any, float, int]:
+    """Run func once and return (result, elapsed seconds, peak traced bytes)"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        result = func()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+def normalize(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Make extraction output comparable regardless of set ordering"""
+    return {k: sorted(map(str, v)) if isinstance(v, list) else v for k, v in data.items()}
+
+def benchmark_file(file_path: str) -> List[Dict[str, Any]]:
+    """Benchmark both ingestion modes on a single bundle file"""
+    size_mb = os.path.getsize(file_path) / (1024 * 1024)
+    rows = []
+    outputs = {}
+    for mode, streaming in (("json.load", False), ("streaming", True)):
+        result, elapsed, peak = measure(lambda: extract_patient_data(file_path, streaming=streaming))
+        outputs[mode] = result
+        rows.append({
+            "file": os.path.basename(file_path),
+            "mode": mode,
+            "size_mb": size_mb,
+            "seconds": elapsed,
+            "mb_per_s": size_mb / elapsed if elapsed else float("inf"),
+            "peak_mb": peak / (1024 * 1024),
+        })
+    if normalize(outputs["json.load"]) != normalize(outputs["streaming"]):
+        print(f"WARNING: streaming output differs from json.load output for {file_path}")
+    return rows
+
+def print_report(rows: List[Dict[str, Any]]) -> None:
+    print(f"\n{'file':<40} {'mode':<10} {'size MB':>9} {'time s':>8} {'MB/s':>8} {'peak MB':>9}")
+    print("-" * 89)
+    for row in rows:
+        print(
+            f"{row['file'][:40]:<40} {row['mode']:<10} {row['size_mb']:>9.1f} "
+            f"{row['seconds']:>8.2f} {row['mb_per_s']:>8.1f} {row['peak_mb']:>9.1f}"
+        )
+
+def run_stage(func: Callable[[], Any], units: int, setup: Optional[Callable[[], None]] = None) -> Dict[str, float]:
+    """Time func without tracing, then run it again under tracemalloc for peak memory"""
+    if setup:
+        setup()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    if setup:
+        setup()
+    _, _, peak = measure(func)
+    return {
+        "units": units,
+        "seconds": elapsed,
+        "per_s": units / elapsed if elapsed else float("inf"),
+        "peak_mb": peak / (1024 * 1024),
+    }
+
+@contextmanager
+def isolated_vector_storage(embedding_cache: bool = False):
+    """
+    Index into a temporary directory, leaving ./patient_vectors and the persistent
+    embedding cache untouched
+
+    Args:
+        embedding_cache: Use a fresh embedding cache inside the temporary directory
+            instead of disabling the cache
+    """
+    cwd = os.getcwd()
+    cache, capacity, cache_dir = embed._embedding_cache, embed.EMBEDDING_CACHE_CAPACITY, embed.EMBEDDING_CACHE_DIR
+    with tempfile.TemporaryDirectory() as path:
+        # Vector paths are relative to the working directory (./patient_vectors)
+        os.chdir(path)
+        embed._embedding_cache = None
+        if embedding_cache:
+            embed.EMBEDDING_CACHE_DIR = os.path.join(path, "embedding_cache")
+        else:
+            embed.EMBEDDING_CACHE_CAPACITY = 0
+        try:
+            yield
+        finally:
+            if embed._embedding_cache is not None:
+                embed._embedding_cache.close()
+            embed._embedding_cache = cache
+            embed.EMBEDDING_CACHE_CAPACITY, embed.EMBEDDING_CACHE_DIR = capacity, cache_dir
+            os.chdir(cwd)
+
+def run_suite(scales: List[int], seed: int = 0) -> Dict[str, Dict[str, float]]:
+    """Benchmark every ingest stage at each scale (clinical resources per bundle)"""
+    results: Dict[str, Dict[str, float]] = {}
+    ingester = FHIRIngester()
+    for scale in scales:
+        print(f"Benchmarking scale {scale} resources...")
+        bundle = generate_bundle(random.Random(seed), scale)
+        resources = len(bundle["entry"])
+        
+        results[f"process_fhir_data@{scale}"] = run_stage(lambda: ingester.process_fhir_data(bundle), resources)
+        if not EMBED_AVAILABLE:
+            continue
+        
+        simplified = ingester.process_fhir_data(bundle)
+        chunks = len(flatten_patient_data(simplified, "benchmark"))
+        results[f"flatten_patient_data@{scale}"] = run_stage(
+            lambda: flatten_patient_data(simplified, "benchmark"), chunks)
+        
+        patient_id = f"benchmark_{scale}"
+        clear_index = lambda: delete_patient_vectors(patient_id)
+        with isolated_vector_storage():
+            results[f"index_patient_data@{scale}"] = run_stage(
+                lambda: index_patient_data(simplified, patient_id), chunks, setup=clear_index)
+            clear_index()
+    return results
+
+def print_suite_report(results: Dict[str, Dict[str, float]]) -> None:
+    print(f"\n{'stage':<34} {'units':>8} {'time s':>8} {'units/s':>11} {'peak MB':>9}")
+    print("-" * 74)
+    for name, row in results.items():
+        print(f"{name:<34} {row['units']:>8} {row['seconds']:>8.3f} {row['per_s']:>11.1f} {row['peak_mb']:>9.1f}")
+
+def compare_to_baseline(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                        tolerance: float) -> List[str]:
+    """Return a description of every stage that regressed beyond tolerance"""
+    regressions = []
+    for name, row in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if row["per_s"] < base["per_s"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {row['per_s']:.1f}/s vs baseline {base['per_s']:.1f}/s")
+        if row["peak_mb"] > base["peak_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak memory {row['peak_mb']:.1f} MB vs baseline {base['peak_mb']:.1f} MB")
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark FHIR ingestion")
+    parser.add_argument("files", nargs="*", help="bundle files to compare json.load vs streaming on")
+    parser.add_argument("--suite", action="store_true", help="run the synthetic multi-scale ingest suite")
+    parser.add_argument("--scales", default="100,1000,10000", help="resources per bundle, comma separated")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write suite results to this JSON file")
+    parser.add_argument("--baseline", help="compare suite results against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    if args.suite:
+        results = run_suite([int(s) for s in args.scales.split(",")], seed=args.seed)
+        print_suite_report(results)
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"\nResults saved to {args.save}")
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+            if regressions:
+                print("\nREGRESSIONS:")
+                for regression in regressions:
+                    print(f"  - {regression}")
+                sys.exit(1)
+            print("\nNo regressions against baseline.")
+        return
+
+    files = args.files
+    if not files:
+        fhir_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "fhir"))
+        if os.path.isdir(fhir_dir):
+            files = sorted(os.path.join(fhir_dir, f) for f in os.listdir(fhir_dir) if f.endswith(".json"))
+    if not files:
+        parser.print_usage()
+        return
+
+    rows = []
+    for file_path in files:
+        print(f"Benchmarking {file_path}...")
+        rows.extend(benchmark_file(file_path))
+    print_report(rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Retrieval backend benchmark: Chroma collection query vs in-memory NumPy exact search
+
+Usage:
+    python benchmark_search.py [--scales 50,250,1000] [--k 5] [--repeats 20]
+
+Indexes one synthetic patient per scale (clinical resources per bundle) into a
+temporary vector directory, without the persistent embedding cache, then times
+retrieval with precomputed query embeddings on both backends, with and
+without a type filter, and reports how often their top-k agree.
+"""
+
+import argparse
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from benchmark_vectors import QUERIES
+from benchmark_ingest import isolated_vector_storage
+from embed import embed_texts, index_patient_data
+from generate_fhir import generate_bundle
+from ingester import FHIRIngester
+from search import get_patient_db_collection, get_patient_numpy_index
+
+def time_queries(run: Callable[[List[float]], List[str]], queries: List[List[float]],
+                 repeats: int) -> Dict[str, Any]:
+    """Per-query latencies in ms and the ids returned for each query"""
+    latencies = []
+    found = []
+    for _ in range(repeats):
+        found = []
+        for query in queries:
+            start = time.perf_counter()
+            found.append(run(query))
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "median_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "found": found,
+    }
+
+def overlap(a: List[List[str]], b: List[List[str]]) -> float:
+    total = sum(max(len(x), len(y)) for x, y in zip(a, b))
+    return sum(len(set(x) & set(y)) for x, y in zip(a, b)) / total if total else 1.0
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Chroma vs NumPy retrieval")
+    parser.add_argument("--scales", default="50,250,1000", help="resources per synthetic patient, comma separated")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--filter-type", default="observations", help="type used for the filtered runs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Index into a temporary directory with the persistent embedding cache disabled
+    with isolated_vector_storage():
+        queries = embed_texts(QUERIES)
+        ingester = FHIRIngester()
+        rows = []
+        for scale in (int(s) for s in args.scales.split(",")):
+            patient_id = f"benchmark_search_{scale}"
+            data = ingester.process_fhir_data(generate_bundle(random.Random(args.seed), scale))
+            index_patient_data(data, patient_id)
+            collection = get_patient_db_collection(patient_id)
+
+            start = time.perf_counter()
+            index = get_patient_numpy_index(patient_id)
+            load_ms = (time.perf_counter() - start) * 1000
+
+            for filter_type in (None, args.filter_type):
+                where = {"type": filter_type} if filter_type else None
+                chroma = time_queries(
+                    lambda q: collection.query(query_embeddings=[q], n_results=args.k, where=where)["ids"][0],
+                    queries, args.repeats)
+                numpy_run = time_queries(
+                    lambda q: index.query(q, args.k, filter_type)["ids"][0],
+                    queries, args.repeats)
+                rows.append({
+                    "chunks": len(index),
+                    "filter": filter_type or "-",
+                    "chroma_ms": chroma["median_ms"],
+                    "chroma_p95": chroma["p95_ms"],
+                    "numpy_ms": numpy_run["median_ms"],
+                    "numpy_p95": numpy_run["p95_ms"],
+                    "load_ms": load_ms,
+                    "agreement": overlap(chroma["found"], numpy_run["found"]),
+                })
+
+    print(f"\n{'chunks':>7} {'filter':<13} {'chroma ms':>10} {'p95':>7} {'numpy ms':>9} {'p95':>7} "
+          f"{'speedup':>8} {'load ms':>8} {'agree':>6}")
+    print("-" * 84)
+    for row in rows:
+        speedup = row["chroma_ms"] / row["numpy_ms"] if row["numpy_ms"] else float("inf")
+        print(f"{row['chunks']:>7} {row['filter']:<13} {row['chroma_ms']:>10.3f} {row['chroma_p95']:>7.3f} "
+              f"{row['numpy_ms']:>9.3f} {row['numpy_p95']:>7.3f} {speedup:>7.1f}x {row['load_ms']:>8.1f} "
+              f"{row['agreement']:>6.2f}")
+    print("\nagree: top-k overlap between backends (NumPy is exact; HNSW is approximate).")
+    print("load ms: one-off cost of building the NumPy index; it is pooled afterwards.")
+
+if __name__ == "__main__":
+    main()
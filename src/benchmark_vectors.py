@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Vector storage benchmark: ChromaDB float32 vs int8 QuantizedStore
+
+Usage:
+    python benchmark_vectors.py [--patients 20] [--resources 500] [--dims 0,128,64] [--k 5]
+
+Embeds chunks of synthetic patients, stores them in a ChromaDB collection and in
+int8 stores (optionally PCA-reduced), and reports bytes scanned per vector,
+on-disk size, query latency and recall@k against exact float32 search.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmark_ingest import isolated_vector_storage
+from embed import embed_texts, flatten_patient_data, get_patient_collection, write_patient_chunks
+from generate_fhir import generate_bundle
+from ingester import FHIRIngester
+from patient_db_utils import VECTOR_STORE_LAYOUT, get_patient_db_path, get_patient_shard, get_shard_db_path
+from quantized_store import QuantizedStore
+
+QUERIES = [
+    "blood pressure",
+    "heart rate",
+    "diabetes",
+    "hypertension medication",
+    "allergy to penicillin",
+    "body mass index",
+    "cholesterol levels",
+    "vaccinations received",
+    "recent emergency visit",
+    "chronic kidney disease",
+    "anemia",
+    "pain medication",
+    "respiratory infection",
+    "surgical procedures",
+    "hemoglobin a1c",
+    "smoking status",
+]
+
+def directory_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+def build_corpus(patients: int, resources: int, seed: int) -> List[Dict]:
+    """Distinct chunks of synthetic patients"""
+    rng = random.Random(seed)
+    ingester = FHIRIngester()
+    chunks = {}
+    for i in range(patients):
+        data = ingester.process_fhir_data(generate_bundle(rng, resources))
+        for chunk in flatten_patient_data(data, "benchmark_vectors"):
+            chunks.setdefault(chunk["id"], chunk)
+    return list(chunks.values())
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> List[List[int]]:
+    distances = (np.square(vectors).sum(axis=1)[None, :] - 2.0 * queries @ vectors.T)
+    return [list(np.argsort(row, kind="stable")[:k]) for row in distances]
+
+def recall(expected: List[List[int]], found: List[List[int]]) -> float:
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return hits / sum(len(e) for e in expected)
+
+def timed_queries(store, queries: np.ndarray, k: int, **kwargs):
+    start = time.perf_counter()
+    results = [store.query(query_embeddings=[q.tolist()], n_results=k, **kwargs)["ids"][0] for q in queries]
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark int8 vector storage against ChromaDB")
+    parser.add_argument("--patients", type=int, default=20)
+    parser.add_argument("--resources", type=int, default=500, help="clinical resources per patient")
+    parser.add_argument("--dims", default="0,128,64", help="PCA dimensions to test (0 = no reduction)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Vectors are written under a temporary directory, with an embedding cache of its
+    # own that the +rescore runs read float32 vectors back from
+    with isolated_vector_storage(embedding_cache=True):
+        chunks = build_corpus(args.patients, args.resources, args.seed)
+        print(f"Embedding {len(chunks)} distinct chunks and {len(QUERIES)} queries...")
+        vectors = np.asarray(embed_texts([c["text"] for c in chunks]), dtype=np.float32)
+        queries = np.asarray(embed_texts(QUERIES), dtype=np.float32)
+        ids = [c["id"] for c in chunks]
+        index_of = {item_id: i for i, item_id in enumerate(ids)}
+        expected = exact_top_k(vectors, queries, args.k)
+        rows = []
+
+        # Baseline: ChromaDB collection with float32 vectors
+        patient_id = "benchmark_vectors"
+        if VECTOR_STORE_LAYOUT == "sharded":
+            chroma_path = get_shard_db_path(get_patient_shard(patient_id))
+        else:
+            chroma_path = get_patient_db_path(patient_id)
+        collection = get_patient_collection(patient_id, "chroma")
+        write_patient_chunks(collection, chunks, vectors.tolist())
+        found, latency = timed_queries(collection, queries, args.k)
+        rows.append({
+            "store": "chroma float32",
+            "scan_bytes": vectors.shape[1] * 4,
+            "disk_mb": directory_bytes(chroma_path) / (1024 * 1024),
+            "latency_ms": latency,
+            "recall": recall(expected, [[index_of[i] for i in r] for r in found]),
+        })
+
+        for dims in (int(d) for d in args.dims.split(",")):
+            with tempfile.TemporaryDirectory() as path:
+                store = QuantizedStore(path, dimensions=dims, rescore_fn=embed_texts)
+                store.upsert(ids, vectors.tolist(), [c["text"] for c in chunks],
+                             [{"type": c["type"]} for c in chunks])
+                scan_bytes = store.dim + 8  # int8 codes + float32 scale and norm
+                label = f"int8 d={store.dim}"
+                for rescore in (False, True):
+                    found, latency = timed_queries(store, queries, args.k, rescore=rescore)
+                    rows.append({
+                        "store": label + (" +rescore" if rescore else ""),
+                        "scan_bytes": scan_bytes,
+                        "disk_mb": store.disk_bytes() / (1024 * 1024),
+                        "latency_ms": latency,
+                        "recall": recall(expected, [[index_of[i] for i in r] for r in found]),
+                    })
+
+    print(f"\n{'store':<24} {'scan B/vec':>10} {'disk MB':>9} {'query ms':>9} {'recall@' + str(args.k):>9}")
+    print("-" * 65)
+    for row in rows:
+        print(f"{row['store']:<24} {row['scan_bytes']:>10} {row['disk_mb']:>9.2f} "
+              f"{row['latency_ms']:>9.2f} {row['recall']:>9.3f}")
+    print("\nscan B/vec: bytes read per vector by a full scan (the part that must stay in page cache);")
+    print("+rescore: candidates rescored with float32 vectors from the shared embedding cache (not stored per patient).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Cross-patient cohort search ("which patients mention X")
+
+The query is embedded once and fanned out over every patient store with a
+bounded thread pool. Each store returns its best chunks, patients are ranked by
+their best chunk, and a size-k min-heap keeps the global top-k as stores finish,
+so partial rankings can be streamed long before the whole panel is scanned.
+
+In the per_patient layout the unit of work is one patient database; in the
+sharded layout it is one shard collection, queried for its best chunks (with
+any requested patient_ids applied inside the query) and grouped by patient_id,
+widening the fetch until it covers n_results distinct patients.
+"""
+
+import heapq
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from patient_db_utils import (
+    get_embedding_function, get_patient_shard, get_shard_db_path, VECTOR_SHARDS, VECTOR_STORAGE, VECTOR_STORE_LAYOUT
+)
+from search import format_search_results, get_collection_pool, get_query_embedding, open_patient_db_collection
+
+load_dotenv()
+VECTOR_DB_BASE_DIR = "./patient_vectors"
+# Stores searched concurrently by one cohort search
+COHORT_SEARCH_WORKERS = int(os.getenv("COHORT_SEARCH_WORKERS", "8"))
+# Minimum seconds between streamed partial rankings
+COHORT_PARTIAL_INTERVAL = float(os.getenv("COHORT_PARTIAL_INTERVAL", "0.5"))
+
+def list_indexed_patients() -> List[str]:
+    """Patient IDs with a vector database in the per_patient layout"""
+    base_dir = Path(VECTOR_DB_BASE_DIR)
+    if not base_dir.exists():
+        return []
+    return sorted(d.name[len("patient_"):] for d in base_dir.iterdir() if d.is_dir() and d.name.startswith("patient_"))
+
+def _search_patient(patient_id: str, query_embedding: List[float], hits_per_patient: int,
+                    filter_type: Optional[str], storage: str) -> Dict[str, List[Dict[str, Any]]]:
+    # Reuse a pooled collection but never add to the pool: a panel scan would evict every hot patient
+    collection = get_collection_pool().peek((patient_id, storage, VECTOR_STORE_LAYOUT))
+    if collection is None:
+        collection = open_patient_db_collection(patient_id, storage)
+    if collection is None:
+        return {}
+    results = collection.query(
+        query_embeddings=[query_embedding],
+        n_results=hits_per_patient,
+        where={"type": filter_type} if filter_type else None
+    )
+    hits = format_search_results(results)
+    return {patient_id: hits} if hits else {}
+
+def _search_shard(shard: int, query_embedding: List[float], n_patients: int, hits_per_patient: int,
+                  filter_type: Optional[str], patient_ids: Optional[List[str]]) -> Dict[str, List[Dict[str, Any]]]:
+    from sharded_store import get_shard_collection
+    if patient_ids is not None:
+        # Only the requested patients stored in this shard, filtered inside the query
+        patient_ids = sorted(p for p in patient_ids if get_patient_shard(p) == shard)
+        if not patient_ids:
+            return {}
+        n_patients = min(n_patients, len(patient_ids))
+    collection = get_shard_collection(shard, get_embedding_function(), create=False)
+    if collection is None:
+        return {}
+    clauses = []
+    if filter_type:
+        clauses.append({"type": filter_type})
+    if patient_ids is not None:
+        clauses.append({"patient_id": {"$in": patient_ids}})
+    where = clauses[0] if len(clauses) == 1 else ({"$and": clauses} if clauses else None)
+    # Matching chunks are not counted up front (that fetches every id); a filtered
+    # query that returns fewer hits than requested has exhausted the shard
+    available = collection.count()
+    if not available:
+        return {}
+
+    # A few patients can fill the top chunks: widen the fetch until it covers
+    # n_patients distinct patients or the shard is exhausted
+    fetch = n_patients * hits_per_patient
+    while True:
+        requested = min(fetch, available)
+        results = collection.query(query_embeddings=[query_embedding], n_results=requested, where=where)
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for hit in format_search_results(results):
+            patient_id = hit["metadata"].get("patient_id")
+            if patient_id is None:
+                continue
+            hits = grouped.setdefault(patient_id, [])
+            if len(hits) < hits_per_patient:
+                hits.append(hit)
+        exhausted = requested >= available or len(results["ids"][0]) < requested
+        if len(grouped) >= n_patients or exhausted:
+            return grouped
+        fetch *= 2
+
+def _ranking(heap: List[tuple]) -> List[Dict[str, Any]]:
+    return [
+        {"patient_id": patient_id, "score": score, "hits": hits}
+        for score, patient_id, hits in sorted(heap, key=lambda entry: (-entry[0], entry[1]))
+    ]
+
+def cohort_search_iter(query: str, n_results: int = 10, hits_per_patient: int = 3,
+                       filter_type: Optional[str] = None, patient_ids: Optional[List[str]] = None,
+                       storage: Optional[str] = None,
+                       workers: int = COHORT_SEARCH_WORKERS) -> Iterator[Dict[str, Any]]:
+    """
+    Search every patient store for query and yield the ranking as it builds up
+
+    Args:
+        query: The search query
+        n_results: Number of patients to return
+        hits_per_patient: Best chunks returned per patient
+        filter_type: Filter by data type (e.g., 'conditions', 'medications')
+        patient_ids: Restrict the search to these patients (default: all indexed patients)
+        storage: "chroma" or "int8" (per_patient layout only); defaults to VECTOR_STORAGE
+        workers: Stores searched concurrently
+
+    Yields:
+        {"event": "partial", ...} events with the current top-k while stores are being
+        searched (at most one per COHORT_PARTIAL_INTERVAL), then one {"event": "done", ...}
+        event with the final top-k. Patients are ranked by the relevance of their best chunk.
+    """
+    start = time.perf_counter()
+    storage = storage or VECTOR_STORAGE
+    query_embedding = get_query_embedding(query)
+
+    if VECTOR_STORE_LAYOUT == "sharded":
+        wanted = list(dict.fromkeys(patient_ids)) if patient_ids else None
+        shards = {get_patient_shard(p) for p in wanted} if wanted else range(VECTOR_SHARDS)
+        units = [shard for shard in sorted(shards) if os.path.exists(get_shard_db_path(shard))]
+        search_unit = lambda shard: _search_shard(shard, query_embedding, n_results,
+                                                  hits_per_patient, filter_type, wanted)
+    else:
+        units = list(dict.fromkeys(patient_ids)) if patient_ids else list_indexed_patients()
+        search_unit = lambda patient_id: _search_patient(patient_id, query_embedding, hits_per_patient,
+                                                         filter_type, storage)
+
+    # Min-heap of (best relevance, patient_id, hits) holding the current top-k patients
+    heap: List[tuple] = []
+    matched = set()
+    completed = 0
+    failed = []
+    last_partial = time.perf_counter()
+    changed = False
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = {executor.submit(search_unit, unit): unit for unit in units}
+        for future in as_completed(futures):
+            completed += 1
+            try:
+                found = future.result()
+            except Exception as e:
+                print(f"Error in cohort search of {futures[future]}: {e}")
+                failed.append(str(futures[future]))
+                found = {}
+            for patient_id, hits in found.items():
+                matched.add(patient_id)
+                entry = (hits[0]["relevance"], patient_id, hits)
+                if len(heap) < n_results:
+                    heapq.heappush(heap, entry)
+                    changed = True
+                elif entry[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, entry)
+                    changed = True
+
+            now = time.perf_counter()
+            if changed and completed < len(units) and now - last_partial >= COHORT_PARTIAL_INTERVAL:
+                last_partial = now
+                changed = False
+                yield {
+                    "event": "partial",
+                    "completed": completed,
+                    "total": len(units),
+                    "results": _ranking(heap),
+                    "elapsed_ms": round((now - start) * 1000, 2)
+                }
+    finally:
+        # A consumer that stops early (e.g. a disconnected stream) must not wait for the whole panel
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    yield {
+        "event": "done",
+        "query": query,
+        "completed": completed,
+        "total": len(units),
+        "failed": failed,
+        # Requested patients without any matching chunk (not indexed, or nothing of filter_type)
+        "unmatched_patients": [p for p in dict.fromkeys(patient_ids) if p not in matched] if patient_ids else [],
+        "results": _ranking(heap),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+
+def cohort_search(query: str, n_results: int = 10, hits_per_patient: int = 3,
+                  filter_type: Optional[str] = None, patient_ids: Optional[List[str]] = None,
+                  storage: Optional[str] = None) -> Dict[str, Any]:
+    """Run a cohort search to completion and return the final event (see cohort_search_iter)"""
+    final: Dict[str, Any] = {}
+    for final in cohort_search_iter(query, n_results, hits_per_patient, filter_type, patient_ids, storage):
+        pass
+    return final
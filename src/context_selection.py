@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Context selection between retrieval and prompt building
+
+Search returns a fixed number of chunks, and many are near-duplicates (several
+readings of the same vital sign) or barely related to the query. Before the
+chunks are pasted into the prompt, select_context:
+
+1. drops chunks below a relevance cutoff (disabled by default),
+2. orders the rest by maximal marginal relevance (MMR), dropping chunks that
+   nearly repeat one already selected, and
+3. stops adding chunks once an estimated token budget is spent.
+
+Similarity between chunks uses embeddings when an embedding function is given
+(embed.embed_texts serves indexed chunk texts from the embedding cache), and
+token overlap with numbers ignored otherwise.
+"""
+
+import math
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# Apply context selection in the copilot route
+CONTEXT_SELECTION = os.getenv("CONTEXT_SELECTION", "true").lower() == "true"
+# Chunks below these relevances are dropped (the best chunk is always kept). The two
+# retrieval modes score on different scales, so each has its own cutoff: vector
+# relevance is 1 - squared L2 distance = 2 * cosine - 1 (0.0 already drops every
+# chunk with cosine below 0.5), hybrid relevance is a fused score in [0, 1] that is
+# min-max normalized per query. Both are disabled unless calibrated and set.
+CONTEXT_MIN_RELEVANCE = float(os.getenv("CONTEXT_MIN_RELEVANCE", "-inf"))
+CONTEXT_MIN_HYBRID_RELEVANCE = float(os.getenv("CONTEXT_MIN_HYBRID_RELEVANCE", "-inf"))
+# MMR trade-off: 1.0 ranks by relevance only, lower values favour diversity
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Chunks at least this similar to a selected chunk are dropped as duplicates
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.9"))
+# Estimated prompt tokens available for context chunks
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Candidates retrieved per context chunk finally wanted
+CONTEXT_CANDIDATE_FACTOR = 2
+
+# Per-chunk formatting overhead in the prompt ("  1. ... (relevance: 0.87)")
+_LINE_OVERHEAD_TOKENS = 8
+_WORD_RE = re.compile(r"[a-z]+")
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return math.ceil(len(text) / 4) + _LINE_OVERHEAD_TOKENS
+
+def _word_set(text: str) -> frozenset:
+    # Numbers are ignored so readings of the same measurement count as duplicates
+    return frozenset(_WORD_RE.findall(text.lower()))
+
+def jaccard_similarity(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def cosine_similarity(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def select_context(results: List[Dict[str, Any]], max_results: Optional[int] = None,
+                   min_relevance: Optional[float] = None, mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+                   duplicate_similarity: float = CONTEXT_DUPLICATE_SIMILARITY,
+                   token_budget: int = CONTEXT_TOKEN_BUDGET,
+                   embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None
+                   ) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Pick the context chunks to send to the model
+
+    Args:
+        results: Search results with "text" and "relevance"
+        max_results: Maximum number of chunks to select (default: no limit)
+        min_relevance: Relevance cutoff (default: CONTEXT_MIN_HYBRID_RELEVANCE for hybrid
+            results, which carry a "match" field, else CONTEXT_MIN_RELEVANCE)
+        mmr_lambda: Weight of relevance against dissimilarity to selected chunks
+        duplicate_similarity: Similarity at which a chunk counts as a near-duplicate
+        token_budget: Estimated tokens the selected chunks may use
+        embed_fn: Optional function embedding a list of texts; token overlap is used without it
+
+    Returns:
+        (selected results in selection order, counts of candidates, selected chunks,
+        chunks dropped by each stage and estimated tokens used)
+    """
+    stats = {"candidates": len(results), "selected": 0, "below_threshold": 0,
+             "duplicates": 0, "over_budget": 0, "estimated_tokens": 0}
+    if not results:
+        return [], stats
+
+    if min_relevance is None:
+        hybrid = any("match" in r for r in results)
+        min_relevance = CONTEXT_MIN_HYBRID_RELEVANCE if hybrid else CONTEXT_MIN_RELEVANCE
+    ranked = sorted(results, key=lambda r: r.get("relevance", 0), reverse=True)
+    candidates = [r for r in ranked[1:] if r.get("relevance", 0) >= min_relevance]
+    candidates.insert(0, ranked[0])
+    stats["below_threshold"] = len(ranked) - len(candidates)
+
+    if embed_fn is not None:
+        vectors = embed_fn([r["text"] for r in candidates])
+        similarity = lambda i, j: cosine_similarity(vectors[i], vectors[j])
+    else:
+        words = [_word_set(r["text"]) for r in candidates]
+        similarity = lambda i, j: jaccard_similarity(words[i], words[j])
+
+    selected: List[int] = []
+    # Highest similarity of each remaining candidate to any selected chunk
+    max_similarity = {i: 0.0 for i in range(len(candidates))}
+    used_tokens = 0
+    while max_similarity and (max_results is None or len(selected) < max_results):
+        best = max(max_similarity, key=lambda i: (
+            mmr_lambda * candidates[i].get("relevance", 0) - (1 - mmr_lambda) * max_similarity[i], -i))
+        del max_similarity[best]
+
+        tokens = estimate_tokens(candidates[best]["text"])
+        if used_tokens + tokens > token_budget and selected:
+            stats["over_budget"] += 1
+            continue
+        selected.append(best)
+        used_tokens += tokens
+
+        for i in list(max_similarity):
+            max_similarity[i] = max(max_similarity[i], similarity(i, best))
+            if max_similarity[i] >= duplicate_similarity:
+                del max_similarity[i]
+                stats["duplicates"] += 1
+
+    stats["selected"] = len(selected)
+    stats["estimated_tokens"] = used_tokens
+    return [candidates[i] for i in selected], stats
@@ -1,9 +1,11 @@
 # embed_patient_data.py
+import hashlib
 import json
+import shutil
 import sys
 import uuid
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Callable, Dict, List, Any
 import chromadb
 from chromadb.utils import embedding_functions
 import os
@@ -12,44 +14,210 @@ from dotenv import load_dotenv
 # --- CONFIG ---
 load_dotenv()
 VECTOR_DB_BASE_DIR = "./patient_vectors"
+# Model behind chromadb's DefaultEmbeddingFunction
+EMBEDDING_MODEL_ID = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./embedding_cache")
+# Max cached embeddings; 0 disables the cache
+EMBEDDING_CACHE_CAPACITY = int(os.getenv("EMBEDDING_CACHE_CAPACITY", "200000"))
+# Chunks embedded per step when reporting indexing progress
+PROGRESS_BATCH_SIZE = 256
+# Fold repeated measurements of an observation code into one summary chunk
+COALESCE_OBSERVATIONS = os.getenv("COALESCE_OBSERVATIONS", "false").lower() == "true"
 
 # Import shared utilities
-from patient_db_utils import get_patient_collection_name, get_patient_db_path
+from patient_db_utils import (
+    get_patient_collection_name, get_patient_db_path, get_embedding_function, get_lexical_index_path,
+    notify_patient_updated, VECTOR_STORAGE, QUANTIZED_DIMENSIONS, VECTOR_STORE_LAYOUT, VECTOR_TYPE_PARTITIONS
+)
+from embedding_cache import EmbeddingCache
+from lexical_index import LexicalIndex
+from observation_store import ObservationTable
 
-def get_patient_collection(patient_id: str):
-    """Get or create a ChromaDB collection for a specific patient"""
+_embedding_cache = None
+
+def get_embedding_cache():
+    """Return the process-wide persistent embedding cache, or None if disabled"""
+    global _embedding_cache
+    if _embedding_cache is None and EMBEDDING_CACHE_CAPACITY > 0:
+        _embedding_cache = EmbeddingCache(
+            os.path.join(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_ID),
+            EMBEDDING_MODEL_ID,
+            capacity=EMBEDDING_CACHE_CAPACITY
+        )
+    return _embedding_cache
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """
+    Embed texts, computing only those missing from the persistent embedding cache
+    
+    Args:
+        texts: Texts to embed
+        
+    Returns:
+        One embedding per text, in order
+    """
+    if not texts:
+        return []
+    cache = get_embedding_cache()
+    if cache is None:
+        return [list(map(float, e)) for e in get_embedding_function()(list(texts))]
+    
+    embeddings = cache.get_many(texts)
+    misses = list(dict.fromkeys(t for t, e in zip(texts, embeddings) if e is None))
+    if misses:
+        computed = dict(zip(misses, get_embedding_function()(misses)))
+        cache.put_many(misses, [computed[t] for t in misses])
+        embeddings = [computed[t] if e is None else e for t, e in zip(texts, embeddings)]
+    return [list(map(float, e)) for e in embeddings]
+
+def get_patient_collection(patient_id: str, storage: str = None):
+    """
+    Get or create a ChromaDB collection for a specific patient
+    
+    Args:
+        patient_id: Patient identifier
+        storage: "chroma" or "int8" (a QuantizedStore); defaults to VECTOR_STORAGE
+        
+    With VECTOR_STORE_LAYOUT=sharded, returns the patient's view of their shard
+    collection instead (chroma storage only).
+    """
+    storage = storage or VECTOR_STORAGE
+    if VECTOR_STORE_LAYOUT == "sharded":
+        if storage != "chroma":
+            raise ValueError("The sharded vector store layout only supports chroma storage")
+        from sharded_store import get_patient_view
+        return get_patient_view(patient_id, get_embedding_function())
+    
     patient_db_path = get_patient_db_path(patient_id)
     
     # Create the patient-specific database directory
     os.makedirs(patient_db_path, exist_ok=True)
     
-    # Create patient-specific chroma client
-    chroma_client = chromadb.PersistentClient(path=patient_db_path)
+    if storage == "int8":
+        from quantized_store import QuantizedStore, QUANTIZED_DIRNAME
+        return QuantizedStore(
+            os.path.join(patient_db_path, QUANTIZED_DIRNAME),
+            embedding_function=get_embedding_function(),
+            dimensions=QUANTIZED_DIMENSIONS,
+            rescore_fn=embed_texts
+        )
+    if storage != "chroma":
+        raise ValueError(f"Unknown vector storage: {storage}")
     
     # Create a valid collection name
     collection_name = get_patient_collection_name(patient_id)
     
     print(f"Using collection name: {collection_name} for patient: {patient_id}")
     
+    if VECTOR_TYPE_PARTITIONS:
+        from partitioned_store import get_partitioned_collection
+        return get_partitioned_collection(patient_db_path, collection_name, get_embedding_function())
+    
+    # Create patient-specific chroma client
+    chroma_client = chromadb.PersistentClient(path=patient_db_path)
+    
     # Create a collection for this patient
     collection = chroma_client.get_or_create_collection(
         name=collection_name,
-        embedding_function=embedding_functions.DefaultEmbeddingFunction()
+        embedding_function=get_embedding_function()
     )
     
     return collection
 
-def flatten_patient_data(data: Dict[str, Any], patient_id: str = None) -> List[Dict[str, Any]]:
+def normalize_chunk_text(text: str) -> str:
+    """Normalize chunk text for content addressing (whitespace insensitive, case preserved)"""
+    return " ".join(str(text).split())
+
+def make_chunk_id(patient_id: str, category: str, text: str) -> str:
+    """
+    Content-addressed chunk ID: "<patient_id>_<category>_<hash>".
+    The same text in the same category always gets the same ID, so IDs survive
+    re-ingest and inserting new data does not renumber existing chunks.
+    """
+    key = f"{patient_id}|{category}|{normalize_chunk_text(text)}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return f"{patient_id}_{category}_{digest}"
+
+def _format_date(effective: str) -> str:
+    return (effective or "unknown date")[:10]
+
+def observation_series_chunks(table: ObservationTable, patient_id: str) -> List[Dict[str, Any]]:
+    """
+    Coalesced observation chunks: one summary chunk per repeatedly measured code
+    (range, latest value, trend, full series in metadata) plus one chunk per
+    remaining distinct observation.
+    """
+    series, leftovers = table.coalesce()
+    chunks = []
+    for s in series:
+        unit = f" {s['unit']}" if s["unit"] else ""
+        text = (
+            f"Observations: {s['name'] or s['code']}: {s['count']} measurements "
+            f"from {_format_date(s['first_effective'])} to {_format_date(s['latest_effective'])}, "
+            f"range {s['min']:g}-{s['max']:g}{unit}, "
+            f"latest {s['latest']:g}{unit} on {_format_date(s['latest_effective'])}, "
+            f"trend {s['trend']}"
+        )
+        chunks.append({
+            "text": text,
+            "type": "observations",
+            # Keyed by code and unit so new measurements update the chunk in place
+            "id": make_chunk_id(patient_id, "observations", f"series|{s['code']}|{s['unit']}"),
+            "patient_id": patient_id,
+            "metadata": {
+                "code": s["code"] or "",
+                "unit": s["unit"] or "",
+                "count": s["count"],
+                "latest_effective": s["latest_effective"] or "",
+                "series": json.dumps(s["points"], separators=(",", ":")),
+            },
+        })
+    
+    texts = set()
+    for i in leftovers:
+        value = table.display_value(i)
+        name = table.name[i] or table.code[i]
+        texts.add(f"Observations: {name}: {value}" if value else f"Observations: {name}")
+    for text in sorted(texts):
+        chunks.append({
+            "text": text,
+            "type": "observations",
+            "id": make_chunk_id(patient_id, "observations", text),
+            "patient_id": patient_id
+        })
+    return chunks
+
+def delete_patient_vectors(patient_id: str) -> None:
+    """Remove all stored vectors of a patient, whatever the store layout"""
+    if VECTOR_STORE_LAYOUT == "sharded":
+        get_patient_collection(patient_id).delete()
+    else:
+        shutil.rmtree(get_patient_db_path(patient_id), ignore_errors=True)
+    lexical_path = get_lexical_index_path(patient_id)
+    if os.path.exists(lexical_path):
+        os.remove(lexical_path)
+    notify_patient_updated(patient_id)
+
+def flatten_patient_data(data: Dict[str, Any], patient_id: str = None,
+                         coalesce_observations: bool = None) -> List[Dict[str, Any]]:
     """
     Convert the patient JSON data into small text chunks for vector embedding.
     Each chunk represents a meaningful piece of patient information.
     
+    Chunk IDs are derived from the chunk content (see make_chunk_id); duplicate
+    chunks are dropped and chunks are ordered by text within each category.
+    
     Args:
         data: Patient data dictionary
         patient_id: Optional patient identifier to include in metadata
+        coalesce_observations: Build observation chunks from the observation table,
+            one summary chunk per repeatedly measured code (defaults to
+            COALESCE_OBSERVATIONS; ignored for data without an observation table)
     """
+    if coalesce_observations is None:
+        coalesce_observations = COALESCE_OBSERVATIONS
     chunks: List[Dict[str, Any]] = []
-    chunk_id = 0  # Counter to generate unique IDs
+    seen_ids = set()
     
     # Determine patient ID from data if not provided
     if not patient_id:
@@ -59,34 +227,30 @@ def flatten_patient_data(data: Dict[str, Any], patient_id: str = None) -> List[D
         else:
             patient_id = "unknown"
     
+    def add_chunks(key: str, texts: List[str]):
+        for text in sorted(texts):
+            chunk_id = make_chunk_id(patient_id, key, text)
+            if chunk_id in seen_ids:
+                continue
+            seen_ids.add(chunk_id)
+            chunks.append({
+                "text": text,
+                "type": key,
+                "id": chunk_id,
+                "patient_id": patient_id
+            })
+    
     # --- Process patient demographics ---
-    for p in data.get("patient", []):
-        demo_text = (
+    add_chunks("patient", [
+        (
             f"Patient: Name={p.get('name')}, "
             f"Gender={p.get('gender')}, "
             f"BirthDate={p.get('birthDate')}"
         )
-        chunks.append({
-            "text": demo_text,
-            "type": "patient",
-            "id": f"{patient_id}_patient_{chunk_id}",
-            "patient_id": patient_id
-        })
-        chunk_id += 1
+        for p in data.get("patient", [])
+    ])
 
     # --- Process lists of medical data ---
-    # Helper function to process list fields
-    def add_list_chunks(key: str, items: List):
-        nonlocal chunk_id
-        for item in items:
-            chunks.append({
-                "text": f"{key.capitalize()}: {item}",
-                "type": key,
-                "id": f"{patient_id}_{key}_{chunk_id}",
-                "patient_id": patient_id
-            })
-            chunk_id += 1
-
     # Process all medical data categories
     categories = [
         "conditions", 
@@ -101,51 +265,165 @@ def flatten_patient_data(data: Dict[str, Any], patient_id: str = None) -> List[D
         "claims_diagnoses"
     ]
     
+    table = data.get("observation_table")
     for category in categories:
-        if category in data and data[category]:
-            add_list_chunks(category, data[category])
+        if category == "observations" and coalesce_observations and table:
+            chunks.extend(observation_series_chunks(ObservationTable.from_dict(table), patient_id))
+        elif category in data and data[category]:
+            add_chunks(category, [f"{category.capitalize()}: {item}" for item in data[category]])
     
     return chunks
 
-def index_patient_data(data: Dict[str, Any], patient_id: str = None) -> None:
+def chunk_metadata(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Metadata stored alongside a chunk in the vector database"""
+    metadata = {"type": chunk["type"], "patient_id": chunk["patient_id"]}
+    metadata.update(chunk.get("metadata", {}))
+    return metadata
+
+def prepare_patient_index(data: Dict[str, Any], patient_id: str, mode: str = "upsert", storage: str = None):
     """
-    Create vector embeddings for patient data and store in patient-specific ChromaDB
+    First half of index_patient_data: flatten the patient data, diff it against the
+    patient's collection and delete removed chunks.
     
-    Args:
-        data: Patient data dictionary
-        patient_id: Patient identifier (required for patient-specific database)
+    Returns:
+        (collection, chunks that still need to be embedded and written, stats)
     """
     if not patient_id:
         raise ValueError("patient_id is required for indexing")
+    if mode not in ("upsert", "replace"):
+        raise ValueError(f"Unknown indexing mode: {mode}")
     
     # Get patient-specific collection
-    collection = get_patient_collection(patient_id)
+    collection = get_patient_collection(patient_id, storage)
     
     # Convert patient data to chunks with patient_id
     chunks = flatten_patient_data(data, patient_id)
+    stats = {"added": 0, "updated": 0, "deleted": 0, "unchanged": 0}
     
     if not chunks:
+        # Still diff below: chunks stored for data the patient no longer has must be deleted
         print("No data chunks generated. Check the format of your patient data.")
-        return
     
-    # Clear existing data for this patient (since it's their own database, clear everything)
+    if mode == "replace":
+        # Clear existing data for this patient (since it's their own database, clear everything)
+        try:
+            # Get all existing IDs and delete them
+            existing_data = collection.get(include=[])
+            if existing_data['ids']:
+                collection.delete(ids=existing_data['ids'])
+                stats["deleted"] = len(existing_data['ids'])
+                notify_patient_updated(patient_id)
+                print(f"Cleared {len(existing_data['ids'])} existing items for patient {patient_id}")
+        except Exception as e:
+            print(f"Note: Could not clear existing data for patient {patient_id}: {e}")
+        changed_chunks = chunks
+        stats["added"] = len(chunks)
+    else:
+        # Diff against what is already stored so only new or changed chunks get embedded
+        existing_data = collection.get(include=["documents", "metadatas"])
+        existing = {
+            item_id: (document, metadata)
+            for item_id, document, metadata in zip(
+                existing_data["ids"], existing_data["documents"], existing_data["metadatas"]
+            )
+        }
+        new_ids = {c["id"] for c in chunks}
+        
+        removed_ids = [item_id for item_id in existing if item_id not in new_ids]
+        if removed_ids:
+            collection.delete(ids=removed_ids)
+            stats["deleted"] = len(removed_ids)
+            notify_patient_updated(patient_id)
+        
+        changed_chunks = []
+        for c in chunks:
+            stored = existing.get(c["id"])
+            if stored is None:
+                stats["added"] += 1
+            elif stored != (c["text"], chunk_metadata(c)):
+                stats["updated"] += 1
+            else:
+                stats["unchanged"] += 1
+                continue
+            changed_chunks.append(c)
+    
+    update_lexical_index(patient_id, chunks)
+    return collection, changed_chunks, stats
+
+def update_lexical_index(patient_id: str, chunks: List[Dict[str, Any]]) -> None:
+    """Rewrite the patient's BM25 index from their full chunk list (skipped when it is unchanged)"""
+    path = get_lexical_index_path(patient_id)
+    index = LexicalIndex.from_chunks(chunks, [chunk_metadata(c) for c in chunks])
     try:
-        # Get all existing IDs and delete them
-        existing_data = collection.get()
-        if existing_data['ids']:
-            collection.delete(ids=existing_data['ids'])
-            print(f"Cleared {len(existing_data['ids'])} existing items for patient {patient_id}")
-    except Exception as e:
-        print(f"Note: Could not clear existing data for patient {patient_id}: {e}")
+        if index.same_contents(LexicalIndex.load(path)):
+            return
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Rebuilding unreadable lexical index of patient {patient_id}: {e}")
+    index.save(path)
+    notify_patient_updated(patient_id)
+
+def write_patient_chunks(collection, chunks: List[Dict[str, Any]],
+                         embeddings: List[List[float]] = None,
+                         progress: Callable[[str, float], None] = None) -> None:
+    """
+    Second half of index_patient_data: upsert chunks into a patient collection.
+    Embeddings are computed through the embedding cache unless precomputed ones are given.
     
-    # Add chunks to the patient-specific vector database
-    collection.add(
+    Args:
+        progress: Optional callback progress(stage, fraction), called as batches are embedded
+    """
+    if not chunks:
+        return
+    if embeddings is None:
+        texts = [c["text"] for c in chunks]
+        embeddings = []
+        for start in range(0, len(texts), PROGRESS_BATCH_SIZE):
+            embeddings.extend(embed_texts(texts[start:start + PROGRESS_BATCH_SIZE]))
+            if progress:
+                progress("embedding", 0.1 + 0.8 * len(embeddings) / len(texts))
+    if progress:
+        progress("writing", 0.9)
+    collection.upsert(
+        embeddings=embeddings,
         documents=[c["text"] for c in chunks],
-        metadatas=[{"type": c["type"], "patient_id": c["patient_id"]} for c in chunks],
+        metadatas=[chunk_metadata(c) for c in chunks],
         ids=[c["id"] for c in chunks]
     )
+    # Let pooled search collections and caches for this patient refresh
+    notify_patient_updated(chunks[0]["patient_id"])
+
+def index_patient_data(data: Dict[str, Any], patient_id: str = None, mode: str = "upsert",
+                       storage: str = None, progress: Callable[[str, float], None] = None) -> Dict[str, int]:
+    """
+    Create vector embeddings for patient data and store in patient-specific ChromaDB
+    
+    Args:
+        data: Patient data dictionary
+        patient_id: Patient identifier (required for patient-specific database)
+        mode: "upsert" diffs the new chunks against the stored ones and only embeds
+            new or changed chunks and deletes removed ones; "replace" clears the
+            collection and re-embeds everything
+        storage: "chroma" or "int8" (int8-quantized vectors with full-precision
+            rescoring, see quantized_store.py); defaults to VECTOR_STORAGE
+        progress: Optional callback progress(stage, fraction) for job status reporting
+            
+    Returns:
+        Counts of added, updated, deleted and unchanged chunks
+    """
+    if progress:
+        progress("diffing", 0.0)
+    collection, changed_chunks, stats = prepare_patient_index(data, patient_id, mode, storage)
+    if progress:
+        progress("embedding", 0.1)
+    
+    # Add new and changed chunks to the patient-specific vector database,
+    # embedding only texts that are not already in the embedding cache
+    write_patient_chunks(collection, changed_chunks, progress=progress)
     
-    print(f"Successfully indexed {len(chunks)} chunks for patient {patient_id} in dedicated database.")
+    print(f"Successfully indexed patient {patient_id} in dedicated database: "
+          f"{stats['added']} added, {stats['updated']} updated, "
+          f"{stats['deleted']} deleted, {stats['unchanged']} unchanged.")
+    return stats
 
 def query_examples():
     """
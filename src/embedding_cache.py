@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Persistent text -> embedding cache shared across patients
+
+Chunks such as "Respiratory rate: 13 /min" repeat across thousands of patients.
+The cache stores each distinct (model, normalized text) embedding once:
+vectors live in a fixed-width float32 file that is memory-mapped, and a small
+SQLite index maps text keys to rows. Capacity is bounded; when full, the least
+recently used rows are overwritten.
+
+One directory holds the cache of a single model. Several processes (the API
+server, rebuild_vectors.py) may share it: slots are reserved in a SQLite write
+transaction that re-reads the current entries, vectors are written only after
+their slot reservation is committed, and an entry becomes visible to readers
+once its vector is on disk.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Rows added to the vector file at a time as the cache grows
+GROWTH_ROWS = 4096
+# Max SQLite parameters per IN (...) lookup
+_LOOKUP_BATCH = 500
+# Cache hits whose recency update is buffered before being written to SQLite
+TOUCH_FLUSH_SIZE = 1024
+
+def normalize_text(text: str) -> str:
+    """Cache normalization: collapse runs of whitespace"""
+    return " ".join(str(text).split())
+
+class EmbeddingCache:
+    """Bounded LRU cache of embeddings backed by a memory-mapped float32 file"""
+
+    def __init__(self, cache_dir: str, model_id: str, capacity: int = 200000):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.model_id = model_id
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self._lock = threading.RLock()
+        self._vectors: Optional[np.memmap] = None
+        # key -> clock of hits not yet written to SQLite
+        self._touched: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+        # Autocommit mode: write transactions are opened explicitly with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite3"), check_same_thread=False,
+                                    timeout=30, isolation_level=None)
+        with self._transaction():
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, last_used INTEGER NOT NULL,"
+                " ready INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(entries)")}
+            if "ready" not in columns:
+                # Caches created before slot reservations: every stored entry is complete
+                self.conn.execute("ALTER TABLE entries ADD COLUMN ready INTEGER NOT NULL DEFAULT 1")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        if meta.get("model_id") not in (None, model_id):
+            raise ValueError(f"Embedding cache at {cache_dir} belongs to model {meta['model_id']}, not {model_id}")
+        self.dim: Optional[int] = int(meta["dim"]) if "dim" in meta else None
+        self._size = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        self._clock = self.conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM entries").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._size
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction holding SQLite's write lock (serializes writers across processes)"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def key(self, text: str) -> str:
+        """Cache key of a text for this cache's model"""
+        content = f"{self.model_id}\0{normalize_text(text)}"
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: Sequence[str], ready_only: bool = True) -> Dict[str, int]:
+        slots: Dict[str, int] = {}
+        condition = " AND ready = 1" if ready_only else ""
+        for start in range(0, len(keys), _LOOKUP_BATCH):
+            batch = list(keys[start:start + _LOOKUP_BATCH])
+            placeholders = ",".join("?" * len(batch))
+            slots.update(self.conn.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({placeholders}){condition}", batch
+            ))
+        return slots
+
+    def _grow(self, rows: int) -> None:
+        """Grow the vector file to hold at least rows vectors (call inside a write transaction)"""
+        row_bytes = self.dim * 4
+        current = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        if current < rows:
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(min(self.capacity, max(rows, current + GROWTH_ROWS)) * row_bytes)
+
+    def _map(self, rows: int) -> np.memmap:
+        """Memory-map the vector file, remapping when it holds fewer than rows vectors"""
+        if self._vectors is not None and self._vectors.shape[0] >= rows:
+            return self._vectors
+        current = os.path.getsize(self.vectors_path) // (self.dim * 4)
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(current, self.dim))
+        return self._vectors
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Return the cached embedding of each text, or None for misses"""
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        if texts and self.dim is None:
+            # Another process may have stored the first embeddings since we opened the cache
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            self.dim = int(row[0]) if row else None
+        if not texts or self.dim is None:
+            self.misses += len(texts)
+            return results
+        with self._lock:
+            keys = [self.key(t) for t in texts]
+            unique_keys = list(dict.fromkeys(keys))
+            slots = self._lookup(unique_keys)
+            if slots:
+                vectors = self._map(max(slots.values()) + 1)
+                copied = {key: np.array(vectors[slot]) for key, slot in slots.items()}
+                # A writer commits a slot's reassignment before overwriting its vector:
+                # only keep vectors whose slot still belongs to the same key after the copy
+                current = self._lookup(list(slots))
+                found = {key: vector for key, vector in copied.items() if current.get(key) == slots[key]}
+                for i, key in enumerate(keys):
+                    results[i] = found.get(key)
+                self._clock += 1
+                for key in found:
+                    self._touched[key] = self._clock
+                if len(self._touched) >= TOUCH_FLUSH_SIZE:
+                    with self._transaction():
+                        self._flush_touched()
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(texts) - hit_count
+        return results
+
+    def _flush_touched(self) -> None:
+        """Write buffered hit recency to SQLite (call inside a write transaction)"""
+        if self._touched:
+            self.conn.executemany(
+                "UPDATE entries SET last_used = MAX(last_used, ?) WHERE key = ?",
+                [(clock, key) for key, clock in self._touched.items()]
+            )
+            self._touched = {}
+
+    def put_many(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        """Store embeddings, evicting least recently used entries when the cache is full"""
+        if not texts:
+            return
+        with self._lock:
+            new: Dict[str, Sequence[float]] = {}
+            for text, embedding in zip(texts, embeddings):
+                new[self.key(text)] = embedding
+
+            # Reserve slots: the write lock makes the row count, clock and existing
+            # keys current across processes while they are read and updated
+            with self._transaction():
+                if self.dim is None:
+                    meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+                    self.dim = int(meta["dim"]) if "dim" in meta else len(embeddings[0])
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                        [("model_id", self.model_id), ("dim", str(self.dim))]
+                    )
+                self._flush_touched()
+                stored = self._lookup(list(new), ready_only=False)
+                ready = self._lookup(list(stored))
+                # Keys reserved but not yet written (by a crashed or concurrent writer) are
+                # rewritten in place; the vector for a key is the same whoever writes it
+                reserved = {key: slot for key, slot in stored.items() if key not in ready}
+                keys = [k for k in new if k not in stored][:self.capacity]
+                size = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                self._clock = max(self._clock, self.conn.execute(
+                    "SELECT COALESCE(MAX(last_used), 0) FROM entries").fetchone()[0]) + 1
+
+                free = self.capacity - size
+                slots = list(range(size, size + min(free, len(keys))))
+                evict = len(keys) - len(slots)
+                if evict:
+                    # Only complete entries are evicted, never another writer's reservation
+                    victims = self.conn.execute(
+                        "SELECT key, slot FROM entries WHERE ready = 1 ORDER BY last_used LIMIT ?", (evict,)
+                    ).fetchall()
+                    self.conn.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in victims])
+                    slots.extend(slot for _, slot in victims)
+                    keys = keys[:len(slots)]
+                    evict = len(victims)
+                self.conn.executemany(
+                    "INSERT INTO entries (key, slot, last_used, ready) VALUES (?, ?, ?, 0)",
+                    [(key, slot, self._clock) for key, slot in zip(keys, slots)]
+                )
+                writes = dict(zip(keys, slots))
+                writes.update(reserved)
+                if writes:
+                    self._grow(max(writes.values()) + 1)
+                self._size = size + len(keys) - evict
+            if not writes:
+                return
+
+            # The slots are ours now; write the vectors, then publish the entries
+            vectors = self._map(max(writes.values()) + 1)
+            for key, slot in writes.items():
+                vectors[slot] = np.asarray(new[key], dtype=np.float32)
+            vectors.flush()
+            with self._transaction():
+                self.conn.executemany(
+                    "UPDATE entries SET ready = 1 WHERE key = ? AND slot = ?",
+                    list(writes.items())
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._touched:
+                with self._transaction():
+                    self._flush_touched()
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            self.conn.close()
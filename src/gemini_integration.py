@@ -1,30 +1,72 @@
 import os
 import json
+import queue
+import threading
+from contextlib import contextmanager
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
 import google.generativeai as genai
 
 # Load environment variables
 load_dotenv()
+GEMINI_MODEL = "gemini-2.0-flash"
+# Model instances shared by concurrent requests; also bounds in-flight Gemini calls
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", "4"))
+
+_configured_api_key = None
+_configure_lock = threading.Lock()
+
+def configure_gemini(api_key: str) -> None:
+    """
+    Configure the Gemini SDK once per process (and again only if the key changes).
+    genai.configure drops the SDK's cached API clients, so calling it per request
+    would reconnect on every call.
+    """
+    global _configured_api_key
+    with _configure_lock:
+        if _configured_api_key != api_key:
+            genai.configure(api_key=api_key)
+            _configured_api_key = api_key
 
 class GeminiCopilot:
-    def __init__(self):
-        """Initialize the Gemini Copilot with API key and model configuration"""
+    def __init__(self, pool_size: int = GEMINI_POOL_SIZE):
+        """Initialize the Gemini Copilot with API key and model configuration
+        
+        Args:
+            pool_size: Number of model instances; requests beyond it wait for a free one
+        """
         api_key = os.getenv('GEMINI_API_KEY')
         if not api_key:
             raise ValueError("GEMINI_API_KEY environment variable not found. Please set your Gemini API key.")
         
-        genai.configure(api_key=api_key)
+        configure_gemini(api_key)
         
-        # Initialize the model with specific configuration for medical contexts
-        self.model = genai.GenerativeModel(
-            model_name='gemini-2.0-flash',
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.3,  # Lower temperature for more consistent medical advice
-                top_p=0.8,
-                max_output_tokens=2048,
-            )
-        )
+        # Initialize the models with specific configuration for medical contexts. They
+        # share the SDK's API client, so its connection is kept alive across requests.
+        self.pool_size = max(1, pool_size)
+        self._models: "queue.Queue[genai.GenerativeModel]" = queue.Queue()
+        for _ in range(self.pool_size):
+            self._models.put(genai.GenerativeModel(
+                model_name=GEMINI_MODEL,
+                generation_config=genai.types.GenerationConfig(
+                    temperature=0.3,  # Lower temperature for more consistent medical advice
+                    top_p=0.8,
+                    max_output_tokens=2048,
+                )
+            ))
+    
+    @contextmanager
+    def _model(self):
+        """Check a model out of the pool for one call"""
+        model = self._models.get()
+        try:
+            yield model
+        finally:
+            self._models.put(model)
+    
+    def _generate(self, prompt: str):
+        with self._model() as model:
+            return model.generate_content(prompt)
     
     def generate_copilot_response(self, query: str, context_results: List[Dict[str, Any]], patient_data: Dict[str, Any] = None) -> Dict[str, Any]:
         """
@@ -46,7 +88,7 @@ class GeminiCopilot:
             prompt = self._build_prompt(query, context_text, patient_data)
             
             # Generate response using Gemini
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt)
             
             # Extract citations from the context
             citations = self._extract_citations(context_results)
@@ -60,7 +102,7 @@ class GeminiCopilot:
                 "citations": citations,
                 "context_used": len(context_results),
                 "response_metadata": {
-                    "model": "gemini-2.0-flash",
+                    "model": GEMINI_MODEL,
                     "temperature": 0.3,
                     "context_sources": [result["type"] for result in context_results]
                 }
@@ -196,7 +238,7 @@ class GeminiCopilot:
             prompt = self._build_prompt(query, context_text or "No specific patient data available.", patient_data)
             
             # Generate response
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt)
             
             return {
                 "query": query,
@@ -204,7 +246,7 @@ class GeminiCopilot:
                 "citations": [],
                 "context_used": 0,
                 "response_metadata": {
-                    "model": "gemini-2.0-flash",
+                    "model": GEMINI_MODEL,
                     "temperature": 0.3,
                     "fallback_mode": True
                 }
@@ -218,3 +260,19 @@ class GeminiCopilot:
                 "citations": [],
                 "context_used": 0
             }
+
+_copilot: Optional[GeminiCopilot] = None
+_copilot_lock = threading.Lock()
+
+def get_copilot() -> GeminiCopilot:
+    """
+    Return the process-wide copilot, creating it on first use
+    
+    Raises:
+        ValueError: If GEMINI_API_KEY is not set (retried on the next call)
+    """
+    global _copilot
+    with _copilot_lock:
+        if _copilot is None:
+            _copilot = GeminiCopilot()
+        return _copilot
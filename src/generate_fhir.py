@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Offline generator of synthetic, Synthea-like FHIR R4 bundles
+
+Usage: python generate_fhir.py OUTPUT_DIR [--patients N] [--resources N] [--seed N] [--ndjson]
+                               [--mix Observation=0.5,Condition=0.1,...]
+
+Bundles are written as "<First>_<Last>_<uuid>.json" (the naming process_fhir_directory
+expects). With --ndjson, a FHIR Bulk Data style export (one NDJSON file per
+resource type) is written instead.
+"""
+
+import argparse
+import json
+import os
+import random
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+# Relative frequency of resource types in a typical longitudinal Synthea bundle
+DEFAULT_RESOURCE_MIX = {
+    "Observation": 0.50,
+    "Encounter": 0.10,
+    "Claim": 0.10,
+    "Procedure": 0.08,
+    "DiagnosticReport": 0.06,
+    "Condition": 0.05,
+    "MedicationRequest": 0.05,
+    "Immunization": 0.03,
+    "CarePlan": 0.02,
+    "AllergyIntolerance": 0.01,
+}
+
+GIVEN_NAMES = ["Ana", "James", "Maria", "Wei", "Fatima", "John", "Olga", "Kwame", "Priya", "Lucas"]
+FAMILY_NAMES = ["Smith", "Garcia", "Chen", "Okafor", "Novak", "Patel", "Silva", "Kim", "Haddad", "Berg"]
+
+CONDITIONS = [
+    ("444814009", "Viral sinusitis (disorder)"),
+    ("195662009", "Acute viral pharyngitis (disorder)"),
+    ("10509002", "Acute bronchitis (disorder)"),
+    ("38341003", "Hypertension"),
+    ("44054006", "Diabetes mellitus type 2 (disorder)"),
+    ("162864005", "Body mass index 30+ - obesity (finding)"),
+    ("278860009", "Chronic low back pain (finding)"),
+    ("65363002", "Otitis media"),
+    ("840544004", "Suspected COVID-19"),
+    ("59621000", "Essential hypertension (disorder)"),
+]
+
+# (LOINC code, display, category, unit, low, high) - unit None means a coded result
+OBSERVATIONS = [
+    ("8867-4", "Heart rate", "vital-signs", "/min", 55, 110),
+    ("9279-1", "Respiratory rate", "vital-signs", "/min", 11, 22),
+    ("39156-5", "Body Mass Index", "vital-signs", "kg/m2", 17, 38),
+    ("29463-7", "Body Weight", "vital-signs", "kg", 45, 120),
+    ("8302-2", "Body Height", "vital-signs", "cm", 150, 195),
+    ("8310-5", "Body temperature", "vital-signs", "Cel", 36, 38.5),
+    ("2339-0", "Glucose", "laboratory", "mg/dL", 65, 180),
+    ("2093-3", "Total Cholesterol", "laboratory", "mg/dL", 140, 260),
+    ("718-7", "Hemoglobin [Mass/volume] in Blood", "laboratory", "g/dL", 11, 17),
+    ("38483-4", "Creatinine", "laboratory", "mg/dL", 0.6, 1.4),
+    ("6298-4", "Potassium", "laboratory", "mmol/L", 3.4, 5.2),
+    ("6206-7", "Peanut IgE Ab in Serum", "laboratory", "kU/L", 0.05, 3.0),
+    ("94531-1", "SARS-CoV-2 RNA Pnl Resp NAA+probe", "laboratory", None, 0, 0),
+    ("72166-2", "Tobacco smoking status", "social-history", None, 0, 0),
+]
+CODED_RESULTS = ["Negative (qualifier value)", "Positive (qualifier value)", "Never smoked tobacco (finding)"]
+
+MEDICATIONS = [
+    "Hydrochlorothiazide 25 MG Oral Tablet",
+    "Acetaminophen 325 MG Oral Tablet",
+    "Amoxicillin 250 MG / Clavulanate 125 MG Oral Tablet",
+    "Metformin hydrochloride 500 MG Oral Tablet",
+    "Lisinopril 10 MG Oral Tablet",
+    "Ibuprofen 200 MG Oral Tablet",
+]
+PROCEDURES = [
+    "Assessment of health and social care needs (procedure)",
+    "Medication Reconciliation (procedure)",
+    "Depression screening (procedure)",
+    "Screening for drug abuse (procedure)",
+    "Measurement of respiratory function (procedure)",
+]
+REPORTS = [
+    "Complete blood count (hemogram) panel - Blood by Automated count",
+    "Lipid Panel",
+    "Basic metabolic panel - Blood",
+    "Generalized anxiety disorder 7 item (GAD-7)",
+]
+IMMUNIZATIONS = [
+    "Influenza, seasonal, injectable, preservative free",
+    "Td (adult) preservative free",
+    "COVID-19, mRNA, LNP-S, PF, 30 mcg/0.3 mL dose",
+    "Hep B, adolescent or pediatric",
+]
+ENCOUNTERS = [
+    "General examination of patient (procedure)",
+    "Encounter for symptom (procedure)",
+    "Follow-up encounter (procedure)",
+    "Emergency room admission (procedure)",
+]
+CAREPLANS = ["Respiratory therapy", "Diabetes self management plan", "Lifestyle education regarding hypertension"]
+ALLERGIES = ["Allergy to peanuts", "Allergy to mould", "Penicillin V", "House dust mite (organism)"]
+
+def _concept(text: str, code: Optional[str] = None, system: str = "http://snomed.info/sct") -> Dict[str, Any]:
+    return {"coding": [{"system": system, "code": code or str(zlib.crc32(text.encode("utf-8"))), "display": text}], "text": text}
+
+def _timestamp(rng: random.Random, start: datetime, span_days: int) -> str:
+    moment = start + timedelta(days=rng.uniform(0, span_days), seconds=rng.randint(0, 86399))
+    return moment.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+def _make_resource(rng: random.Random, resource_type: str, patient_ref: str, start: datetime, span_days: int) -> Dict[str, Any]:
+    """Build one resource of the given type belonging to patient_ref"""
+    resource: Dict[str, Any] = {"resourceType": resource_type, "id": str(uuid.UUID(int=rng.getrandbits(128)))}
+    when = _timestamp(rng, start, span_days)
+    subject = {"reference": patient_ref}
+
+    if resource_type == "Observation":
+        code, display, category, unit, low, high = rng.choice(OBSERVATIONS)
+        resource.update({
+            "status": "final",
+            "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category", "code": category}]}],
+            "code": _concept(display, code, "http://loinc.org"),
+            "subject": subject,
+            "effectiveDateTime": when,
+            "issued": when,
+        })
+        if unit:
+            resource["valueQuantity"] = {"value": round(rng.uniform(low, high), 2), "unit": unit,
+                                         "system": "http://unitsofmeasure.org", "code": unit}
+        else:
+            resource["valueCodeableConcept"] = _concept(rng.choice(CODED_RESULTS))
+    elif resource_type == "Condition":
+        code, display = rng.choice(CONDITIONS)
+        resource.update({"clinicalStatus": _concept("active"), "code": _concept(display, code),
+                         "subject": subject, "onsetDateTime": when})
+    elif resource_type == "MedicationRequest":
+        resource.update({"status": "active", "intent": "order",
+                         "medicationCodeableConcept": _concept(rng.choice(MEDICATIONS), system="http://www.nlm.nih.gov/research/umls/rxnorm"),
+                         "subject": subject, "authoredOn": when})
+    elif resource_type == "Procedure":
+        resource.update({"status": "completed", "code": _concept(rng.choice(PROCEDURES)),
+                         "subject": subject, "performedPeriod": {"start": when, "end": when}})
+    elif resource_type == "DiagnosticReport":
+        resource.update({"status": "final", "code": _concept(rng.choice(REPORTS), system="http://loinc.org"),
+                         "subject": subject, "effectiveDateTime": when})
+    elif resource_type == "Immunization":
+        resource.update({"status": "completed", "vaccineCode": _concept(rng.choice(IMMUNIZATIONS), system="http://hl7.org/fhir/sid/cvx"),
+                         "patient": subject, "occurrenceDateTime": when})
+    elif resource_type == "Encounter":
+        resource.update({"status": "finished", "class": {"code": "AMB"}, "type": [_concept(rng.choice(ENCOUNTERS))],
+                         "subject": subject, "period": {"start": when, "end": when}})
+    elif resource_type == "CarePlan":
+        description = rng.choice(CAREPLANS)
+        resource.update({"status": "active", "intent": "order", "description": description,
+                         "category": [_concept(description)], "subject": subject})
+    elif resource_type == "AllergyIntolerance":
+        resource.update({"clinicalStatus": _concept("active"), "code": _concept(rng.choice(ALLERGIES)),
+                         "patient": subject, "recordedDate": when})
+    elif resource_type == "Claim":
+        code, display = rng.choice(CONDITIONS)
+        resource.update({"status": "active", "use": "claim", "patient": subject, "created": when,
+                         "diagnosis": [{"sequence": 1, "diagnosisCodeableConcept": _concept(display, code)}]})
+    return resource
+
+def generate_patient_resources(rng: random.Random, resource_count: int,
+                               resource_mix: Optional[Dict[str, float]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yield a Patient resource followed by resource_count clinical resources for it
+
+    Args:
+        rng: Random generator (seed it for reproducible output)
+        resource_count: Number of non-Patient resources to generate
+        resource_mix: Relative weight per resource type (defaults to DEFAULT_RESOURCE_MIX)
+    """
+    resource_mix = resource_mix or DEFAULT_RESOURCE_MIX
+    patient_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    birth = datetime(1940, 1, 1) + timedelta(days=rng.randint(0, 365 * 80))
+    yield {
+        "resourceType": "Patient",
+        "id": patient_id,
+        "name": [{"use": "official", "given": [rng.choice(GIVEN_NAMES)], "family": rng.choice(FAMILY_NAMES)}],
+        "gender": rng.choice(["male", "female"]),
+        "birthDate": birth.strftime("%Y-%m-%d"),
+    }
+
+    patient_ref = f"urn:uuid:{patient_id}"
+    span_days = max(1, (datetime(2024, 1, 1) - birth).days)
+    types = list(resource_mix)
+    weights = [resource_mix[t] for t in types]
+    for resource_type in rng.choices(types, weights=weights, k=resource_count):
+        yield _make_resource(rng, resource_type, patient_ref, birth, span_days)
+
+def generate_bundle(rng: random.Random, resource_count: int,
+                    resource_mix: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """Generate one patient's FHIR transaction Bundle with resource_count clinical resources"""
+    return {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [
+            {"fullUrl": f"urn:uuid:{resource['id']}", "resource": resource,
+             "request": {"method": "POST", "url": resource["resourceType"]}}
+            for resource in generate_patient_resources(rng, resource_count, resource_mix)
+        ],
+    }
+
+def bundle_file_name(bundle: Dict[str, Any]) -> str:
+    """Synthea-style file name: <First>_<Last>_<uuid>.json"""
+    patient = bundle["entry"][0]["resource"]
+    name = patient["name"][0]
+    return f"{name['given'][0]}_{name['family']}_{patient['id']}.json"
+
+def generate_bundles(output_dir: str, patients: int, resources_per_patient: int,
+                     resource_mix: Optional[Dict[str, float]] = None, seed: int = 0) -> List[str]:
+    """
+    Write one bundle file per patient into output_dir
+
+    Returns:
+        Paths of the written bundle files
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for _ in range(patients):
+        bundle = generate_bundle(rng, resources_per_patient, resource_mix)
+        path = os.path.join(output_dir, bundle_file_name(bundle))
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(bundle, f)
+        paths.append(path)
+    return paths
+
+def generate_ndjson_export(output_dir: str, patients: int, resources_per_patient: int,
+                           resource_mix: Optional[Dict[str, float]] = None, seed: int = 0) -> List[str]:
+    """
+    Write a FHIR Bulk Data style export: one <ResourceType>.ndjson file per type
+
+    Returns:
+        Paths of the written NDJSON files
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    handles: Dict[str, Any] = {}
+    try:
+        for _ in range(patients):
+            for resource in generate_patient_resources(rng, resources_per_patient, resource_mix):
+                resource_type = resource["resourceType"]
+                if resource_type not in handles:
+                    handles[resource_type] = open(os.path.join(output_dir, f"{resource_type}.ndjson"), "w", encoding="utf-8")
+                handles[resource_type].write(json.dumps(resource) + "\n")
+    finally:
+        for handle in handles.values():
+            handle.close()
+    return sorted(handle.name for handle in handles.values())
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parse "Observation=0.5,Condition=0.1" into a resource mix"""
+    mix = {}
+    for part in text.split(","):
+        resource_type, weight = part.split("=")
+        mix[resource_type.strip()] = float(weight)
+    return mix
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic FHIR R4 bundles")
+    parser.add_argument("output_dir")
+    parser.add_argument("--patients", type=int, default=10)
+    parser.add_argument("--resources", type=int, default=1000, help="clinical resources per patient")
+    parser.add_argument("--mix", type=parse_mix, default=None, help="e.g. Observation=0.5,Condition=0.1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ndjson", action="store_true", help="write a Bulk Data NDJSON export instead of bundles")
+    args = parser.parse_args()
+
+    if args.ndjson:
+        paths = generate_ndjson_export(args.output_dir, args.patients, args.resources, args.mix, args.seed)
+    else:
+        paths = generate_bundles(args.output_dir, args.patients, args.resources, args.mix, args.seed)
+    total_mb = sum(os.path.getsize(p) for p in paths) / (1024 * 1024)
+    print(f"Wrote {len(paths)} files ({total_mb:.1f} MB) to {args.output_dir}")
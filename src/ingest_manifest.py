@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Persistent manifest of ingested sources for incremental re-runs
+
+Stores a content hash per source file (FHIR bundle or patient data file) and,
+optionally, the id/version of every resource it contained. Backed by SQLite so
+large backfills can commit progress cheaply and look up single sources fast.
+"""
+
+import hashlib
+import json
+import sqlite3
+from typing import Any, Dict, List, Optional
+
+def file_sha256(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """Compute the SHA-256 of a file without reading it into memory at once"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _content_hash(resource: Dict[str, Any]) -> str:
+    content = json.dumps(resource, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
+def resource_version(resource: Dict[str, Any]) -> str:
+    """
+    Version token for a FHIR resource.
+    Uses meta.versionId when present, otherwise a hash of the resource content.
+    """
+    version_id = resource.get("meta", {}).get("versionId")
+    if version_id:
+        return f"v:{version_id}"
+    return "h:" + _content_hash(resource)
+
+def resource_key(resource: Dict[str, Any]) -> str:
+    """
+    Manifest key for a resource: "<resourceType>/<id>".
+    Resources without an id are keyed by their content hash instead.
+    """
+    resource_id = resource.get("id") or "~" + _content_hash(resource)
+    return f"{resource.get('resourceType')}/{resource_id}"
+
+def diff_resource_versions(old: Dict[str, str], new: Dict[str, str]) -> Dict[str, List[str]]:
+    """Compare two resource version maps"""
+    return {
+        "added": [k for k in new if k not in old],
+        "changed": [k for k in new if k in old and old[k] != new[k]],
+        "removed": [k for k in old if k not in new],
+    }
+
+class IngestManifest:
+    """SQLite-backed manifest mapping source files to content hashes and outputs"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " source TEXT PRIMARY KEY, sha256 TEXT NOT NULL, output TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS resources ("
+            " source TEXT NOT NULL, resource TEXT NOT NULL, version TEXT NOT NULL,"
+            " PRIMARY KEY (source, resource))"
+        )
+        self.conn.commit()
+
+    def get_source(self, source: str) -> Optional[Dict[str, Any]]:
+        """Return {"sha256", "output"} for a recorded source, or None"""
+        row = self.conn.execute(
+            "SELECT sha256, output FROM sources WHERE source = ?", (source,)
+        ).fetchone()
+        if not row:
+            return None
+        return {"sha256": row[0], "output": row[1]}
+
+    def get_hashes(self) -> Dict[str, str]:
+        """Return the recorded content hash of every source"""
+        return dict(self.conn.execute("SELECT source, sha256 FROM sources"))
+
+    def get_resource_versions(self, source: str) -> Dict[str, str]:
+        """Return the recorded resource version map of a source"""
+        return dict(self.conn.execute(
+            "SELECT resource, version FROM resources WHERE source = ?", (source,)
+        ))
+
+    def record_source(self, source: str, sha256: str, output: Optional[str] = None,
+                      resource_versions: Optional[Dict[str, str]] = None) -> None:
+        """Record (or replace) a source's hash, output and optionally its resource versions"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sources (source, sha256, output) VALUES (?, ?, ?)",
+            (source, sha256, output)
+        )
+        if resource_versions is not None:
+            self.conn.execute("DELETE FROM resources WHERE source = ?", (source,))
+            self.conn.executemany(
+                "INSERT INTO resources (source, resource, version) VALUES (?, ?, ?)",
+                [(source, key, version) for key, version in resource_versions.items()]
+            )
+
+    def remove_source(self, source: str) -> None:
+        self.conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+        self.conn.execute("DELETE FROM resources WHERE source = ?", (source,))
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
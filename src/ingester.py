@@ -1,6 +1,15 @@
 # fhir_ingester_extended.py
+import codecs
 import json
-from typing import Dict, List, Any, Set
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, List, Any, Set, IO, Callable, Iterable, Iterator, Optional, Tuple
+
+from observation_store import ObservationTable
+from vocabulary import save_patient_record
+from ingest_manifest import IngestManifest, diff_resource_versions, file_sha256, resource_key, resource_version
 
 class FHIRIngester:
     """
@@ -24,12 +33,10 @@ class FHIRIngester:
             "Claim": self.extract_claim
         }
 
-    def extract_all_patient_resources(self, bundle: Dict[str, Any]) -> Dict[str, List[Any]]:
-        """
-        Iterates through all entries in a FHIR Bundle and extracts simplified resources.
-        Uses sets to remove duplicates.
-        """
-        simplified_data = {
+    @staticmethod
+    def new_simplified_data() -> Dict[str, Any]:
+        """Create an empty accumulator for simplified resources."""
+        return {
             "conditions": set(),
             "observations": set(),
             "medications": set(),
@@ -40,39 +47,52 @@ class FHIRIngester:
             "encounters": set(),
             "careplans": set(),
             "claims_diagnoses": set(),
-            "patient": []
+            "patient": [],
+            "observation_table": ObservationTable()
         }
 
-        entries = bundle.get("entry", [])
-        for entry in entries:
-            resource = entry.get("resource", {})
-            resource_type = resource.get("resourceType")
-            if resource_type in self.supported_resources:
-                try:
-                    simplified = self.supported_resources[resource_type](resource)
-                    if simplified:
-                        key = self.map_resource_to_key(resource_type)
-                        # Handle patient separately (list)
-                        if key == "patient":
-                            simplified_data[key].append(simplified)
-                        # For other types, use sets to deduplicate
-                        elif isinstance(simplified, (str, tuple)):
-                            simplified_data[key].add(simplified)
-                        elif isinstance(simplified, list):
-                            simplified_data[key].update(simplified)
-                        else:
-                            simplified_data[key].add(tuple(simplified.items()))
-                except Exception as e:
-                    print(f"Warning: Failed to extract {resource_type}: {e}")
-            else:
-                continue
+    def add_resource(self, simplified_data: Dict[str, Any], resource: Dict[str, Any]) -> None:
+        """
+        Extract a single FHIR resource into an accumulator created by new_simplified_data().
+        Uses sets to remove duplicates.
+        """
+        resource_type = resource.get("resourceType")
+        if resource_type not in self.supported_resources:
+            return
+        try:
+            simplified = self.supported_resources[resource_type](resource)
+            if simplified:
+                key = self.map_resource_to_key(resource_type)
+                # Handle patient separately (list)
+                if key == "patient":
+                    simplified_data[key].append(simplified)
+                # For other types, use sets to deduplicate
+                elif isinstance(simplified, (str, tuple)):
+                    simplified_data[key].add(simplified)
+                elif isinstance(simplified, list):
+                    simplified_data[key].update(simplified)
+                else:
+                    simplified_data[key].add(tuple(simplified.items()))
+            # Keep every observation (not just unique strings) with its code, value and time
+            if resource_type == "Observation":
+                simplified_data["observation_table"].add_resource(resource)
+        except Exception as e:
+            print(f"Warning: Failed to extract {resource_type}: {e}")
 
-        # Convert sets back to lists for JSON serialization
+    @staticmethod
+    def finalize_simplified_data(simplified_data: Dict[str, Any]) -> Dict[str, List[Any]]:
+        """
+        Convert an accumulator's sets back to lists for JSON serialization.
+        Lists are sorted so output is identical across processes and runs.
+        """
         for k, v in simplified_data.items():
-            if isinstance(v, set):
+            if isinstance(v, ObservationTable):
+                v.sort()
+                simplified_data[k] = v.to_dict()
+            elif isinstance(v, set):
                 # Convert tuple back to dict if needed
                 new_list = []
-                for item in v:
+                for item in sorted(v, key=str):
                     if isinstance(item, tuple):
                         new_list.append(dict(item))
                     else:
@@ -81,6 +101,24 @@ class FHIRIngester:
 
         return simplified_data
 
+    def extract_resources(self, resources: Iterable[Dict[str, Any]]) -> Dict[str, List[Any]]:
+        """
+        Extract simplified data from any iterable of FHIR resources.
+        Resources are consumed one at a time, so a lazy iterator keeps memory flat.
+        """
+        simplified_data = self.new_simplified_data()
+        for resource in resources:
+            self.add_resource(simplified_data, resource)
+        return self.finalize_simplified_data(simplified_data)
+
+    def extract_all_patient_resources(self, bundle: Dict[str, Any]) -> Dict[str, List[Any]]:
+        """
+        Iterates through all entries in a FHIR Bundle and extracts simplified resources.
+        Uses sets to remove duplicates.
+        """
+        entries = bundle.get("entry", [])
+        return self.extract_resources(entry.get("resource", {}) for entry in entries)
+
     def process_fhir_data(self, fhir_data: Dict[str, Any]) -> Dict[str, List[Any]]:
         """
         Process FHIR data - handles both Bundle format and pre-processed format.
@@ -98,6 +136,27 @@ class FHIRIngester:
         # If it's neither, try to treat it as a bundle anyway
         return self.extract_all_patient_resources(fhir_data)
 
+    def process_fhir_stream(self, fp: IO, top_level: Optional[Dict[str, Any]] = None) -> Dict[str, List[Any]]:
+        """
+        Streaming counterpart of process_fhir_data for file-like objects.
+
+        Bundle entries are parsed and extracted one resource at a time, so peak
+        memory does not grow with bundle size. Pre-processed documents are
+        returned as-is, like process_fhir_data does.
+
+        Args:
+            fp: Text or binary file-like object containing the JSON document
+            top_level: Optional dict that receives the document's top-level keys other than "entry"
+        """
+        if top_level is None:
+            top_level = {}
+        simplified_data = self.extract_resources(iter_bundle_resources(fp, top_level=top_level))
+
+        expected_keys = {"conditions", "observations", "medications", "procedures", "allergies"}
+        if any(key in top_level for key in expected_keys):
+            return top_level
+        return simplified_data
+
     @staticmethod
     def map_resource_to_key(resource_type: str) -> str:
         mapping = {
@@ -179,31 +238,148 @@ class FHIRIngester:
         return list(diagnoses)
 
 
-def extract_patient_data(file_path: str) -> Dict[str, Any]:
+class _JSONStreamReader:
+    """
+    Minimal incremental JSON reader over a file-like object.
+
+    Only as much of the input as is needed to decode the current value is kept
+    in memory, which lets large bundles be walked one entry at a time.
+    """
+
+    def __init__(self, fp: IO, chunk_size: int = 1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+
+    def _fill(self, size: int) -> bool:
+        """Append up to size characters to the buffer. Returns False at end of input."""
+        if self.eof:
+            return False
+        raw = self.fp.read(size)
+        chunk = self._utf8.decode(raw, final=not raw) if isinstance(raw, bytes) else raw
+        if not raw:
+            self.eof = True
+            if not chunk:
+                return False
+        # Drop the consumed prefix so the buffer only holds unparsed input
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it ('' at EOF)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value."""
+        self.peek()
+        read_size = self.chunk_size
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A scalar not followed by a delimiter may be truncated (e.g. "3" of "3.5")
+                if self.eof or (end < len(self.buffer) and self.buffer[end] in " \t\r\n,:]}"):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(read_size)
+            read_size *= 2
+
+
+def iter_bundle_resources(fp: IO, top_level: Optional[Dict[str, Any]] = None,
+                          chunk_size: int = 1 << 16) -> Iterator[Dict[str, Any]]:
+    """
+    Incrementally walk entry[*].resource of a FHIR Bundle read from a file-like object.
+
+    Args:
+        fp: Text or binary file-like object containing a JSON object
+        top_level: Optional dict that receives every top-level key other than "entry"
+        chunk_size: Characters (or bytes) read from fp at a time
+
+    Yields:
+        Each entry's resource dictionary, one at a time
+    """
+    reader = _JSONStreamReader(fp, chunk_size=chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == "entry" and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() != "]":
+                while True:
+                    entry = reader.value()
+                    if isinstance(entry, dict):
+                        yield entry.get("resource", {})
+                    if reader.peek() != ",":
+                        break
+                    reader.expect(",")
+            reader.expect("]")
+        else:
+            value = reader.value()
+            if top_level is not None:
+                top_level[key] = value
+        if reader.peek() != ",":
+            break
+        reader.expect(",")
+    reader.expect("}")
+
+
+def extract_patient_data(file_path: str, streaming: bool = True,
+                         resource_versions: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
     """
     Extract patient data from a FHIR bundle file
     
     Args:
         file_path: Path to the FHIR bundle JSON file
+        streaming: Parse the bundle incrementally instead of loading it with json.load
+        resource_versions: Optional dict that receives "<type>/<id>" -> version token for every resource
         
     Returns:
         Dictionary containing extracted patient data
     """
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            bundle = json.load(f)
-            
         ingester = FHIRIngester()
-        simplified_data = ingester.extract_all_patient_resources(bundle)
-        
-        # Extract patient ID from the bundle
         patient_id = None
-        entries = bundle.get("entry", [])
-        for entry in entries:
-            resource = entry.get("resource", {})
-            if resource.get("resourceType") == "Patient":
-                patient_id = resource.get("id")
-                break
+
+        def track_resources(resources):
+            nonlocal patient_id
+            for resource in resources:
+                if patient_id is None and resource.get("resourceType") == "Patient":
+                    patient_id = resource.get("id")
+                if resource_versions is not None:
+                    resource_versions[resource_key(resource)] = resource_version(resource)
+                yield resource
+
+        if streaming:
+            with open(file_path, "rb") as f:
+                simplified_data = ingester.extract_resources(track_resources(iter_bundle_resources(f)))
+        else:
+            with open(file_path, "r", encoding="utf-8") as f:
+                bundle = json.load(f)
+
+            simplified_data = ingester.extract_resources(
+                track_resources(entry.get("resource", {}) for entry in bundle.get("entry", []))
+            )
         
         # Add the patient ID to the simplified data
         if patient_id:
@@ -214,76 +390,319 @@ def extract_patient_data(file_path: str) -> Dict[str, Any]:
         print(f"Error extracting data from {file_path}: {str(e)}")
         return {}
 
-def process_fhir_directory(fhir_dir: str, output_dir: str) -> None:
+MANIFEST_FILENAME = "ingest_manifest.sqlite3"
+
+def _extract_fhir_file(task: Tuple[int, str, Optional[str]]) -> Tuple[int, str, str, Optional[Dict[str, Any]], Optional[Dict[str, str]]]:
+    """
+    Worker entry point: hash and extract one bundle file. Must stay module-level so it can be pickled.
+    Returns no data and no resource versions when the content hash equals known_sha256.
+    """
+    i, file_path, known_sha256 = task
+    sha256 = file_sha256(file_path)
+    if sha256 == known_sha256:
+        return i, file_path, sha256, None, None
+    resource_versions: Dict[str, str] = {}
+    patient_data = extract_patient_data(file_path, resource_versions=resource_versions)
+    return i, file_path, sha256, patient_data, resource_versions
+
+def _run_tasks(func: Callable, tasks: List[Any], workers: Optional[int], handle_result: Callable) -> None:
+    """
+    Run func over tasks serially (workers == 1) or in a process pool, passing each
+    result tuple to handle_result in the parent process in task order. Results are
+    handled in the same order as a serial run, so output files and the vocabulary
+    IDs they assign do not depend on which worker finishes first.
+    """
+    workers = workers if workers else (os.cpu_count() or 1)
+    if workers <= 1:
+        for task in tasks:
+            handle_result(*func(task))
+        return
+    
+    print(f"Processing with {workers} worker processes.")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep a bounded window of in-flight tasks so results don't pile up in memory
+        task_iter = iter(tasks)
+        pending = deque(executor.submit(func, task) for task in islice(task_iter, workers * 4))
+        while pending:
+            handle_result(*pending.popleft().result())
+            for task in islice(task_iter, 1):
+                pending.append(executor.submit(func, task))
+
+def _write_patient_file(i: int, file_path: str, patient_data: Dict[str, Any], output_dir: str) -> str:
+    """Write extracted patient data using the "<First>_<Last>_<patient_id>.json" naming scheme"""
+    # Extract the patient name from the filename (assuming format like "Name_Surname_ID.json")
+    file_name = os.path.basename(file_path)
+    name_parts = file_name.split('_')
+    if len(name_parts) >= 2:
+        patient_name = f"{name_parts[0]}_{name_parts[1]}"
+    else:
+        patient_name = f"patient_{i}"
+    
+    # Create output file path
+    patient_id = patient_data.get("patient_id", f"unknown_{i}")
+    output_file = os.path.join(output_dir, f"{patient_name}_{patient_id}.json")
+    
+    # Save the data (strings are stored as shared vocabulary IDs)
+    save_patient_record(output_file, patient_data)
+    return output_file
+
+def process_fhir_directory(fhir_dir: str, output_dir: str, workers: int = 1,
+                           manifest_path: Optional[str] = None, resume: bool = False,
+                           checkpoint_every: int = 50) -> None:
     """
     Process all FHIR files in a directory and create individual JSON files
     
+    Every processed bundle is recorded in a manifest with its content hash and the
+    id/version of each resource it contained. With resume=True, bundles whose hash
+    matches the manifest are skipped, and bundles whose resources are unchanged
+    (e.g. only Bundle metadata differs) keep their existing output file untouched.
+    
     Args:
         fhir_dir: Path to the directory containing FHIR JSON files
         output_dir: Path to the directory where individual patient files will be saved
+        workers: Number of worker processes (1 = serial, 0 or None = one per CPU)
+        manifest_path: Manifest path (defaults to <output_dir>/ingest_manifest.sqlite3)
+        resume: Skip unchanged bundles recorded in the manifest (resumes and incremental re-runs)
+        checkpoint_every: Commit the manifest after this many processed files
     """
-    import os
-    
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
-    # Get all JSON files in the FHIR directory
-    fhir_files = [os.path.join(fhir_dir, f) for f in os.listdir(fhir_dir) 
-                 if f.endswith('.json') and os.path.isfile(os.path.join(fhir_dir, f))]
+    # Get all JSON files in the FHIR directory (sorted so indices are stable across resumed runs)
+    fhir_files = sorted(os.path.join(fhir_dir, f) for f in os.listdir(fhir_dir)
+                        if f.endswith('.json') and os.path.isfile(os.path.join(fhir_dir, f)))
     
     print(f"Found {len(fhir_files)} FHIR files to process.")
     
-    # Process each file
+    manifest = IngestManifest(manifest_path or os.path.join(output_dir, MANIFEST_FILENAME))
+    
+    tasks = []
     for i, file_path in enumerate(fhir_files):
-        try:
-            # Extract the patient name from the filename (assuming format like "Name_Surname_ID.json")
-            file_name = os.path.basename(file_path)
-            name_parts = file_name.split('_')
-            if len(name_parts) >= 2:
-                patient_name = f"{name_parts[0]}_{name_parts[1]}"
-            else:
-                patient_name = f"patient_{i}"
-            
-            # Extract the data
-            patient_data = extract_patient_data(file_path)
-            
-            if not patient_data:
-                print(f"Skipping {file_name} due to extraction errors.")
+        known_sha256 = None
+        if resume:
+            recorded = manifest.get_source(os.path.basename(file_path))
+            # Only trust the recorded hash if the output it produced still exists
+            if recorded and recorded["output"] and os.path.exists(os.path.join(output_dir, recorded["output"])):
+                known_sha256 = recorded["sha256"]
+        tasks.append((i, file_path, known_sha256))
+    
+    stats = {"written": 0, "unchanged": 0, "failed": 0}
+    processed = 0
+    
+    def handle_result(i: int, file_path: str, sha256: str, patient_data: Optional[Dict[str, Any]],
+                      resource_versions: Optional[Dict[str, str]]) -> None:
+        nonlocal processed
+        file_name = os.path.basename(file_path)
+        processed += 1
+        if patient_data is None and resource_versions is None:
+            stats["unchanged"] += 1
+        elif not patient_data:
+            print(f"Skipping {file_name} due to extraction errors.")
+            stats["failed"] += 1
+        else:
+            try:
+                recorded = manifest.get_source(file_name)
+                old_versions = manifest.get_resource_versions(file_name) if recorded else {}
+                if (resume and recorded and recorded["output"] and old_versions == resource_versions
+                        and os.path.exists(os.path.join(output_dir, recorded["output"]))):
+                    # Bytes changed but every resource id/version is the same: keep the output as-is
+                    manifest.record_source(file_name, sha256, recorded["output"])
+                    stats["unchanged"] += 1
+                else:
+                    if recorded and old_versions:
+                        diff = diff_resource_versions(old_versions, resource_versions)
+                        print(f"{file_name}: {len(diff['added'])} added, {len(diff['changed'])} changed, "
+                              f"{len(diff['removed'])} removed resources")
+                    output_file = _write_patient_file(i, file_path, patient_data, output_dir)
+                    manifest.record_source(file_name, sha256, os.path.basename(output_file), resource_versions)
+                    stats["written"] += 1
+            except Exception as e:
+                print(f"Error processing {file_path}: {str(e)}")
+                stats["failed"] += 1
+        
+        if processed % checkpoint_every == 0:
+            manifest.commit()
+        if processed % 10 == 0 or processed == len(tasks):
+            print(f"Processed {processed}/{len(tasks)} files...")
+    
+    try:
+        _run_tasks(_extract_fhir_file, tasks, workers, handle_result)
+    finally:
+        manifest.close()
+    
+    print(f"Completed. Processed {len(fhir_files)} files: {stats['written']} written, "
+          f"{stats['unchanged']} unchanged, {stats['failed']} failed. Results saved to {output_dir}")
+
+# ------------------- FHIR Bulk Data ($export) NDJSON -------------------
+
+def _patient_reference(resource: Dict[str, Any]) -> Optional[str]:
+    """Return the id of the patient a resource belongs to (its own id for Patient resources)"""
+    if resource.get("resourceType") == "Patient":
+        return resource.get("id")
+    for field in ("subject", "patient", "beneficiary"):
+        reference = (resource.get(field) or {}).get("reference")
+        if reference:
+            # Handles both "Patient/<id>" and "urn:uuid:<id>" references
+            return reference.rsplit("/", 1)[-1].rsplit(":", 1)[-1]
+    return None
+
+def _ndjson_ranges(file_path: str, chunk_bytes: int) -> List[Tuple[str, int, int]]:
+    """Split an NDJSON file into byte ranges that start and end on line boundaries"""
+    size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, "rb") as f:
+        offset = chunk_bytes
+        while offset < size:
+            f.seek(offset)
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+            offset = position + chunk_bytes
+    boundaries.append(size)
+    return [(file_path, start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+def _extract_ndjson_range(task: Tuple[str, int, int]) -> Tuple[str, Dict[str, Dict[str, Any]], int]:
+    """
+    Worker entry point: extract one byte range of an NDJSON file into per-patient
+    accumulators. Must stay module-level so it can be pickled.
+    """
+    file_path, start, end = task
+    ingester = FHIRIngester()
+    patients: Dict[str, Dict[str, Any]] = {}
+    unassigned = 0
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
                 continue
-                
-            # Create output file path
-            patient_id = patient_data.get("patient_id", f"unknown_{i}")
-            output_file = os.path.join(output_dir, f"{patient_name}_{patient_id}.json")
-            
-            # Save the data
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(patient_data, f, indent=2)
-                
-            if i % 10 == 0:
-                print(f"Processed {i+1}/{len(fhir_files)} files...")
-                
+            try:
+                resource = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Warning: Skipping invalid NDJSON line in {file_path}: {e}")
+                continue
+            patient_id = _patient_reference(resource)
+            if not patient_id:
+                unassigned += 1
+                continue
+            if patient_id not in patients:
+                patients[patient_id] = ingester.new_simplified_data()
+            ingester.add_resource(patients[patient_id], resource)
+    return file_path, patients, unassigned
+
+def _merge_simplified_data(target: Dict[str, Any], source: Dict[str, Any]) -> None:
+    """Merge one accumulator created by new_simplified_data() into another"""
+    for key, value in source.items():
+        if isinstance(value, set):
+            target[key].update(value)
+        else:
+            # Lists and ObservationTable both append in order
+            target[key].extend(value)
+
+def extract_ndjson_patients(ndjson_files: List[str], workers: int = 1,
+                            chunk_bytes: int = 64 * 1024 * 1024) -> Dict[str, Dict[str, Any]]:
+    """
+    Extract per-patient simplified data from FHIR Bulk Data NDJSON files
+    
+    Each file is streamed line by line in byte ranges spread across worker processes,
+    and resources are grouped by their subject/patient reference. The result for each
+    patient matches extract_all_patient_resources on an equivalent bundle.
+    
+    Args:
+        ndjson_files: Paths to NDJSON files (typically one per resource type)
+        workers: Number of worker processes (1 = serial, 0 or None = one per CPU)
+        chunk_bytes: Approximate size of the byte range handled by one task
+        
+    Returns:
+        Dictionary mapping patient id to simplified data (including "patient_id")
+    """
+    tasks = [task for file_path in ndjson_files for task in _ndjson_ranges(file_path, chunk_bytes)]
+    print(f"Split {len(ndjson_files)} NDJSON files into {len(tasks)} ranges.")
+    
+    merged: Dict[str, Dict[str, Any]] = {}
+    unassigned_total = 0
+    
+    def handle_result(file_path: str, patients: Dict[str, Dict[str, Any]], unassigned: int) -> None:
+        nonlocal unassigned_total
+        unassigned_total += unassigned
+        for patient_id, partial in patients.items():
+            if patient_id in merged:
+                _merge_simplified_data(merged[patient_id], partial)
+            else:
+                merged[patient_id] = partial
+    
+    _run_tasks(_extract_ndjson_range, tasks, workers, handle_result)
+    if unassigned_total:
+        print(f"Skipped {unassigned_total} resources without a patient reference.")
+    
+    results = {}
+    for patient_id, partial in merged.items():
+        simplified_data = FHIRIngester.finalize_simplified_data(partial)
+        simplified_data["patient_id"] = patient_id
+        results[patient_id] = simplified_data
+    return results
+
+def process_ndjson_export(export_dir: str, output_dir: str, workers: int = 1,
+                          chunk_bytes: int = 64 * 1024 * 1024) -> None:
+    """
+    Process a FHIR Bulk Data $export directory (*.ndjson) into individual patient JSON files
+    
+    Args:
+        export_dir: Directory containing the NDJSON files
+        output_dir: Path to the directory where individual patient files will be saved
+        workers: Number of worker processes (1 = serial, 0 or None = one per CPU)
+        chunk_bytes: Approximate size of the byte range handled by one task
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    
+    ndjson_files = sorted(os.path.join(export_dir, f) for f in os.listdir(export_dir)
+                          if f.endswith('.ndjson') and os.path.isfile(os.path.join(export_dir, f)))
+    print(f"Found {len(ndjson_files)} NDJSON files to process.")
+    
+    patients = extract_ndjson_patients(ndjson_files, workers=workers, chunk_bytes=chunk_bytes)
+    
+    for patient_id, patient_data in sorted(patients.items()):
+        # Name files "<First>_<Last>_<patient_id>.json" like process_fhir_directory does
+        patient_info = patient_data.get("patient") or [{}]
+        name_parts = (patient_info[0].get("name") or "").split()
+        patient_name = f"{name_parts[0]}_{name_parts[-1]}" if len(name_parts) >= 2 else "patient"
+        output_file = os.path.join(output_dir, f"{patient_name}_{patient_id}.json")
+        try:
+            save_patient_record(output_file, patient_data)
         except Exception as e:
-            print(f"Error processing {file_path}: {str(e)}")
+            print(f"Error writing {output_file}: {str(e)}")
     
-    print(f"Completed. Processed {len(fhir_files)} files. Results saved to {output_dir}")
+    print(f"Completed. Wrote {len(patients)} patient files to {output_dir}")
 
 if __name__ == "__main__":
-    import os
-    import sys
+    import argparse
     
     # Default paths
-    fhir_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "fhir"))
-    output_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "patient_data"))
+    default_fhir_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "fhir"))
+    default_output_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "patient_data"))
     
-    # Check command line arguments
-    if len(sys.argv) > 1:
-        fhir_dir = sys.argv[1]
-    if len(sys.argv) > 2:
-        output_dir = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Extract simplified patient data from FHIR bundles")
+    parser.add_argument("fhir_dir", nargs="?", default=default_fhir_dir)
+    parser.add_argument("output_dir", nargs="?", default=default_output_dir)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (0 = one per CPU)")
+    parser.add_argument("--resume", "--incremental", action="store_true",
+                        help="skip bundles whose content hash matches the manifest")
+    parser.add_argument("--manifest", default=None, help="ingest manifest path")
+    parser.add_argument("--ndjson", action="store_true",
+                        help="treat fhir_dir as a FHIR Bulk Data export of NDJSON files")
+    args = parser.parse_args()
     
-    print(f"Processing FHIR files from: {fhir_dir}")
-    print(f"Saving patient data to: {output_dir}")
+    print(f"Processing FHIR files from: {args.fhir_dir}")
+    print(f"Saving patient data to: {args.output_dir}")
     
     # Process the files
-    process_fhir_directory(fhir_dir, output_dir)
-
+    if args.ndjson:
+        process_ndjson_export(args.fhir_dir, args.output_dir, workers=args.workers)
+    else:
+        process_fhir_directory(args.fhir_dir, args.output_dir, workers=args.workers,
+                               manifest_path=args.manifest, resume=args.resume)
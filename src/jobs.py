@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Background job queue for patient indexing
+
+Uploads persist the patient data and enqueue an indexing job instead of
+embedding inside the request. A small pool of worker threads drains the
+queue; job status and progress are kept in memory for the status endpoint.
+
+Jobs for the same patient never run concurrently: a worker that picks up a job
+whose patient is already being indexed parks it and moves on to the next job,
+and the parked job is requeued when the running one finishes. A job submitted
+while another job for the same patient is still queued is merged into it (the
+queued job reads the latest saved data when it starts).
+"""
+
+import itertools
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+INDEXING_WORKERS = int(os.getenv("INDEXING_WORKERS", "2"))
+# Finished jobs kept for status queries
+MAX_FINISHED_JOBS = int(os.getenv("MAX_FINISHED_JOBS", "1000"))
+
+class IndexingJobQueue:
+    """Thread pool running indexing jobs with per-job status and progress"""
+
+    def __init__(self, workers: int = INDEXING_WORKERS, max_finished: int = MAX_FINISHED_JOBS):
+        self.workers = workers
+        self.max_finished = max_finished
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._funcs: Dict[str, Callable] = {}
+        self._queued_by_patient: Dict[str, str] = {}
+        # Patients with a running job, and jobs parked until that job finishes
+        self._running_patients: set = set()
+        self._deferred: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started = False
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"indexing-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, patient_id: str, func: Callable[[Callable[[str, float], None]], Any]) -> str:
+        """
+        Enqueue func for a patient and return the job ID.
+
+        func is called with a progress callback progress(stage, fraction) and its
+        return value is stored as the job result.
+        """
+        self.start()
+        with self._lock:
+            queued_id = self._queued_by_patient.get(patient_id)
+            if queued_id is not None:
+                # Not started yet: run the newest func under the existing job
+                self._funcs[queued_id] = func
+                self._jobs[queued_id]["merged_submissions"] += 1
+                return queued_id
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "patient_id": patient_id,
+                "status": "queued",
+                "stage": "queued",
+                "progress": 0.0,
+                "created_at": datetime.now().isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "duration_s": None,
+                "merged_submissions": 0,
+                "result": None,
+                "error": None,
+            }
+            self._funcs[job_id] = func
+            self._queued_by_patient[patient_id] = job_id
+        self._queue.put(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a snapshot of a job's status, or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+        snapshot["queue_position"] = self._queue_position(job_id) if snapshot["status"] == "queued" else None
+        return snapshot
+
+    def _queue_position(self, job_id: str) -> Optional[int]:
+        with self._queue.mutex:
+            pending = list(self._queue.queue)
+        try:
+            return pending.index(job_id) + 1
+        except ValueError:
+            return None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        counts["workers"] = self.workers
+        return counts
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _worker(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            try:
+                self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id: str) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            patient_id = job["patient_id"]
+            if patient_id in self._running_patients:
+                # Don't hold a worker while another job indexes this patient
+                self._deferred.setdefault(patient_id, []).append(job_id)
+                job["stage"] = "waiting for running job"
+                return
+            self._running_patients.add(patient_id)
+            # From here on, new submissions for the patient get a new job
+            if self._queued_by_patient.get(patient_id) == job_id:
+                del self._queued_by_patient[patient_id]
+            func = self._funcs.pop(job_id)
+            job.update(status="running", stage="starting", started_at=datetime.now().isoformat())
+        start = time.perf_counter()
+
+        def progress(stage: str, fraction: float) -> None:
+            self._update(job_id, stage=stage, progress=round(max(0.0, min(1.0, fraction)), 3))
+
+        try:
+            result = func(progress)
+            self._update(job_id, status="completed", stage="done", progress=1.0, result=result)
+        except Exception as e:
+            print(f"Indexing job {job_id} for patient {patient_id} failed: {e}")
+            traceback.print_exc()
+            self._update(job_id, status="failed", stage="failed", error=str(e))
+        finally:
+            self._update(job_id, finished_at=datetime.now().isoformat(),
+                         duration_s=round(time.perf_counter() - start, 3))
+            with self._lock:
+                self._running_patients.discard(patient_id)
+                deferred = self._deferred.pop(patient_id, [])
+            for deferred_id in deferred:
+                self._queue.put(deferred_id)
+            self._prune()
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond max_finished"""
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job["status"] in ("completed", "failed")]
+            for job_id in itertools.islice(finished, max(0, len(finished) - self.max_finished)):
+                del self._jobs[job_id]
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the workers after the queued jobs finish"""
+        if wait:
+            # Parked jobs are requeued behind the stop sentinels otherwise
+            self._queue.join()
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+_job_queue: Optional[IndexingJobQueue] = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue() -> IndexingJobQueue:
+    """Return the process-wide indexing job queue"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = IndexingJobQueue()
+        return _job_queue
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Per-patient BM25 inverted index over the indexed chunks
+
+Sentence embeddings blur exact clinical terms (drug names, LOINC display
+strings, abbreviations like "IgE"), so a lexical index is built next to the
+vectors at index time. search.py fuses its BM25 scores with vector relevance in
+hybrid retrieval, and answers queries that occur verbatim in enough chunks
+without embedding the query at all.
+
+The index is stored as JSON (ids, texts, metadatas) and the postings are
+rebuilt when it is loaded, which takes milliseconds for a patient's chunks.
+"""
+
+import json
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric tokens (decimal numbers are kept whole)"""
+    return _TOKEN_RE.findall(text.lower())
+
+class LexicalIndex:
+    """BM25 inverted index over one patient's chunks"""
+
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]):
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = list(metadatas)
+        self.tokens = [tokenize(text) for text in self.documents]
+        self.lengths = [len(tokens) for tokens in self.tokens]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        # term -> {doc index: term frequency}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        for doc, tokens in enumerate(self.tokens):
+            for term in tokens:
+                frequencies = self.postings.setdefault(term, {})
+                frequencies[doc] = frequencies.get(doc, 0) + 1
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_chunks(cls, chunks: List[Dict[str, Any]], metadatas: List[Dict[str, Any]]) -> "LexicalIndex":
+        """Build the index from embed.py chunks and their stored metadata"""
+        return cls([c["id"] for c in chunks], [c["text"] for c in chunks], metadatas)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LexicalIndex"]:
+        """Load a saved index, or None if there is none"""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["ids"], data["documents"], data["metadatas"])
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas}, f)
+        os.replace(tmp_path, path)
+
+    def same_contents(self, other: Optional["LexicalIndex"]) -> bool:
+        return (other is not None and self.ids == other.ids and self.documents == other.documents
+                and self.metadatas == other.metadatas)
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1.0 + (len(self.ids) - df + 0.5) / (df + 0.5))
+
+    def _candidates(self, filter_type: Optional[str]) -> Optional[set]:
+        if not filter_type:
+            return None
+        return {i for i, m in enumerate(self.metadatas) if m.get("type") == filter_type}
+
+    def scope_size(self, filter_type: Optional[str] = None) -> int:
+        """Number of documents a filter_type query searches"""
+        allowed = self._candidates(filter_type)
+        return len(self.ids) if allowed is None else len(allowed)
+
+    def scores(self, query: str, filter_type: Optional[str] = None) -> Dict[int, float]:
+        """BM25 score of every document matching at least one query term"""
+        allowed = self._candidates(filter_type)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc, tf in postings.items():
+                if allowed is not None and doc not in allowed:
+                    continue
+                norm = 1.0 - BM25_B + BM25_B * self.lengths[doc] / (self.avg_length or 1.0)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + BM25_K1 * norm)
+        return scores
+
+    def search(self, query: str, n_results: int = 5, filter_type: Optional[str] = None) -> List[Tuple[int, float]]:
+        """Top documents as (doc index, BM25 score), best first"""
+        scores = self.scores(query, filter_type)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:n_results]
+
+    def exact_matches(self, query: str, filter_type: Optional[str] = None) -> List[Tuple[int, float]]:
+        """
+        Documents containing the query's tokens as a contiguous phrase, as
+        (doc index, BM25 score), best first
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        scores = self.scores(query, filter_type)
+        # Only documents containing every term can contain the phrase
+        candidates = set(scores)
+        for term in terms:
+            candidates &= set(self.postings.get(term, ()))
+        width = len(terms)
+        matches = [
+            (doc, scores[doc]) for doc in candidates
+            if any(self.tokens[doc][i:i + width] == terms for i in range(len(self.tokens[doc]) - width + 1))
+        ]
+        return sorted(matches, key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+In-process exact-search index for one patient's chunks
+
+Most patient collections hold a few hundred chunks. At that size one vectorized
+distance computation over a contiguous float32 matrix beats an HNSW lookup plus
+SQLite metadata fetches. NumpyPatientIndex loads a patient's embeddings once
+(from any collection exposing get(include=["embeddings", ...])) and answers
+queries exactly.
+
+Rows are stored grouped by chunk type, so each type is one contiguous block of
+the matrix. A filter_type query scans only its block (a view, no copy): results
+stay exact however selective the filter is, and cost is proportional to the
+partition size rather than the whole patient.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+class NumpyPatientIndex:
+    """Exact squared-L2 nearest-neighbour search over a patient's embeddings"""
+
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+                 embeddings: Any):
+        types = [m.get("type", "") for m in metadatas]
+        # Stable sort by type: one contiguous block per type, original order within it
+        order = sorted(range(len(ids)), key=lambda i: types[i])
+        self.ids = [ids[i] for i in order]
+        self.documents = [documents[i] for i in order]
+        self.metadatas = [metadatas[i] for i in order]
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        self.matrix = np.ascontiguousarray(matrix.reshape(len(order), -1)[order]) if order else matrix.reshape(0, 0)
+        self.sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        # type -> (start, stop) row range of its block
+        self.partitions: Dict[str, Tuple[int, int]] = {}
+        for row, i in enumerate(order):
+            start, _ = self.partitions.get(types[i], (row, row))
+            self.partitions[types[i]] = (start, row + 1)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def partition_sizes(self) -> Dict[str, int]:
+        """Number of chunks of each type"""
+        return {chunk_type: stop - start for chunk_type, (start, stop) in self.partitions.items()}
+
+    @classmethod
+    def from_collection(cls, collection) -> "NumpyPatientIndex":
+        """Load every chunk and embedding of a patient collection"""
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        return cls(data["ids"], data["documents"], data["metadatas"], data["embeddings"])
+
+    def query(self, query_embedding: List[float], n_results: int = 5,
+              filter_type: Optional[str] = None) -> Dict[str, List[List[Any]]]:
+        """
+        Exact top-k by squared L2 distance, optionally restricted to one chunk type.
+        Results have the shape of chromadb's Collection.query for a single query.
+        """
+        return self.query_many([query_embedding], n_results, filter_type)
+
+    def query_many(self, query_embeddings: List[List[float]], n_results: int = 5,
+                   filter_type: Optional[str] = None) -> Dict[str, List[List[Any]]]:
+        """
+        Exact top-k for several queries with one matrix product, in the shape of
+        chromadb's Collection.query (one inner list per query)
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        offset = 0
+        matrix, sq_norms = self.matrix, self.sq_norms
+        if filter_type:
+            offset, stop = self.partitions.get(filter_type, (0, 0))
+            matrix, sq_norms = self.matrix[offset:stop], self.sq_norms[offset:stop]
+
+        results: Dict[str, List[List[Any]]] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        k = min(n_results, len(sq_norms))
+        if k <= 0:
+            for key in results:
+                results[key] = [[] for _ in range(len(queries))]
+            return results
+        distances = sq_norms[None, :] - 2.0 * (queries @ matrix.T) + np.einsum("ij,ij->i", queries, queries)[:, None]
+        for row in distances:
+            top = np.argpartition(row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+            top = top[np.argsort(row[top], kind="stable")]
+            selected = top + offset
+            results["ids"].append([self.ids[i] for i in selected])
+            results["documents"].append([self.documents[i] for i in selected])
+            results["metadatas"].append([self.metadatas[i] for i in selected])
+            results["distances"].append([max(0.0, float(d)) for d in row[top]])
+        return results
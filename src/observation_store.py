@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Columnar, typed storage for a patient's FHIR Observations
+
+The ingester's flattened observation strings ("Heart rate: 77 /min") lose the
+code, numeric value and timestamp. ObservationTable keeps them in parallel
+column arrays so API endpoints can filter and format observations without
+re-parsing strings.
+"""
+
+import math
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Column names, in serialization order. date and time are parsed from effective
+# once at ingest so API endpoints don't parse timestamps per request.
+COLUMNS = ("code", "name", "category", "value", "value_text", "unit", "effective", "date", "time")
+
+def parse_effective(effective: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(YYYY-MM-DD date, 'HH:MM AM' time) of a FHIR timestamp; None for parts it lacks"""
+    if not effective:
+        return None, None
+    try:
+        parsed = datetime.fromisoformat(effective.replace("Z", "+00:00"))
+    except ValueError:
+        return effective[:10], None
+    # Date-only values carry no time of day
+    return parsed.strftime("%Y-%m-%d"), parsed.strftime("%I:%M %p") if "T" in effective else None
+
+class ObservationTable:
+    """
+    Parallel-array table of observations for one patient.
+
+    Numeric values live in an array('d') with NaN for non-numeric results; the
+    other columns are lists of strings (or None).
+    """
+
+    def __init__(self, columns: Optional[Dict[str, List[Any]]] = None):
+        columns = columns or {}
+        self.code: List[Optional[str]] = list(columns.get("code", []))
+        self.name: List[Optional[str]] = list(columns.get("name", []))
+        self.category: List[Optional[str]] = list(columns.get("category", []))
+        self.value = array("d", (math.nan if v is None else v for v in columns.get("value", [])))
+        self.value_text: List[Optional[str]] = list(columns.get("value_text", []))
+        self.unit: List[Optional[str]] = list(columns.get("unit", []))
+        self.effective: List[Optional[str]] = list(columns.get("effective", []))
+        if "date" in columns and "time" in columns:
+            self.date: List[Optional[str]] = list(columns["date"])
+            self.time: List[Optional[str]] = list(columns["time"])
+        else:
+            # Tables stored before date and time were columns
+            parsed = [parse_effective(effective) for effective in self.effective]
+            self.date = [date for date, _ in parsed]
+            self.time = [time for _, time in parsed]
+
+    def __len__(self) -> int:
+        return len(self.code)
+
+    def append(self, code: Optional[str], name: Optional[str], category: Optional[str],
+               value: Optional[float], value_text: Optional[str], unit: Optional[str],
+               effective: Optional[str]) -> None:
+        self.code.append(code)
+        self.name.append(name)
+        self.category.append(category)
+        self.value.append(math.nan if value is None else float(value))
+        self.value_text.append(value_text)
+        self.unit.append(unit)
+        self.effective.append(effective)
+        date, time = parse_effective(effective)
+        self.date.append(date)
+        self.time.append(time)
+
+    def add_resource(self, resource: Dict[str, Any]) -> None:
+        """Append one row per measured value of an Observation (one per component for panels)"""
+        code, name = _coding(resource.get("code", {}))
+        category = None
+        for cat in resource.get("category", []):
+            category = _coding(cat)[0]
+            if category:
+                break
+        effective = resource.get("effectiveDateTime") or resource.get("effectiveInstant") \
+            or resource.get("effectivePeriod", {}).get("start") or resource.get("issued")
+
+        components = resource.get("component") or []
+        if components and not _has_value(resource):
+            for component in components:
+                component_code, component_name = _coding(component.get("code", {}))
+                self.append(component_code, component_name, category, *_value(component), effective)
+        else:
+            self.append(code, name, category, *_value(resource), effective)
+
+    def extend(self, other: "ObservationTable") -> None:
+        """Append all rows of another table"""
+        for column in COLUMNS:
+            getattr(self, column).extend(getattr(other, column))
+
+    def sort(self) -> None:
+        """Order rows by timestamp, then code, so output is deterministic"""
+        def row_key(i: int):
+            value = self.value[i]
+            return (self.effective[i] or "", self.code[i] or "", self.name[i] or "",
+                    math.isnan(value), 0.0 if math.isnan(value) else value,
+                    self.value_text[i] or "", self.unit[i] or "", self.category[i] or "")
+        order = sorted(range(len(self)), key=row_key)
+        for column in COLUMNS:
+            values = getattr(self, column)
+            reordered = [values[i] for i in order]
+            setattr(self, column, array("d", reordered) if column == "value" else reordered)
+
+    def indices(self, category: Optional[str] = None) -> List[int]:
+        """Row indices, optionally restricted to one category (e.g. 'laboratory', 'vital-signs')"""
+        if category is None:
+            return list(range(len(self)))
+        return [i for i, c in enumerate(self.category) if c == category]
+
+    def bare_value(self, i: int) -> str:
+        """Value of row i without its unit, e.g. '77' or 'Negative'"""
+        value = self.value[i]
+        if not math.isnan(value):
+            return f"{value:g}"
+        return self.value_text[i] or ""
+
+    def display_value(self, i: int) -> str:
+        """Human-readable value of row i, e.g. '77 /min' or 'Negative'"""
+        text = self.bare_value(i)
+        unit = self.unit[i]
+        return f"{text} {unit}".strip() if unit else text
+
+    def rows(self, category: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Iterate rows as dictionaries"""
+        for i in self.indices(category):
+            yield {column: self._cell(column, i) for column in COLUMNS}
+
+    def _cell(self, column: str, i: int) -> Any:
+        value = getattr(self, column)[i]
+        if column == "value" and math.isnan(value):
+            return None
+        return value
+
+    def coalesce(self, min_count: int = 2) -> Tuple[List[Dict[str, Any]], List[int]]:
+        """
+        Fold repeated numeric measurements of the same code and unit into series.
+
+        Returns:
+            (series, leftover row indices). Each series dict holds code, name, unit,
+            category, count, min, max, first/latest value and timestamp, trend
+            ('rising', 'falling' or 'stable') and points [[effective, value], ...]
+            in time order. Rows that are non-numeric or whose code was measured
+            fewer than min_count times are returned as leftovers.
+        """
+        groups: Dict[Tuple[str, str], List[int]] = {}
+        leftovers = []
+        for i in range(len(self)):
+            key = self.code[i] or self.name[i]
+            if key is None or math.isnan(self.value[i]):
+                leftovers.append(i)
+                continue
+            groups.setdefault((key, self.unit[i] or ""), []).append(i)
+
+        series = []
+        for (_, unit), rows in groups.items():
+            if len(rows) < min_count:
+                leftovers.extend(rows)
+                continue
+            rows.sort(key=lambda i: self.effective[i] or "")
+            values = [self.value[i] for i in rows]
+            low, high = min(values), max(values)
+            half = max(1, len(values) // 2)
+            delta = sum(values[-half:]) / half - sum(values[:half]) / half
+            if high == low or abs(delta) < 0.1 * (high - low):
+                trend = "stable"
+            else:
+                trend = "rising" if delta > 0 else "falling"
+            first, last = rows[0], rows[-1]
+            series.append({
+                "code": self.code[last],
+                "name": self.name[last],
+                "unit": unit or None,
+                "category": self.category[last],
+                "count": len(rows),
+                "min": low,
+                "max": high,
+                "first": self.value[first],
+                "first_effective": self.effective[first],
+                "latest": self.value[last],
+                "latest_effective": self.effective[last],
+                "trend": trend,
+                "points": [[self.effective[i], self.value[i]] for i in rows],
+            })
+        series.sort(key=lambda s: (s["name"] or "", s["code"] or "", s["unit"] or ""))
+        leftovers.sort()
+        return series, leftovers
+
+    def to_dict(self) -> Dict[str, List[Any]]:
+        """Serialize to a JSON-compatible dict of columns (NaN values become None)"""
+        columns = {column: list(getattr(self, column)) for column in COLUMNS}
+        columns["value"] = [None if math.isnan(v) else v for v in self.value]
+        return columns
+
+    @classmethod
+    def from_dict(cls, columns: Dict[str, List[Any]]) -> "ObservationTable":
+        return cls(columns)
+
+def _coding(concept: Dict[str, Any]):
+    """Return (code, display text) of a CodeableConcept"""
+    codings = concept.get("coding") or [{}]
+    code = codings[0].get("code")
+    name = concept.get("text") or codings[0].get("display")
+    return code, name
+
+def _has_value(resource: Dict[str, Any]) -> bool:
+    return any(key in resource for key in ("valueQuantity", "valueString", "valueCodeableConcept"))
+
+def _value(resource: Dict[str, Any]):
+    """Return (numeric value, text value, unit) of an Observation or component"""
+    if "valueQuantity" in resource:
+        quantity = resource["valueQuantity"]
+        value = quantity.get("value")
+        unit = quantity.get("unit") or quantity.get("code")
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value, None, unit
+        return None, None if value is None else str(value), unit
+    if "valueString" in resource:
+        return None, resource.get("valueString"), None
+    if "valueCodeableConcept" in resource:
+        return None, _coding(resource["valueCodeableConcept"])[1], None
+    return None, None, None
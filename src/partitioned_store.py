@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Per-type partitioned collections for the per_patient chroma layout
+
+A patient's chunks are stored in one ChromaDB collection per chunk type
+("type_conditions_<hash>", ...) inside their database directory.
+A filter_type query then searches that type's own HNSW index instead of
+post-filtering the patient's whole collection, and nothing is held in memory
+beyond what chromadb itself caches. PartitionedCollection exposes the
+Collection methods used by embed.py and search.py; unfiltered queries fan out
+over the partitions and merge their hits by distance.
+
+Databases written before partitioning hold a single collection named after the
+patient. Opening one for writing moves its items into partitions; readers use
+the single collection until then.
+"""
+
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import chromadb
+
+from patient_db_utils import get_partition_collection_name
+
+def where_type(where: Optional[Dict[str, Any]]) -> Optional[str]:
+    """The chunk type a where filter is restricted to, or None if it allows several"""
+    if not where:
+        return None
+    for key, condition in where.items():
+        if key == "$and":
+            for clause in condition:
+                found = where_type(clause)
+                if found is not None:
+                    return found
+        elif key == "type":
+            if isinstance(condition, str):
+                return condition
+            if isinstance(condition, dict) and isinstance(condition.get("$eq"), str):
+                return condition["$eq"]
+    return None
+
+class PartitionedCollection:
+    """One patient's chunks split into one chroma collection per chunk type"""
+
+    def __init__(self, client, embedding_function, name: str):
+        self.client = client
+        self.embedding_function = embedding_function
+        self.name = name
+        self._lock = threading.Lock()
+        # chunk type -> collection
+        self._partitions: Dict[str, Any] = {}
+        for collection in client.list_collections():
+            chunk_type = (collection.metadata or {}).get("chunk_type")
+            if chunk_type is not None:
+                self._partitions[chunk_type] = client.get_collection(
+                    name=collection.name, embedding_function=embedding_function)
+
+    def _partition(self, chunk_type: str):
+        with self._lock:
+            collection = self._partitions.get(chunk_type)
+            if collection is None:
+                collection = self.client.get_or_create_collection(
+                    name=get_partition_collection_name(chunk_type),
+                    embedding_function=self.embedding_function,
+                    metadata={"chunk_type": chunk_type}
+                )
+                self._partitions[chunk_type] = collection
+            return collection
+
+    def _selected(self, where: Optional[Dict[str, Any]]) -> List[Any]:
+        """Partitions a where filter can match (only one for a type filter)"""
+        chunk_type = where_type(where)
+        with self._lock:
+            if chunk_type is not None:
+                return [self._partitions[chunk_type]] if chunk_type in self._partitions else []
+            return [self._partitions[t] for t in sorted(self._partitions)]
+
+    def count(self) -> int:
+        return sum(collection.count() for collection in self._selected(None))
+
+    def get(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, include: Sequence[str] = ("documents", "metadatas")) -> Dict[str, Any]:
+        merged: Dict[str, Any] = {"ids": []}
+        for key in ("documents", "metadatas", "embeddings"):
+            merged[key] = [] if key in include else None
+        for collection in self._selected(where):
+            remaining = None if limit is None else limit - len(merged["ids"])
+            if remaining is not None and remaining <= 0:
+                break
+            result = collection.get(ids=ids, where=where, limit=remaining, include=list(include))
+            merged["ids"].extend(result["ids"])
+            for key in ("documents", "metadatas", "embeddings"):
+                if merged[key] is not None:
+                    merged[key].extend(result[key])
+        return merged
+
+    def peek(self, limit: int = 10) -> Dict[str, Any]:
+        return self.get(limit=limit)
+
+    def _grouped(self, metadatas: Sequence[Dict[str, Any]]) -> Dict[str, List[int]]:
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(metadata.get("type", "unknown"), []).append(i)
+        return groups
+
+    def upsert(self, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[Dict[str, Any]],
+               embeddings: Optional[Sequence[Sequence[float]]] = None) -> None:
+        for chunk_type, rows in self._grouped(metadatas).items():
+            self._partition(chunk_type).upsert(
+                ids=[ids[i] for i in rows],
+                documents=[documents[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows] if embeddings is not None else None
+            )
+
+    add = upsert
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        if ids is not None and not ids:
+            return
+        for collection in self._selected(where):
+            if ids is None and where is None:
+                # Drop the whole partition rather than deleting item by item
+                with self._lock:
+                    self._partitions = {t: c for t, c in self._partitions.items() if c is not collection}
+                self.client.delete_collection(name=collection.name)
+            else:
+                collection.delete(ids=ids, where=where)
+
+    def query(self, query_texts: Optional[Sequence[str]] = None,
+              query_embeddings: Optional[Sequence[Sequence[float]]] = None,
+              n_results: int = 10, where: Optional[Dict[str, Any]] = None) -> Dict[str, List[List[Any]]]:
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(list(query_texts))
+        # (distance, id, document, metadata) hits of every partition, per query
+        hits: List[List[tuple]] = [[] for _ in query_embeddings]
+        for collection in self._selected(where):
+            available = collection.count()
+            if not available:
+                continue
+            result = collection.query(query_embeddings=query_embeddings, n_results=min(n_results, available),
+                                      where=where)
+            for q, per_query in enumerate(hits):
+                per_query.extend(zip(result["distances"][q], result["ids"][q],
+                                     result["documents"][q], result["metadatas"][q]))
+
+        merged: Dict[str, List[List[Any]]] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for per_query in hits:
+            top = sorted(per_query, key=lambda hit: (hit[0], hit[1]))[:n_results]
+            merged["distances"].append([hit[0] for hit in top])
+            merged["ids"].append([hit[1] for hit in top])
+            merged["documents"].append([hit[2] for hit in top])
+            merged["metadatas"].append([hit[3] for hit in top])
+        return merged
+
+def get_partitioned_collection(patient_db_path: str, collection_name: str, embedding_function,
+                               create: bool = True):
+    """
+    Open a patient's partitioned collection
+
+    Args:
+        patient_db_path: The patient's database directory
+        collection_name: The patient's collection name (the unpartitioned collection of older databases)
+        embedding_function: Embedding function of the collections
+        create: Open for writing: an unpartitioned collection is moved into partitions.
+            Readers get the unpartitioned collection as-is, or None if there is neither.
+    """
+    client = chromadb.PersistentClient(path=patient_db_path)
+    partitioned = PartitionedCollection(client, embedding_function, collection_name)
+    try:
+        legacy = client.get_collection(name=collection_name, embedding_function=embedding_function)
+    except Exception:
+        legacy = None
+
+    if legacy is not None and not create:
+        return legacy
+    if legacy is not None:
+        items = legacy.get(include=["documents", "metadatas", "embeddings"])
+        if items["ids"]:
+            print(f"Partitioning {len(items['ids'])} items of collection {collection_name} by type")
+            partitioned.upsert(ids=items["ids"], documents=items["documents"],
+                               metadatas=items["metadatas"], embeddings=items["embeddings"])
+        client.delete_collection(name=collection_name)
+    if not create and partitioned.count() == 0:
+        return None
+    return partitioned
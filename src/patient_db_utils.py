@@ -4,7 +4,22 @@ Shared utilities for patient-specific vector databases
 """
 
 import hashlib
+import os
 import re
+import threading
+from typing import Callable, List, Optional
+
+# Vector storage backend for patient collections: "chroma" or "int8" (see quantized_store.py)
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "chroma")
+# PCA target dimension for int8 storage (0 keeps the full embedding dimension)
+QUANTIZED_DIMENSIONS = int(os.getenv("QUANTIZED_DIMENSIONS", "0"))
+# "per_patient": one database directory per patient; "sharded": patients are
+# hash-partitioned into VECTOR_SHARDS shared collections (see sharded_store.py)
+VECTOR_STORE_LAYOUT = os.getenv("VECTOR_STORE_LAYOUT", "per_patient")
+VECTOR_SHARDS = int(os.getenv("VECTOR_SHARDS", "16"))
+# per_patient chroma storage: one collection per chunk type, so filter_type queries
+# search only that type's index (see partitioned_store.py)
+VECTOR_TYPE_PARTITIONS = os.getenv("VECTOR_TYPE_PARTITIONS", "true").lower() == "true"
 
 def get_patient_collection_name(patient_id: str) -> str:
     """Generate a valid ChromaDB collection name for a patient
@@ -32,8 +47,65 @@ def get_patient_collection_name(patient_id: str) -> str:
     
     return collection_name
 
+def get_partition_collection_name(chunk_type: str) -> str:
+    """Collection name of one chunk type's partition inside a patient's database"""
+    part = re.sub(r'[^a-zA-Z0-9]+', '_', chunk_type).strip('_')[:40] or "unknown"
+    digest = hashlib.md5(chunk_type.encode()).hexdigest()[:6]
+    return f"type_{part}_{digest}"
+
 def get_patient_db_path(patient_id: str) -> str:
     """Get the path for a specific patient's vector database"""
     import os
     VECTOR_DB_BASE_DIR = "./patient_vectors"
-    return os.path.join(VECTOR_DB_BASE_DIR, f"patient_{patient_id}")
\ No newline at end of file
+    return os.path.join(VECTOR_DB_BASE_DIR, f"patient_{patient_id}")
+
+def get_patient_shard(patient_id: str, shards: int = None) -> int:
+    """Shard number of a patient in the sharded layout (stable across processes)"""
+    shards = shards or VECTOR_SHARDS
+    return int(hashlib.md5(patient_id.encode()).hexdigest()[:8], 16) % shards
+
+def get_shard_db_path(shard: int) -> str:
+    """Get the path of a shard's vector database in the sharded layout"""
+    return os.path.join("./patient_vectors", "shards", f"shard_{shard:03d}")
+
+def get_shard_collection_name(shard: int) -> str:
+    return f"patient_shard_{shard:03d}"
+
+def file_version(path: str) -> str:
+    """Version stamp of a file (modification time and size), taken without reading it"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "none"
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+def get_lexical_index_path(patient_id: str) -> str:
+    """Get the path of a patient's BM25 lexical index (kept outside the vector store, whatever the layout)"""
+    return os.path.join("./patient_vectors", "lexical", f"{get_patient_collection_name(patient_id)}.json")
+
+_embedding_function = None
+_embedding_function_lock = threading.Lock()
+
+def get_embedding_function():
+    """Return the process-wide embedding function (the ONNX model is loaded once)"""
+    global _embedding_function
+    with _embedding_function_lock:
+        if _embedding_function is None:
+            from chromadb.utils import embedding_functions
+            _embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    return _embedding_function
+
+_invalidation_hooks: List[Callable[[Optional[str]], None]] = []
+
+def register_invalidation_hook(hook: Callable[[Optional[str]], None]) -> None:
+    """Register a callback run with a patient_id whenever that patient's vectors change (None = all patients)"""
+    if hook not in _invalidation_hooks:
+        _invalidation_hooks.append(hook)
+
+def notify_patient_updated(patient_id: Optional[str] = None) -> None:
+    """Tell registered caches that a patient's vectors were rewritten (None = all patients)"""
+    for hook in list(_invalidation_hooks):
+        try:
+            hook(patient_id)
+        except Exception as e:
+            print(f"Warning: invalidation hook failed for patient {patient_id}: {e}")
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Compact int8 vector storage for patient collections
+
+An alternative to a ChromaDB collection for one patient. Vectors are stored
+int8-quantized (one float32 scale per vector), optionally reduced with PCA, and
+scanned from a memory-mapped file, so the store is about a quarter of the
+float32 size (less with PCA). No float32 copy is kept per patient: the top
+candidates of the approximate scan are rescored exactly against full-precision
+vectors looked up by document text through rescore_fn (embed.embed_texts,
+served from the shared embedding cache that indexing filled).
+
+Vector files are append-only: upserts append rows, replaced and deleted items
+leave dead rows that are compacted away once they outnumber the live ones, and
+the PCA projection is fitted once, on the first batch written (rebuild() refits
+it from vectors fetched through rescore_fn).
+
+QuantizedStore implements the subset of the chromadb Collection API used by
+embed.py and search.py (get, upsert, add, delete, query, count), returning
+results in the same shape and with the same squared-L2 distances.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Directory name of the int8 store inside a patient's vector database directory
+QUANTIZED_DIRNAME = "int8"
+ITEMS_FILE = "items.json"
+# Append-only row files
+CODES_FILE = "codes.i8"
+SCALES_FILE = "scales.f32"
+NORMS_FILE = "norms.f32"
+# Dead rows tolerated before compaction (or as many as there are live rows, if more)
+MIN_COMPACT_ROWS = 256
+# Candidates rescored at full precision per requested result (at least MIN_RESCORE)
+RESCORE_FACTOR = 4
+MIN_RESCORE = 32
+# int8 rows converted to float32 at a time by the approximate scan
+SCAN_BLOCK_ROWS = 4096
+
+def metadata_matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate a chromadb-style where filter ($and, $or, $eq, $ne, $in, $nin) on metadata"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(metadata_matches(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(metadata_matches(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if op == "$eq":
+                    ok = value == operand
+                elif op == "$ne":
+                    ok = value != operand
+                elif op == "$in":
+                    ok = value in operand
+                elif op == "$nin":
+                    ok = value not in operand
+                else:
+                    raise ValueError(f"Unsupported where operator: {op}")
+                if not ok:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 quantization; returns (codes, scales)"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+def fit_pca(vectors: np.ndarray, dimensions: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (mean, components) projecting vectors onto their top principal directions"""
+    mean = vectors.mean(axis=0)
+    _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+    return mean.astype(np.float32), vt[:dimensions].astype(np.float32)
+
+class QuantizedStore:
+    """int8-quantized, optionally PCA-reduced vector store for one patient"""
+
+    def __init__(self, path: str, embedding_function=None, dimensions: int = 0,
+                 rescore_fn: Optional[Callable[[List[str]], List[List[float]]]] = None):
+        """
+        Args:
+            path: Directory holding the store's files
+            embedding_function: Used to embed query_texts in query()
+            dimensions: PCA target dimension when the store is created (0 keeps all)
+            rescore_fn: Returns the full-precision embedding of each document text, used
+                to rescore query candidates and by rebuild() (typically embed.embed_texts)
+        """
+        self.path = path
+        self.embedding_function = embedding_function
+        self.dimensions = dimensions
+        self.rescore_fn = rescore_fn
+        self._lock = threading.RLock()
+        self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self) -> None:
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.row_of = np.zeros(0, dtype=np.int64)
+        self.total_rows = 0
+        self.dim = self.full_dim = None
+        self.codes = self.scales = self.norms = None
+        self.mean = self.components = None
+        self._index: Dict[str, int] = {}
+        if os.path.exists(self._file("codes.npy")):
+            self._migrate()
+        if os.path.exists(self._file(ITEMS_FILE)):
+            with open(self._file(ITEMS_FILE), "r", encoding="utf-8") as f:
+                items = json.load(f)
+            self.ids = items["ids"]
+            self.documents = items["documents"]
+            self.metadatas = items["metadatas"]
+            self.row_of = np.asarray(items["rows"], dtype=np.int64)
+            self.total_rows = items["total_rows"]
+            self.dim = items["dim"]
+            self.full_dim = items["full_dim"]
+        if os.path.exists(self._file("pca.npz")):
+            with np.load(self._file("pca.npz")) as pca:
+                self.mean = pca["mean"]
+                self.components = pca["components"]
+        self._map()
+        self._index = {item_id: i for i, item_id in enumerate(self.ids)}
+
+    def _map(self) -> None:
+        """Map the first total_rows rows of the vector files"""
+        self.codes = None
+        if not self.total_rows:
+            return
+        rows = self.total_rows
+        self.codes = np.memmap(self._file(CODES_FILE), dtype=np.int8, mode="r", shape=(rows, self.dim))
+        self.scales = np.fromfile(self._file(SCALES_FILE), dtype=np.float32, count=rows)
+        self.norms = np.fromfile(self._file(NORMS_FILE), dtype=np.float32, count=rows)
+
+    def _save_items(self) -> None:
+        tmp = self._file(ITEMS_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas,
+                       "rows": self.row_of.tolist(), "total_rows": self.total_rows, "dim": self.dim,
+                       "full_dim": self.full_dim}, f)
+        os.replace(tmp, self._file(ITEMS_FILE))
+
+    def _migrate(self) -> None:
+        """Convert a store written by the earlier whole-file format, dropping its float32 copy"""
+        with open(self._file(ITEMS_FILE), "r", encoding="utf-8") as f:
+            items = json.load(f)
+        full = np.load(self._file("full.npy")) if items["ids"] else None
+        for name in ("codes.npy", "scales.npy", "norms.npy", "full.npy", "pca.npz", ITEMS_FILE):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        if full is not None:
+            self._append(items["ids"], items["documents"], items["metadatas"], full)
+        self._save_items()
+
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors if self.components is None else (vectors - self.mean) @ self.components.T
+
+    def _residual(self, vectors: np.ndarray, projected: np.ndarray) -> np.ndarray:
+        """Squared norm of the part of each vector that PCA drops"""
+        if self.components is None:
+            return np.zeros(len(vectors), dtype=np.float32)
+        centered = np.square(vectors - self.mean).sum(axis=-1)
+        return np.maximum(centered - np.square(projected).sum(axis=-1), 0.0).astype(np.float32)
+
+    def _append(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+                full: np.ndarray) -> None:
+        """Append vectors as new rows and point the items at them (replacing existing items)"""
+        os.makedirs(self.path, exist_ok=True)
+        full = np.ascontiguousarray(full, dtype=np.float32)
+        if self.dim is None:
+            # First write fixes the layout: fit PCA once, on this batch
+            self.full_dim = full.shape[1]
+            if self.dimensions and self.dimensions < full.shape[1] and len(full) >= self.dimensions:
+                self.mean, self.components = fit_pca(full, self.dimensions)
+                np.savez(self._file("pca.tmp.npz"), mean=self.mean, components=self.components)
+                os.replace(self._file("pca.tmp.npz"), self._file("pca.npz"))
+            elif self.dimensions and self.dimensions < full.shape[1]:
+                print(f"Only {len(full)} vectors in the first batch of {self.path}; "
+                      f"storing {full.shape[1]} dimensions until rebuild()")
+            self.dim = full.shape[1] if self.components is None else self.components.shape[0]
+        projected = self._project(full)
+        codes, scales = quantize(projected)
+        # ||v - mean||^2 in the reduced basis (dequantized) plus the residual PCA drops,
+        # so approximate distances stay comparable to full squared L2 distances
+        norms = ((scales ** 2) * np.square(codes.astype(np.float32)).sum(axis=1)
+                 + self._residual(full, projected)).astype(np.float32)
+
+        # Release the map, drop rows beyond total_rows left by an interrupted write, append
+        self.codes = None
+        arrays = [(CODES_FILE, codes, self.dim), (SCALES_FILE, scales, 1), (NORMS_FILE, norms, 1)]
+        for name, array, width in arrays:
+            with open(self._file(name), "ab") as f:
+                f.truncate(self.total_rows * width * array.dtype.itemsize)
+                f.write(np.ascontiguousarray(array).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        row_of = self.row_of.tolist()
+        for offset, (item_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+            row = self.total_rows + offset
+            i = self._index.get(item_id)
+            if i is None:
+                self._index[item_id] = len(self.ids)
+                self.ids.append(item_id)
+                self.documents.append(document)
+                self.metadatas.append(metadata)
+                row_of.append(row)
+            else:
+                self.documents[i] = document
+                self.metadatas[i] = metadata
+                row_of[i] = row
+        self.row_of = np.asarray(row_of, dtype=np.int64)
+        self.total_rows += len(full)
+
+    def _commit(self) -> None:
+        """Compact when dead rows dominate, then publish the item list"""
+        dead = self.total_rows - len(self.ids)
+        if dead > max(MIN_COMPACT_ROWS, len(self.ids)):
+            self.compact()
+            return
+        self._save_items()
+        self._map()
+
+    def compact(self) -> None:
+        """Rewrite the vector files keeping only live rows (PCA and quantization unchanged)"""
+        with self._lock:
+            if self.total_rows == len(self.ids) and np.array_equal(self.row_of, np.arange(len(self.ids))):
+                return
+            self._map()
+            arrays = [(CODES_FILE, self.codes), (SCALES_FILE, self.scales), (NORMS_FILE, self.norms)]
+            live = [np.ascontiguousarray(array[self.row_of]) for _, array in arrays]
+            self.codes = None
+            for (name, _), array in zip(arrays, live):
+                with open(self._file(name + ".tmp"), "wb") as f:
+                    f.write(array.tobytes())
+                os.replace(self._file(name + ".tmp"), self._file(name))
+            self.row_of = np.arange(len(self.ids), dtype=np.int64)
+            self.total_rows = len(self.ids)
+            self._save_items()
+            self._map()
+
+    def rebuild(self, dimensions: Optional[int] = None) -> None:
+        """Refit PCA and requantize every item from full-precision vectors (requires rescore_fn)"""
+        with self._lock:
+            if self.rescore_fn is None:
+                raise ValueError(f"Store {self.path} has no rescore_fn to fetch full-precision vectors from")
+            if dimensions is not None:
+                self.dimensions = dimensions
+            ids, documents, metadatas = list(self.ids), list(self.documents), list(self.metadatas)
+            full = np.asarray(self.rescore_fn(documents), dtype=np.float32) if ids else None
+            self.codes = None
+            for name in (CODES_FILE, SCALES_FILE, NORMS_FILE, "pca.npz"):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            self.ids, self.documents, self.metadatas = [], [], []
+            self.row_of = np.zeros(0, dtype=np.int64)
+            self.total_rows = 0
+            self.dim = self.full_dim = None
+            self.mean = self.components = None
+            self._index = {}
+            if full is not None:
+                self._append(ids, documents, metadatas, full)
+            self._save_items()
+            self._map()
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def _rows(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None) -> List[int]:
+        if ids is not None:
+            rows = [self._index[i] for i in ids if i in self._index]
+        else:
+            rows = list(range(len(self.ids)))
+        if where:
+            rows = [i for i in rows if metadata_matches(self.metadatas[i], where)]
+        return rows
+
+    def _vectors(self, items: Sequence[int]) -> np.ndarray:
+        """float32 vectors of items: full precision through rescore_fn, else dequantized (and un-projected)"""
+        if self.rescore_fn is not None:
+            return np.asarray(self.rescore_fn([self.documents[i] for i in items]), dtype=np.float32)
+        rows = self.row_of[list(items)]
+        vectors = self.codes[rows].astype(np.float32) * self.scales[rows][:, None]
+        return vectors if self.components is None else vectors @ self.components + self.mean
+
+    def get(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, include: Sequence[str] = ("documents", "metadatas")) -> Dict[str, Any]:
+        """Return stored items in the shape of chromadb's Collection.get"""
+        with self._lock:
+            rows = self._rows(ids, where)[:limit]
+            result: Dict[str, Any] = {"ids": [self.ids[i] for i in rows]}
+            result["documents"] = [self.documents[i] for i in rows] if "documents" in include else None
+            result["metadatas"] = [self.metadatas[i] for i in rows] if "metadatas" in include else None
+            if "embeddings" in include:
+                result["embeddings"] = self._vectors(rows).tolist() if rows else []
+            return result
+
+    def peek(self, limit: int = 10) -> Dict[str, Any]:
+        return self.get(limit=limit)
+
+    def upsert(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]],
+               documents: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        """Insert or replace items (precomputed embeddings are required)"""
+        if not ids:
+            return
+        with self._lock:
+            # Last occurrence wins for ids repeated within one call
+            latest = {item_id: i for i, item_id in enumerate(ids)}
+            order = sorted(latest.values())
+            self._append([ids[i] for i in order], [documents[i] for i in order], [metadatas[i] for i in order],
+                         np.asarray([embeddings[i] for i in order], dtype=np.float32))
+            self._commit()
+
+    add = upsert
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            removed = set(self._rows(ids, where))
+            if not removed:
+                return
+            keep = [i for i in range(len(self.ids)) if i not in removed]
+            self.ids = [self.ids[i] for i in keep]
+            self.documents = [self.documents[i] for i in keep]
+            self.metadatas = [self.metadatas[i] for i in keep]
+            self.row_of = self.row_of[keep]
+            self._index = {item_id: i for i, item_id in enumerate(self.ids)}
+            self._commit()
+
+    def query(self, query_texts: Optional[Sequence[str]] = None,
+              query_embeddings: Optional[Sequence[Sequence[float]]] = None,
+              n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+              rescore: bool = True) -> Dict[str, List[List[Any]]]:
+        """
+        Nearest neighbours by squared L2 distance, in the shape of chromadb's Collection.query.
+        Candidates come from the int8 scan and are rescored against full-precision vectors
+        from rescore_fn (rescore=False, or a store without rescore_fn, ranks by the int8
+        approximation alone).
+        """
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(list(query_texts))
+        results: Dict[str, List[List[Any]]] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._lock:
+            rows = np.asarray(self._rows(where=where), dtype=np.int64)
+            for query in query_embeddings:
+                query = np.asarray(query, dtype=np.float32)
+                selected, distances = (self._search(query, rows, n_results,
+                                                    rescore and self.rescore_fn is not None)
+                                       if rows.size else ([], []))
+                results["ids"].append([self.ids[i] for i in selected])
+                results["documents"].append([self.documents[i] for i in selected])
+                results["metadatas"].append([self.metadatas[i] for i in selected])
+                results["distances"].append([float(d) for d in distances])
+        return results
+
+    def _approximate(self, reduced: np.ndarray, physical: Optional[np.ndarray]) -> np.ndarray:
+        """||q - v||^2 up to the query's constant, from the int8 codes (all rows, or the given rows)"""
+        count = self.total_rows if physical is None else physical.size
+        dots = np.empty(count, dtype=np.float32)
+        # Upcast the int8 codes one block at a time instead of the whole matrix
+        for start in range(0, count, SCAN_BLOCK_ROWS):
+            stop = min(start + SCAN_BLOCK_ROWS, count)
+            block = self.codes[start:stop] if physical is None else self.codes[physical[start:stop]]
+            dots[start:stop] = block.astype(np.float32) @ reduced
+        scales = self.scales if physical is None else self.scales[physical]
+        norms = self.norms if physical is None else self.norms[physical]
+        return norms - 2.0 * scales * dots
+
+    def _search(self, query: np.ndarray, rows: np.ndarray, n_results: int, rescore: bool = True):
+        reduced = self._project(query)
+        physical = self.row_of[rows]
+        # Every row live and in order: scan the maps without gathering
+        dense = physical.size == self.total_rows and np.array_equal(physical, np.arange(self.total_rows))
+        approx = self._approximate(reduced, None if dense else physical)
+
+        k = min(n_results, rows.size)
+        if not rescore:
+            order = np.argsort(approx, kind="stable")[:k]
+            constant = float(reduced @ reduced) + float(self._residual(query[None, :], reduced[None, :])[0])
+            return rows[order].tolist(), (approx[order] + constant).tolist()
+
+        candidate_count = min(rows.size, max(k * RESCORE_FACTOR, MIN_RESCORE))
+        if candidate_count < rows.size:
+            candidates = np.sort(rows[np.argpartition(approx, candidate_count - 1)[:candidate_count]])
+        else:
+            candidates = rows
+        exact = np.square(self._vectors(candidates) - query).sum(axis=1)
+        order = np.argsort(exact, kind="stable")[:k]
+        return candidates[order].tolist(), exact[order].tolist()
+
+    def disk_bytes(self) -> int:
+        """Total size of the store's files"""
+        if not os.path.isdir(self.path):
+            return 0
+        return sum(os.path.getsize(self._file(name)) for name in os.listdir(self.path))
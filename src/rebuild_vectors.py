@@ -3,27 +3,51 @@
 Script to rebuild the vector database with proper patient isolation
 """
 
+import argparse
 import json
 import os
 from pathlib import Path
 import shutil
-from embed import index_patient_data
+import sys
+import time
+from embed import delete_patient_vectors, embed_texts, prepare_patient_index, write_patient_chunks
+from ingest_manifest import IngestManifest, file_sha256
+from patient_db_utils import notify_patient_updated
+from vocabulary import load_patient_record
+
+VECTOR_DB_BASE_DIR = "./patient_vectors"
+INDEX_MANIFEST_PATH = os.path.join(VECTOR_DB_BASE_DIR, "index_manifest.sqlite3")
+# Distinct chunk texts collected across patients before each embedding call
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "2048"))
 
 def clear_vector_database():
     """Clear the entire vector database"""
-    vector_db_path = Path("./patient_vectors")
+    vector_db_path = Path(VECTOR_DB_BASE_DIR)
     if vector_db_path.exists():
         print(f"Clearing existing vector database at {vector_db_path}")
         shutil.rmtree(vector_db_path)
+        notify_patient_updated(None)
         print("Vector database cleared.")
     else:
         print("No existing vector database found.")
 
-def rebuild_patient_vectors():
-    """Rebuild vector database with proper patient isolation"""
+def rebuild_patient_vectors(incremental: bool = False, batch_size: int = EMBED_BATCH_SIZE):
+    """
+    Rebuild vector database with proper patient isolation
+    
+    Chunks from many patients are collected into deduplicated batches of up to
+    batch_size distinct texts, embedded in one call per batch, and the precomputed
+    embeddings are then written to each patient's collection.
+    
+    Args:
+        incremental: Keep the existing database and only re-index patient files whose
+            content hash changed since the last run (new, changed or removed files)
+        batch_size: Distinct chunk texts per embedding batch
+    """
     
     # Clear existing database
-    clear_vector_database()
+    if not incremental:
+        clear_vector_database()
     
     # Get all patient files
     patient_dir = Path("patient_data")
@@ -34,30 +58,100 @@ def rebuild_patient_vectors():
     patient_files = list(patient_dir.glob("*.json"))
     print(f"Found {len(patient_files)} patient files to process")
     
+    os.makedirs(VECTOR_DB_BASE_DIR, exist_ok=True)
+    manifest = IngestManifest(INDEX_MANIFEST_PATH)
+    recorded_hashes = manifest.get_hashes()
+    
     success_count = 0
+    skipped_count = 0
     error_count = 0
-    
-    for patient_file in patient_files:
+    chunk_count = 0
+    embedded_count = 0
+    start_time = time.perf_counter()
+    
+    # Patients waiting for the current embedding batch: (file, patient_id, sha256, collection, chunks)
+    pending = []
+    pending_texts = {}  # insertion-ordered set of distinct texts in the batch
+    
+    def flush_batch():
+        nonlocal success_count, error_count, chunk_count, embedded_count
+        if not pending:
+            return
+        texts = list(pending_texts)
         try:
-            patient_id = patient_file.stem  # Use filename without extension as patient_id
-            print(f"\nProcessing patient: {patient_id}")
-            
-            # Load patient data
-            with open(patient_file, 'r') as f:
-                patient_data = json.load(f)
-            
-            # Index with proper patient_id
-            index_patient_data(patient_data, patient_id)
-            success_count += 1
-            print(f"Successfully indexed patient: {patient_id}")
-            
+            embeddings = dict(zip(texts, embed_texts(texts)))
         except Exception as e:
-            print(f"Error processing {patient_file.name}: {e}")
-            error_count += 1
-    
+            print(f"Error embedding batch of {len(texts)} texts: {e}")
+            error_count += len(pending)
+            pending.clear()
+            pending_texts.clear()
+            return
+        embedded_count += len(texts)
+        
+        for patient_file, patient_id, sha256, collection, chunks in pending:
+            try:
+                write_patient_chunks(collection, chunks, [embeddings[c["text"]] for c in chunks])
+                manifest.record_source(patient_file.name, sha256, patient_id)
+                success_count += 1
+                chunk_count += len(chunks)
+                print(f"Successfully indexed patient: {patient_id} ({len(chunks)} chunks written)")
+            except Exception as e:
+                print(f"Error processing {patient_file.name}: {e}")
+                error_count += 1
+        manifest.commit()
+        pending.clear()
+        pending_texts.clear()
+        
+        elapsed = time.perf_counter() - start_time
+        print(f"Batch done: {chunk_count} chunks written so far "
+              f"({chunk_count / elapsed if elapsed else 0:.1f} chunks/s)")
+    
+    try:
+        for patient_file in patient_files:
+            try:
+                patient_id = patient_file.stem  # Use filename without extension as patient_id
+                sha256 = file_sha256(str(patient_file))
+                if incremental and recorded_hashes.get(patient_file.name) == sha256:
+                    skipped_count += 1
+                    continue
+                
+                print(f"\nProcessing patient: {patient_id}")
+                
+                # Load patient data
+                patient_data = load_patient_record(str(patient_file))
+                
+                # Diff with proper patient_id; embedding is deferred to the batch
+                collection, chunks, _ = prepare_patient_index(patient_data, patient_id)
+                pending.append((patient_file, patient_id, sha256, collection, chunks))
+                for c in chunks:
+                    pending_texts[c["text"]] = None
+                
+            except Exception as e:
+                print(f"Error processing {patient_file.name}: {e}")
+                error_count += 1
+            
+            if len(pending_texts) >= batch_size:
+                flush_batch()
+        flush_batch()
+        
+        # Drop vectors of patients whose data file no longer exists
+        current_files = {f.name for f in patient_files}
+        for source in recorded_hashes:
+            if source not in current_files:
+                patient_id = Path(source).stem
+                print(f"Removing vectors for deleted patient file: {source}")
+                delete_patient_vectors(patient_id)
+                manifest.remove_source(source)
+    finally:
+        manifest.close()
+    
+    elapsed = time.perf_counter() - start_time
     print(f"\n=== Rebuild Complete ===")
     print(f"Successfully processed: {success_count} patients")
+    print(f"Unchanged (skipped): {skipped_count} patients")
     print(f"Errors: {error_count} patients")
+    print(f"Chunks written: {chunk_count} ({embedded_count} distinct texts embedded) "
+          f"in {elapsed:.1f}s, {chunk_count / elapsed if elapsed else 0:.1f} chunks/s")
     
     # Verify the rebuild
     verify_patient_isolation()
@@ -123,13 +217,24 @@ def verify_patient_isolation():
             print(f"  ⚠️  No results found for {patient_id}")
 
 if __name__ == "__main__":
-    print("=== Patient Vector Database Rebuild ===")
-    print("This will clear the existing vector database and rebuild it with proper patient isolation.")
+    parser = argparse.ArgumentParser(description="Rebuild the patient vector databases")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only re-index patient files that changed since the last run")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help="distinct chunk texts per embedding batch")
+    args = parser.parse_args()
+    incremental = args.incremental
     
-    # Ask for confirmation
-    response = input("Continue? (y/N): ")
-    if response.lower() != 'y':
-        print("Operation cancelled.")
-        exit()
+    print("=== Patient Vector Database Rebuild ===")
+    if incremental:
+        print("Re-indexing only patient files that changed since the last run.")
+    else:
+        print("This will clear the existing vector database and rebuild it with proper patient isolation.")
+        
+        # Ask for confirmation
+        response = input("Continue? (y/N): ")
+        if response.lower() != 'y':
+            print("Operation cancelled.")
+            exit()
     
-    rebuild_patient_vectors()
\ No newline at end of file
+    rebuild_patient_vectors(incremental=incremental, batch_size=args.batch_size)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Copilot response cache
+
+The same question about the same patient (one chart opened by several
+clinicians during rounds) should not pay for retrieval and a Gemini call each
+time. Responses are cached under the patient ID, a version stamp of the patient data
+the answer was generated from (the saved file's mtime and size, or a counter
+of the in-memory record), a version of the patient's vector index, the
+normalized query and the retrieval parameters. Entries expire after a TTL, the
+least recently used entries are evicted beyond the size limit, and all entries
+of a patient are dropped whenever their data is uploaded or their vectors are
+re-indexed in this process. Re-indexing by another process (rebuild_vectors.py,
+another server worker) cannot reach this cache; it changes the index version
+instead, so the stale entries are never hit again and age out.
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from patient_db_utils import file_version, get_lexical_index_path, register_invalidation_hook
+
+load_dotenv()
+# Cached copilot responses; 0 disables the cache
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+# Seconds a cached response stays valid
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+
+def normalize_question(query: str) -> str:
+    """Cache normalization: lowercase, whitespace collapsed, trailing punctuation dropped"""
+    return " ".join(query.lower().split()).rstrip("?.! ")
+
+def patient_index_version(patient_id: Optional[str]) -> str:
+    """
+    Version of a patient's indexed chunks as seen by any process: the lexical index
+    file is rewritten whenever indexing changes the chunk set and removed with the vectors
+    """
+    if not patient_id:
+        return ""
+    return file_version(get_lexical_index_path(patient_id))
+
+class ResponseCache:
+    """Thread-safe TTL + LRU cache of copilot responses, invalidated per patient"""
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, list]" = OrderedDict()  # key -> [response, stored_at]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(patient_id: Optional[str], data_version: str, query: str, **params) -> tuple:
+        return (patient_id, data_version, normalize_question(query), tuple(sorted(params.items())))
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached response with its age, or None on a miss or expiry"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] >= self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            response = copy.deepcopy(entry[0])
+        response["cache_age_s"] = round(now - entry[1], 3)
+        return response
+
+    def put(self, key: tuple, response: Dict[str, Any]) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = [copy.deepcopy(response), time.monotonic()]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, patient_id: Optional[str] = None) -> None:
+        """Drop a patient's cached responses (all entries if patient_id is None)"""
+        with self._lock:
+            if patient_id is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == patient_id]:
+                    del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries), "max_size": self.max_size, "ttl_s": self.ttl,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
+
+_response_cache = ResponseCache()
+# Re-indexing a patient (or clearing all vectors) invalidates their cached answers
+register_invalidation_hook(_response_cache.invalidate)
+
+def get_response_cache() -> ResponseCache:
+    return _response_cache
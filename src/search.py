@@ -1,6 +1,9 @@
 # search_patient_data.py
 import json
 import sys
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 import chromadb
@@ -11,17 +14,251 @@ from dotenv import load_dotenv
 # --- CONFIG ---
 load_dotenv()
 VECTOR_DB_BASE_DIR = "./patient_vectors"
+# Open patient collections kept by the pool, and seconds before an unused one is dropped
+COLLECTION_POOL_SIZE = int(os.getenv("COLLECTION_POOL_SIZE", "64"))
+COLLECTION_IDLE_SECONDS = float(os.getenv("COLLECTION_IDLE_SECONDS", "900"))
+# In-memory indexes kept per kind (each pool holds at most one entry per patient)
+NUMPY_INDEX_POOL_SIZE = int(os.getenv("NUMPY_INDEX_POOL_SIZE", "16"))
+LEXICAL_INDEX_POOL_SIZE = int(os.getenv("LEXICAL_INDEX_POOL_SIZE", "64"))
+# Retrieval backend: "chroma" (collection query) or "numpy" (in-memory exact search)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "chroma")
+# Retrieval mode: "vector" or "hybrid" (BM25 fused with vector relevance, see lexical_index.py)
+SEARCH_RETRIEVAL = os.getenv("SEARCH_RETRIEVAL", "vector")
+# Weight of the vector score in hybrid fusion (the lexical score gets the rest)
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))
+# Candidates fetched from each retriever per requested hybrid result
+HYBRID_CANDIDATE_FACTOR = 3
+# Exact phrase matches skip vector search only when the phrase is rare: it may occur
+# in at most this fraction of the searched chunks (generic words such as "patient"
+# match many chunks and are still fused with vector relevance)
+HYBRID_EXACT_MAX_FRACTION = float(os.getenv("HYBRID_EXACT_MAX_FRACTION", "0.1"))
+# Query embeddings kept in memory by normalized query text; 0 disables the cache
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
 
 # Import shared utilities
-from patient_db_utils import get_patient_collection_name, get_patient_db_path
+from patient_db_utils import (
+    file_version, get_patient_collection_name, get_patient_db_path, get_patient_shard, get_shard_db_path,
+    get_embedding_function, get_lexical_index_path, register_invalidation_hook,
+    VECTOR_STORAGE, VECTOR_STORE_LAYOUT, VECTOR_TYPE_PARTITIONS
+)
+from lexical_index import LexicalIndex
+from numpy_index import NumpyPatientIndex
 
-def get_patient_db_collection(patient_id: str):
+class CollectionPool:
+    """
+    Thread-safe LRU pool of open patient collections.
+    
+    Entries unused for idle_seconds are dropped, the least recently used entry is
+    dropped beyond max_size, and invalidate() drops a patient's entries after their
+    vectors are rewritten. Entries opened with a version are reopened when a later
+    get() passes a different one (files rewritten by another process).
+    """
+    
+    def __init__(self, max_size: int = COLLECTION_POOL_SIZE, idle_seconds: float = COLLECTION_IDLE_SECONDS):
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self._entries: "OrderedDict[tuple, list]" = OrderedDict()  # key -> [collection, last_used, version]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def _evict_idle(self, now: float) -> None:
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry[1] < self.idle_seconds:
+                break
+            del self._entries[key]
+    
+    def get(self, key: tuple, factory, version: Optional[str] = None):
+        """
+        Return the pooled collection for key, opening it with factory() on a miss (None is not pooled)
+        
+        Args:
+            version: Stamp of the files the entry is read from, taken before opening it;
+                a pooled entry with another stamp is stale and reopened
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] != version:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                entry[1] = now
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        
+        collection = factory()
+        if collection is None or self.max_size <= 0:
+            return collection
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] == version:
+                # Another thread opened it meanwhile; share theirs
+                return entry[0]
+            self._entries[key] = [collection, now, version]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return collection
+    
+    def peek(self, key: tuple):
+        """Return the pooled collection for key without opening it, touching the LRU order or counting"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+    
+    def invalidate(self, patient_id: Optional[str] = None) -> None:
+        """Drop a patient's pooled collections (all entries if patient_id is None)"""
+        with self._lock:
+            if patient_id is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == patient_id]:
+                    del self._entries[key]
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+_collection_pool = CollectionPool()
+register_invalidation_hook(_collection_pool.invalidate)
+# NumPy and BM25 indexes hold a patient's chunks in memory, so they are pooled
+# apart from the open collections and sized on their own
+_numpy_index_pool = CollectionPool(max_size=NUMPY_INDEX_POOL_SIZE)
+register_invalidation_hook(_numpy_index_pool.invalidate)
+_lexical_index_pool = CollectionPool(max_size=LEXICAL_INDEX_POOL_SIZE)
+register_invalidation_hook(_lexical_index_pool.invalidate)
+
+def get_collection_pool() -> CollectionPool:
+    return _collection_pool
+
+def get_index_pools() -> Dict[str, CollectionPool]:
+    return {"numpy_index_pool": _numpy_index_pool, "lexical_index_pool": _lexical_index_pool}
+
+def normalize_query(query: str) -> str:
+    """Query cache key: lowercase with whitespace collapsed (the embedding model is uncased)"""
+    return " ".join(query.lower().split())
+
+class QueryEmbeddingCache:
+    """
+    Thread-safe LRU cache from normalized query text to its embedding.
+    
+    Clinicians ask the same questions across patients, so repeated queries skip
+    the embedding model. Embeddings depend only on the query text, so entries
+    never need invalidating when patient data changes.
+    """
+    
+    def __init__(self, max_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, query: str) -> List[float]:
+        """Return the embedding of query, computing it on a miss"""
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(embedding)
+            self.misses += 1
+        
+        embedding = [float(x) for x in get_embedding_function()([key])[0]]
+        if self.max_size > 0:
+            with self._lock:
+                self._entries[key] = embedding
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return list(embedding)
+    
+    def get_many(self, queries: List[str]) -> List[List[float]]:
+        """Return the embeddings of several queries, computing all misses in one model call"""
+        keys = [normalize_query(q) for q in queries]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for key in keys:
+                embedding = self._entries.get(key)
+                if embedding is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    found[key] = embedding
+                elif key not in found:
+                    self.misses += 1
+                else:
+                    # Repeated within the batch: embedded once below
+                    self.hits += 1
+                found.setdefault(key, None)
+        
+        missing = [key for key, embedding in found.items() if embedding is None]
+        if missing:
+            for key, embedding in zip(missing, get_embedding_function()(missing)):
+                found[key] = [float(x) for x in embedding]
+            if self.max_size > 0:
+                with self._lock:
+                    for key in missing:
+                        self._entries[key] = found[key]
+                        self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+        return [list(found[key]) for key in keys]
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
+
+_query_embedding_cache = QueryEmbeddingCache()
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    return _query_embedding_cache
+
+def get_query_embedding(query: str) -> List[float]:
+    """Embedding of a search query, served from the query embedding cache when possible"""
+    return _query_embedding_cache.get(query)
+
+def get_patient_db_collection(patient_id: str, storage: Optional[str] = None):
     """
     Get the ChromaDB collection for a specific patient
+    
+    Collections are kept open in a process-wide pool, so only the first query of a
+    patient pays for opening the database.
+    
+    Args:
+        patient_id: Patient identifier
+        storage: "chroma" or "int8" (a QuantizedStore); defaults to VECTOR_STORAGE
     """
     if not patient_id:
         return None
-        
+    
+    storage = storage or VECTOR_STORAGE
+    return _collection_pool.get(
+        (patient_id, storage, VECTOR_STORE_LAYOUT),
+        lambda: open_patient_db_collection(patient_id, storage)
+    )
+
+def open_patient_db_collection(patient_id: str, storage: str):
+    """Open a patient's collection without the pool (see get_patient_db_collection)"""
+    if VECTOR_STORE_LAYOUT == "sharded":
+        from sharded_store import get_patient_view
+        view = get_patient_view(patient_id, get_embedding_function(), create=False)
+        if view is None or view.count() == 0:
+            print(f"No vectors found for patient {patient_id} in their shard")
+            return None
+        return view
+    
     patient_db_path = get_patient_db_path(patient_id)
     
     # Check if patient database exists
@@ -29,13 +266,30 @@ def get_patient_db_collection(patient_id: str):
         print(f"No vector database found for patient {patient_id}")
         return None
     
+    if storage == "int8":
+        from embed import embed_texts
+        from quantized_store import QuantizedStore, QUANTIZED_DIRNAME
+        store_path = os.path.join(patient_db_path, QUANTIZED_DIRNAME)
+        if not os.path.exists(store_path):
+            print(f"No int8 vector store found for patient {patient_id}")
+            return None
+        # Candidates are rescored with full-precision vectors from the shared embedding cache
+        return QuantizedStore(store_path, embedding_function=get_embedding_function(), rescore_fn=embed_texts)
+    
     try:
+        if VECTOR_TYPE_PARTITIONS:
+            from partitioned_store import get_partitioned_collection
+            collection = get_partitioned_collection(patient_db_path, get_patient_collection_name(patient_id),
+                                                    get_embedding_function(), create=False)
+            if collection is None:
+                print(f"No vectors found for patient {patient_id}")
+            return collection
         chroma_client = chromadb.PersistentClient(path=patient_db_path)
         collection_name = get_patient_collection_name(patient_id)
         print(f"Looking for collection: {collection_name} for patient: {patient_id}")
         collection = chroma_client.get_collection(
             name=collection_name,
-            embedding_function=embedding_functions.DefaultEmbeddingFunction()
+            embedding_function=get_embedding_function()
         )
         return collection
     except Exception as e:
@@ -91,7 +345,168 @@ def search_patient_data(query: str, n_results: int = 5, filter_type: Optional[st
         print(f"{i+1}. {text} (type: {metadata['type']}, relevance: {relevance:.2f})")
 
 
-def search_patient_data_for_context(query: str, n_results: int = 5, filter_type: Optional[str] = None, patient_id: Optional[str] = None) -> List[Dict[str, Any]]:
+def get_patient_numpy_index(patient_id: str, storage: Optional[str] = None) -> Optional[NumpyPatientIndex]:
+    """Return the pooled in-memory exact-search index of a patient (None if they have no vectors)"""
+    storage = storage or VECTOR_STORAGE
+    
+    def open_index():
+        collection = get_patient_db_collection(patient_id, storage)
+        if collection is None:
+            return None
+        return NumpyPatientIndex.from_collection(collection)
+    
+    return _numpy_index_pool.get((patient_id, storage, VECTOR_STORE_LAYOUT), open_index,
+                                 version=vector_store_version(patient_id, storage))
+
+def vector_store_version(patient_id: str, storage: str) -> str:
+    """Stamp of the files a patient's vectors are read from (changes whenever any process writes them)"""
+    if VECTOR_STORE_LAYOUT == "sharded":
+        db_path = get_shard_db_path(get_patient_shard(patient_id))
+    elif storage == "int8":
+        from quantized_store import ITEMS_FILE, QUANTIZED_DIRNAME
+        return file_version(os.path.join(get_patient_db_path(patient_id), QUANTIZED_DIRNAME, ITEMS_FILE))
+    else:
+        db_path = get_patient_db_path(patient_id)
+    sqlite_path = os.path.join(db_path, "chroma.sqlite3")
+    return f"{file_version(sqlite_path)}/{file_version(sqlite_path + '-wal')}"
+
+def format_search_results(results: Dict[str, List[List[Any]]], query_index: int = 0) -> List[Dict[str, Any]]:
+    """Convert one query (the first by default) of Collection.query-shaped results into context dictionaries"""
+    formatted_results = []
+    if results["documents"][query_index]:
+        for i, (text, metadata, distance) in enumerate(zip(
+            results["documents"][query_index], 
+            results["metadatas"][query_index],
+            results["distances"][query_index]
+        )):
+            # Convert distance to a similarity score (1.0 = perfect match)
+            relevance = 1 - distance
+            formatted_results.append({
+                "text": text,
+                "type": metadata.get('type', 'unknown'),
+                "relevance": round(relevance, 3),
+                "distance": round(distance, 3),
+                "metadata": metadata
+            })
+    return formatted_results
+
+def get_patient_lexical_index(patient_id: str) -> Optional[LexicalIndex]:
+    """Return the pooled BM25 index of a patient (None if they were not indexed with one)"""
+    path = get_lexical_index_path(patient_id)
+    return _lexical_index_pool.get((patient_id,), lambda: LexicalIndex.load(path), version=file_version(path))
+
+def vector_search(query: str, n_results: int, filter_type: Optional[str], patient_id: str,
+                  storage: Optional[str], backend: str) -> Optional[Dict[str, List[List[Any]]]]:
+    """Run the vector query of one patient; returns Collection.query-shaped results, or None if there is no database"""
+    if backend == "numpy":
+        index = get_patient_numpy_index(patient_id, storage)
+        if index is None:
+            return None
+        return index.query(get_query_embedding(query), n_results, filter_type)
+    
+    # Get patient-specific collection
+    collection = get_patient_db_collection(patient_id, storage)
+    if not collection:
+        return None
+    
+    # Only a type filter is needed since we're searching a patient-specific database
+    where_param = {"type": filter_type} if filter_type else None
+    return collection.query(
+        query_embeddings=[get_query_embedding(query)],
+        n_results=n_results,
+        where=where_param
+    )
+
+def _normalize_scores(scores: Dict[str, float]) -> Dict[str, float]:
+    """Min-max scale scores to [0, 1] (a single or all-equal score becomes 1.0)"""
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high - low < 1e-9:
+        return {key: 1.0 for key in scores}
+    return {key: (value - low) / (high - low) for key, value in scores.items()}
+
+def lexical_results(index: LexicalIndex, matches: List[tuple], match: str) -> List[Dict[str, Any]]:
+    """Format (doc index, BM25 score) matches as context dictionaries, scored relative to the best match"""
+    top = matches[0][1] if matches else 0.0
+    return [{
+        "text": index.documents[doc],
+        "type": index.metadatas[doc].get('type', 'unknown'),
+        "relevance": round(score / top, 3) if top > 0 else 0.0,
+        "distance": None,
+        "lexical_score": round(score, 3),
+        "match": match,
+        "metadata": index.metadatas[doc]
+    } for doc, score in matches]
+
+def hybrid_search(query: str, n_results: int, filter_type: Optional[str], patient_id: str,
+                  storage: Optional[str], backend: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Fuse BM25 and vector retrieval for one patient.
+    
+    If at least n_results chunks contain the query as an exact phrase, and the phrase
+    is rare (found in at most HYBRID_EXACT_MAX_FRACTION of the searched chunks), the
+    matches are returned by BM25 score without embedding the query. Otherwise the top
+    HYBRID_CANDIDATE_FACTOR * n_results candidates of each retriever are scored by
+    HYBRID_ALPHA * vector relevance + (1 - HYBRID_ALPHA) * BM25, both min-max
+    normalized over the candidates.
+    
+    Returns:
+        Context dictionaries, or None if the patient has no lexical index
+    """
+    index = get_patient_lexical_index(patient_id)
+    if index is None:
+        return None
+    
+    exact = index.exact_matches(query, filter_type)
+    if n_results <= len(exact) <= HYBRID_EXACT_MAX_FRACTION * index.scope_size(filter_type):
+        return lexical_results(index, exact[:n_results], "exact")
+    
+    pool_size = n_results * HYBRID_CANDIDATE_FACTOR
+    lexical = {index.ids[doc]: (doc, score) for doc, score in index.search(query, pool_size, filter_type)}
+    vector = vector_search(query, pool_size, filter_type, patient_id, storage, backend)
+    vector_hits = {}
+    if vector is not None:
+        for item_id, text, metadata, distance in zip(vector["ids"][0], vector["documents"][0],
+                                                     vector["metadatas"][0], vector["distances"][0]):
+            vector_hits[item_id] = (text, metadata, distance)
+    
+    vector_norm = _normalize_scores({item_id: 1 - hit[2] for item_id, hit in vector_hits.items()})
+    lexical_norm = _normalize_scores({item_id: hit[1] for item_id, hit in lexical.items()})
+    exact_ids = {index.ids[doc] for doc, _ in exact}
+    fused = []
+    for item_id in set(vector_hits) | set(lexical):
+        score = HYBRID_ALPHA * vector_norm.get(item_id, 0.0) + (1 - HYBRID_ALPHA) * lexical_norm.get(item_id, 0.0)
+        fused.append((score, item_id))
+    fused.sort(key=lambda item: (-item[0], item[1]))
+    
+    results = []
+    for score, item_id in fused[:n_results]:
+        if item_id in vector_hits:
+            text, metadata, distance = vector_hits[item_id]
+        else:
+            doc = lexical[item_id][0]
+            text, metadata, distance = index.documents[doc], index.metadatas[doc], None
+        if item_id in exact_ids:
+            match = "exact"
+        elif item_id in vector_hits and item_id in lexical:
+            match = "both"
+        else:
+            match = "vector" if item_id in vector_hits else "lexical"
+        results.append({
+            "text": text,
+            "type": metadata.get('type', 'unknown'),
+            "relevance": round(score, 3),
+            "distance": round(distance, 3) if distance is not None else None,
+            "lexical_score": round(lexical[item_id][1], 3) if item_id in lexical else 0.0,
+            "match": match,
+            "metadata": metadata
+        })
+    return results
+
+def search_patient_data_for_context(query: str, n_results: int = 5, filter_type: Optional[str] = None, patient_id: Optional[str] = None,
+                                    storage: Optional[str] = None, backend: Optional[str] = None,
+                                    retrieval: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Search the patient-specific vector database for patient data and return structured results for context
     
@@ -100,57 +515,106 @@ def search_patient_data_for_context(query: str, n_results: int = 5, filter_type:
         n_results: Number of results to return
         filter_type: Filter by data type (e.g., 'conditions', 'medications')
         patient_id: Patient ID to search (required for patient-specific search)
+        storage: "chroma" or "int8"; defaults to VECTOR_STORAGE
+        backend: "chroma" queries the collection; "numpy" runs exact search over the
+            patient's embeddings held in memory (see numpy_index.py); defaults to SEARCH_BACKEND.
+            Both scan only the filter_type partition: the in-memory index keeps rows sorted
+            by type, and chroma storage keeps one collection per type (VECTOR_TYPE_PARTITIONS)
+        retrieval: "vector", or "hybrid" to fuse BM25 scores from the patient's lexical
+            index with vector relevance (see hybrid_search); defaults to SEARCH_RETRIEVAL
         
     Returns:
-        List of dictionaries containing search results with text, metadata, and relevance scores
+        List of dictionaries containing search results with text, metadata, and relevance scores.
+        Hybrid results also carry lexical_score and match ("exact", "both", "vector" or
+        "lexical"); their relevance is the fused score and distance is None for lexical-only hits.
     """
     if not patient_id:
         print("Warning: No patient_id provided for search. Cannot perform patient-specific search.")
         return []
     
-    # Get patient-specific collection
-    collection = get_patient_db_collection(patient_id)
-    if not collection:
+    backend = backend or SEARCH_BACKEND
+    retrieval = retrieval or SEARCH_RETRIEVAL
+    try:
+        if retrieval == "hybrid":
+            results = hybrid_search(query, n_results, filter_type, patient_id, storage, backend)
+            if results is not None:
+                return results
+            print(f"No lexical index for patient {patient_id}; using vector search")
+        results = vector_search(query, n_results, filter_type, patient_id, storage, backend)
+    except Exception as e:
+        print(f"Error searching patient {patient_id} database: {e}")
+        return []
+    if results is None:
         print(f"No vector database found for patient {patient_id}")
         return []
     
-    # Prepare filter - only need type filter now since we're searching patient-specific database
-    where_filter = {}
-    if filter_type:
-        where_filter["type"] = filter_type
+    return format_search_results(results)
+
+def search_patient_data_batch(queries: List[str], patient_ids: List[str], n_results: int = 5,
+                              filter_type: Optional[str] = None, storage: Optional[str] = None,
+                              backend: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Run many queries against one or more patients' vector databases
     
-    # Only use where filter if we have conditions
-    where_param = where_filter if where_filter else None
+    All queries are embedded in one model call (through the query embedding cache)
+    and each patient is searched with a single multi-query collection.query, or a
+    single matrix product with the numpy backend. Batches always use vector retrieval.
     
-    # Search the patient-specific collection
-    try:
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results,
-            where=where_param
-        )
-    except Exception as e:
-        print(f"Error searching patient {patient_id} database: {e}")
-        return []
+    Args:
+        queries: Search queries
+        patient_ids: Patients to search with every query
+        n_results: Number of results per query and patient
+        filter_type: Filter by data type (e.g., 'conditions', 'medications')
+        storage: "chroma" or "int8"; defaults to VECTOR_STORAGE
+        backend: "chroma" or "numpy"; defaults to SEARCH_BACKEND
+        
+    Returns:
+        Dictionary with "results" (patient_id -> one result list per query, in query
+        order), "missing_patients" (patients without a database), "errors" (patient_id ->
+        error message for searches that failed) and "timings_ms" (embedding and search time)
+    """
+    backend = backend or SEARCH_BACKEND
+    start = time.perf_counter()
+    query_embeddings = _query_embedding_cache.get_many(queries) if queries else []
+    embedded = time.perf_counter()
     
-    formatted_results = []
-    if results["documents"][0]:
-        for i, (text, metadata, distance) in enumerate(zip(
-            results["documents"][0], 
-            results["metadatas"][0],
-            results["distances"][0]
-        )):
-            # Convert distance to a similarity score (1.0 = perfect match)
-            relevance = 1 - distance
-            formatted_results.append({
-                "text": text,
-                "type": metadata.get('type', 'unknown'),
-                "relevance": round(relevance, 3),
-                "distance": round(distance, 3),
-                "metadata": metadata
-            })
+    grouped: Dict[str, List[List[Dict[str, Any]]]] = {}
+    missing = []
+    errors: Dict[str, str] = {}
+    for patient_id in dict.fromkeys(patient_ids):
+        if not query_embeddings:
+            grouped[patient_id] = []
+            continue
+        try:
+            if backend == "numpy":
+                index = get_patient_numpy_index(patient_id, storage)
+                results = index.query_many(query_embeddings, n_results, filter_type) if index is not None else None
+            else:
+                collection = get_patient_db_collection(patient_id, storage)
+                results = collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=n_results,
+                    where={"type": filter_type} if filter_type else None
+                ) if collection else None
+        except Exception as e:
+            print(f"Error searching patient {patient_id} database: {e}")
+            errors[patient_id] = str(e)
+            continue
+        if results is None:
+            missing.append(patient_id)
+            continue
+        grouped[patient_id] = [format_search_results(results, i) for i in range(len(queries))]
     
-    return formatted_results
+    finished = time.perf_counter()
+    return {
+        "results": grouped,
+        "missing_patients": missing,
+        "errors": errors,
+        "timings_ms": {
+            "embedding": round((embedded - start) * 1000, 2),
+            "search": round((finished - embedded) * 1000, 2)
+        }
+    }
 
 def list_collection_stats() -> None:
     """
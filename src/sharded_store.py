@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Sharded multi-tenant layout for patient vectors
+
+Instead of one database directory per patient, patients are hash-partitioned
+into a fixed number of shared shard collections. Every chunk carries a
+patient_id metadata field, and all access goes through PatientCollectionView,
+which adds a patient_id filter to every read and refuses writes for other
+patients. One client per shard is kept open for the life of the process.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import chromadb
+
+from patient_db_utils import (
+    get_patient_shard, get_shard_collection_name, get_shard_db_path, register_invalidation_hook
+)
+
+_shard_collections: Dict[int, Any] = {}
+_shard_lock = threading.Lock()
+
+def _invalidate_shards(patient_id: Optional[str]) -> None:
+    # Shard collections stay valid when one patient changes; only a full clear drops them
+    if patient_id is None:
+        with _shard_lock:
+            _shard_collections.clear()
+
+register_invalidation_hook(_invalidate_shards)
+
+def get_shard_collection(shard: int, embedding_function, create: bool = True):
+    """Return the process-wide collection of a shard (None if it does not exist and create is False)"""
+    with _shard_lock:
+        collection = _shard_collections.get(shard)
+        if collection is not None:
+            return collection
+        shard_path = get_shard_db_path(shard)
+        if not create and not os.path.exists(shard_path):
+            return None
+        os.makedirs(shard_path, exist_ok=True)
+        client = chromadb.PersistentClient(path=shard_path)
+        name = get_shard_collection_name(shard)
+        if create:
+            collection = client.get_or_create_collection(name=name, embedding_function=embedding_function)
+        else:
+            try:
+                collection = client.get_collection(name=name, embedding_function=embedding_function)
+            except Exception:
+                return None
+        _shard_collections[shard] = collection
+        return collection
+
+def patient_where(patient_id: str, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Combine a where filter with the patient_id isolation filter"""
+    if not where:
+        return {"patient_id": patient_id}
+    return {"$and": [{"patient_id": patient_id}, where]}
+
+class PatientCollectionView:
+    """
+    One patient's slice of a shard collection, exposing the Collection methods
+    used by embed.py and search.py. Reads are always filtered by patient_id.
+
+    Match counts per filter are cached on the view and cleared by writes through
+    it; pooled views are dropped when the patient is re-indexed elsewhere
+    (notify_patient_updated), so the cache lives no longer than the indexed data.
+    """
+
+    def __init__(self, collection, patient_id: str):
+        self.collection = collection
+        self.patient_id = patient_id
+        self.name = collection.name
+        # json-encoded where filter -> number of the patient's chunks it matches
+        self._counts: Dict[str, int] = {}
+        self._counts_lock = threading.Lock()
+
+    def _check_metadatas(self, metadatas: Sequence[Dict[str, Any]]) -> None:
+        for metadata in metadatas:
+            if metadata.get("patient_id") != self.patient_id:
+                raise ValueError(
+                    f"Refusing to write chunk of patient {metadata.get('patient_id')} "
+                    f"through the view of patient {self.patient_id}"
+                )
+
+    def _count(self, where: Dict[str, Any]) -> int:
+        key = json.dumps(where, sort_keys=True)
+        with self._counts_lock:
+            count = self._counts.get(key)
+        if count is None:
+            count = len(self.collection.get(where=where, include=[])["ids"])
+            with self._counts_lock:
+                self._counts[key] = count
+        return count
+
+    def _invalidate_counts(self) -> None:
+        with self._counts_lock:
+            self._counts.clear()
+
+    def count(self) -> int:
+        return self._count(patient_where(self.patient_id))
+
+    def get(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, include: Sequence[str] = ("documents", "metadatas")) -> Dict[str, Any]:
+        return self.collection.get(ids=ids, where=patient_where(self.patient_id, where),
+                                   limit=limit, include=list(include))
+
+    def peek(self, limit: int = 10) -> Dict[str, Any]:
+        return self.get(limit=limit)
+
+    def upsert(self, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[Dict[str, Any]],
+               embeddings: Optional[Sequence[Sequence[float]]] = None) -> None:
+        self._check_metadatas(metadatas)
+        self.collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        self._invalidate_counts()
+
+    def add(self, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[Dict[str, Any]],
+            embeddings: Optional[Sequence[Sequence[float]]] = None) -> None:
+        self._check_metadatas(metadatas)
+        self.collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        self._invalidate_counts()
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        self.collection.delete(ids=ids, where=patient_where(self.patient_id, where))
+        self._invalidate_counts()
+
+    def query(self, query_texts: Optional[Sequence[str]] = None,
+              query_embeddings: Optional[Sequence[Sequence[float]]] = None,
+              n_results: int = 10, where: Optional[Dict[str, Any]] = None) -> Dict[str, List[List[Any]]]:
+        where = patient_where(self.patient_id, where)
+        # Never ask the index for more neighbours than the filter can match
+        available = self._count(where)
+        if not available:
+            queries = len(query_texts if query_embeddings is None else query_embeddings)
+            return {key: [[] for _ in range(queries)] for key in ("ids", "documents", "metadatas", "distances")}
+        return self.collection.query(query_texts=query_texts, query_embeddings=query_embeddings,
+                                     n_results=min(n_results, available), where=where)
+
+def get_patient_view(patient_id: str, embedding_function, create: bool = True) -> Optional[PatientCollectionView]:
+    """Return the view of a patient's chunks in their shard (None if the shard does not exist and create is False)"""
+    collection = get_shard_collection(get_patient_shard(patient_id), embedding_function, create=create)
+    if collection is None:
+        return None
+    return PatientCollectionView(collection, patient_id)
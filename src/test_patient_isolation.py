@@ -7,7 +7,9 @@ import json
 import os
 from pathlib import Path
 from embed import index_patient_data
-from search import search_patient_data_for_context
+from patient_db_utils import VECTOR_STORE_LAYOUT, VECTOR_SHARDS, get_patient_shard, get_shard_db_path
+from search import get_patient_db_collection, search_patient_data_for_context
+from vocabulary import load_patient_record
 
 def test_patient_isolation():
     """Test that patient databases are properly isolated"""
@@ -27,6 +29,7 @@ def test_patient_isolation():
         return
     
     print(f"Testing with patients: {[f.stem for f in patient_files]}")
+    print(f"Vector store layout: {VECTOR_STORE_LAYOUT}")
     
     # Index both patients
     for patient_file in patient_files:
@@ -34,8 +37,7 @@ def test_patient_isolation():
         print(f"\nIndexing patient: {patient_id}")
         
         try:
-            with open(patient_file, 'r') as f:
-                patient_data = json.load(f)
+            patient_data = load_patient_record(str(patient_file))
             
             index_patient_data(patient_data, patient_id)
             print(f"✓ Successfully indexed {patient_id}")
@@ -65,6 +67,21 @@ def test_patient_isolation():
         else:
             print(f"  ⚠️  No results found for {patient_id}")
     
+    if VECTOR_STORE_LAYOUT == "sharded":
+        print("\n=== Testing Shard Filter ===")
+        
+        # Every item visible through a patient's view must belong to that patient,
+        # even when other patients share the shard
+        for patient_file in patient_files:
+            patient_id = patient_file.stem
+            collection = get_patient_db_collection(patient_id)
+            items = collection.get(include=["metadatas"]) if collection else {"metadatas": []}
+            foreign = [m.get('patient_id') for m in items["metadatas"] if m.get('patient_id') != patient_id]
+            if foreign:
+                print(f"  ✗ {patient_id} (shard {get_patient_shard(patient_id)}) sees data of {set(foreign)}")
+                return
+            print(f"  ✓ {patient_id} (shard {get_patient_shard(patient_id)}): {len(items['metadatas'])} items, all their own")
+    
     print("\n=== Testing Cross-Patient Search ===")
     
     # Test that searching patient A's database doesn't return patient B's data
@@ -86,6 +103,10 @@ def test_patient_isolation():
 
 def list_patient_databases():
     """List all patient databases"""
+    if VECTOR_STORE_LAYOUT == "sharded":
+        list_shards()
+        return
+    
     base_dir = Path("./patient_vectors")
     if not base_dir.exists():
         print("No patient vector databases found")
@@ -100,7 +121,6 @@ def list_patient_databases():
         
         # Try to get count of items in this database
         try:
-            from search import get_patient_db_collection
             collection = get_patient_db_collection(patient_id)
             if collection:
                 count = collection.count()
@@ -108,6 +128,26 @@ def list_patient_databases():
         except Exception as e:
             print(f"    (error reading: {e})")
 
+def list_shards():
+    """List patients stored in each shard of the sharded layout"""
+    from sharded_store import get_shard_collection
+    from patient_db_utils import get_embedding_function
+    
+    print(f"\nSharded layout with {VECTOR_SHARDS} shards:")
+    for shard in range(VECTOR_SHARDS):
+        if not os.path.exists(get_shard_db_path(shard)):
+            continue
+        collection = get_shard_collection(shard, get_embedding_function(), create=False)
+        if not collection:
+            continue
+        patients = {}
+        for metadata in collection.get(include=["metadatas"])["metadatas"]:
+            patient_id = metadata.get('patient_id', 'MISSING')
+            patients[patient_id] = patients.get(patient_id, 0) + 1
+        print(f"  - shard {shard}: {len(patients)} patients")
+        for patient_id, count in sorted(patients.items()):
+            print(f"    - {patient_id} ({count} embeddings)")
+
 if __name__ == "__main__":
     print("Patient Database Isolation Test")
     print("=" * 40)
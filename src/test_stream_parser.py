@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test script for the streaming FHIR bundle parser (ingester.iter_bundle_resources)
+
+Every document is parsed with several tiny chunk sizes, so numbers, literals
+and multibyte UTF-8 characters are split across reads, and compared with json.loads.
+"""
+
+import io
+import json
+
+from ingester import iter_bundle_resources
+
+CHUNK_SIZES = (1, 2, 3, 5, 7, 1 << 16)
+
+def parse(document: str, binary: bool, chunk_size: int):
+    """Return (resources, top-level keys) of a document streamed in chunk_size reads"""
+    fp = io.BytesIO(document.encode("utf-8")) if binary else io.StringIO(document)
+    top_level = {}
+    resources = list(iter_bundle_resources(fp, top_level=top_level, chunk_size=chunk_size))
+    return resources, top_level
+
+def check(name: str, document: str, resources, top_level) -> None:
+    for binary in (False, True):
+        for chunk_size in CHUNK_SIZES:
+            found = parse(document, binary, chunk_size)
+            assert found == (resources, top_level), \
+                f"{name}: binary={binary} chunk_size={chunk_size} parsed {found}"
+    print(f"  ok: {name}")
+
+def check_rejected(name: str, document: str) -> None:
+    for binary in (False, True):
+        for chunk_size in CHUNK_SIZES:
+            try:
+                parse(document, binary, chunk_size)
+            except json.JSONDecodeError:
+                continue
+            raise AssertionError(f"{name}: binary={binary} chunk_size={chunk_size} was accepted")
+    print(f"  ok: {name} rejected")
+
+def test_chunk_boundaries():
+    """Numbers, literals and multibyte strings split across reads decode as with json.loads"""
+    resource = {
+        "resourceType": "Observation",
+        "valueQuantity": {"value": 123456.789e-2, "unit": "µmol/L"},
+        "count": -1024,
+        "flags": [True, False, None],
+        "note": "Überweisung – 日本語 🩺",
+    }
+    document = json.dumps({
+        "resourceType": "Bundle",
+        "total": 31415926,
+        "entry": [{"resource": resource}, {"resource": {"id": "ä" * 20, "n": 0.5}}],
+        "score": 2.75,
+    }, ensure_ascii=False)
+    expected = json.loads(document)
+    check("split numbers and UTF-8", document,
+          [e["resource"] for e in expected["entry"]],
+          {k: v for k, v in expected.items() if k != "entry"})
+
+def test_empty_and_missing_entry():
+    check("empty entry array", '{"resourceType": "Bundle", "entry": [ ]}', [], {"resourceType": "Bundle"})
+    check("missing entry", '{"resourceType": "Bundle", "total": 0}', [], {"resourceType": "Bundle", "total": 0})
+    check("empty object", " { } ", [], {})
+
+def test_non_object_root():
+    check_rejected("array root", '[{"resource": {}}]')
+    check_rejected("number root", "42")
+    check_rejected("empty document", "")
+    check_rejected("truncated bundle", '{"entry": [{"resource": {"id": 1}}')
+
+def test_invalid_utf8():
+    """Invalid UTF-8 raises UnicodeDecodeError (the upload endpoints answer 400 for it)"""
+    for chunk_size in CHUNK_SIZES:
+        try:
+            list(iter_bundle_resources(io.BytesIO(b'{"entry": [{"resource": {"id": "\xff"}}]}'),
+                                       chunk_size=chunk_size))
+        except UnicodeDecodeError:
+            continue
+        raise AssertionError(f"invalid UTF-8 accepted with chunk_size={chunk_size}")
+    print("  ok: invalid UTF-8 rejected")
+
+if __name__ == "__main__":
+    print("Streaming Parser Test")
+    print("=" * 40)
+
+    test_chunk_boundaries()
+    test_empty_and_missing_entry()
+    test_non_object_root()
+    test_invalid_utf8()
+    print("All streaming parser checks passed")
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Shared vocabulary of clinical strings for the patient data store
+
+Condition, medication and observation strings repeat across thousands of
+patients. Patient files store integer IDs into a single append-only
+vocabulary file (one JSON string per line, ID = line number), and decoded
+records share one string object per term in memory.
+
+Several processes may write the same store (the API workers, the ingester CLI).
+New terms are assigned IDs only while holding an exclusive lock on the
+vocabulary, after re-reading the terms other processes appended, so an ID
+always refers to the same term. Free-text observation strings ("Body Mass
+Index: 27.5 kg/m2") are nearly all unique and are stored as plain strings; the
+repeated parts of an observation (code, name, category, unit) are interned
+through the columns of the observation table instead.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    # Windows has no fcntl; byte-range locks serve instead
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+VOCABULARY_FILENAME = "vocabulary.jsonl"
+ENCODING_MARKER = "vocab-v1"
+
+# Simplified-data fields holding lists of repeated strings (encoded as vocabulary IDs)
+STRING_LIST_FIELDS = (
+    "conditions",
+    "medications",
+    "procedures",
+    "allergies",
+    "diagnostic_reports",
+    "immunizations",
+    "encounters",
+    "careplans",
+    "claims_diagnoses",
+)
+
+# Fields encoded by earlier versions that are now stored as plain strings; IDs found
+# in them are still decoded
+LEGACY_ENCODED_FIELDS = ("observations",)
+
+# Observation table columns holding repeated strings
+TABLE_STRING_COLUMNS = ("code", "name", "category", "unit")
+
+class Vocabulary:
+    """Append-only string <-> integer ID table persisted as JSON lines"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.terms: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self._loaded_size = 0
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def refresh(self) -> None:
+        """Load terms appended to the file since the last read"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+            size = os.path.getsize(self.path)
+            if size == self._loaded_size:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._loaded_size)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Partially written last line; pick it up on the next refresh
+                        break
+                    self._add(json.loads(line))
+                    self._loaded_size += len(line)
+
+    def _add(self, term: str) -> int:
+        term_id = len(self.terms)
+        self.terms.append(term)
+        self.ids[term] = term_id
+        return term_id
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive cross-process lock on the vocabulary (a sidecar .lock file)"""
+        if fcntl is None and msvcrt is None:
+            raise RuntimeError("No cross-process file locking (fcntl or msvcrt) on this platform; "
+                               "vocabulary IDs cannot be assigned safely")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", "a+") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                return
+            # Lock the first byte; LK_LOCK gives up after about 10 seconds, so keep waiting
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def intern_many(self, terms: Iterable[str]) -> Dict[str, int]:
+        """
+        Return the IDs of terms, appending unknown terms to the vocabulary file.
+        IDs are assigned under the file lock after loading the terms other
+        processes appended, and are on disk before this returns.
+        """
+        with self._lock:
+            wanted = list(dict.fromkeys(terms))
+            if any(term not in self.ids for term in wanted):
+                with self._file_lock():
+                    self.refresh()
+                    new_terms = [term for term in wanted if term not in self.ids]
+                    if new_terms:
+                        data = "".join(json.dumps(term) + "\n" for term in new_terms).encode("utf-8")
+                        with open(self.path, "ab") as f:
+                            # Drop a partial line left by a writer that crashed while holding the lock
+                            f.truncate(self._loaded_size)
+                            f.write(data)
+                            f.flush()
+                            os.fsync(f.fileno())
+                        for term in new_terms:
+                            self._add(term)
+                        self._loaded_size += len(data)
+            return {term: self.ids[term] for term in wanted}
+
+    def intern(self, term: str) -> int:
+        """Return the ID of term, adding it to the vocabulary if needed"""
+        return self.intern_many([term])[term]
+
+    def lookup(self, term_id: int) -> str:
+        with self._lock:
+            if term_id >= len(self.terms):
+                self.refresh()
+            return self.terms[term_id]
+
+    def canonical(self, term: str) -> str:
+        """Return the shared string object for a known term (or term itself if unknown)"""
+        term_id = self.ids.get(term)
+        return self.terms[term_id] if term_id is not None else term
+
+_vocabularies: Dict[str, Vocabulary] = {}
+_vocabularies_lock = threading.Lock()
+
+def get_vocabulary(store_dir: str) -> Vocabulary:
+    """Return the process-wide Vocabulary for a patient data directory"""
+    path = os.path.abspath(os.path.join(store_dir, VOCABULARY_FILENAME))
+    with _vocabularies_lock:
+        if path not in _vocabularies:
+            _vocabularies[path] = Vocabulary(path)
+        return _vocabularies[path]
+
+def is_encoded(data: Dict[str, Any]) -> bool:
+    return data.get("_encoding") == ENCODING_MARKER
+
+def encode_patient_record(data: Dict[str, Any], vocab: Vocabulary) -> Dict[str, Any]:
+    """Replace repeated strings in simplified patient data with vocabulary IDs"""
+    lists = {}
+    for field in STRING_LIST_FIELDS:
+        values = data.get(field)
+        if isinstance(values, list) and all(isinstance(v, str) for v in values):
+            lists[field] = values
+    table = data.get("observation_table")
+    columns = {}
+    if isinstance(table, dict):
+        columns = {column: table[column] for column in TABLE_STRING_COLUMNS if column in table}
+    
+    # One locked vocabulary update per record
+    terms = [v for values in lists.values() for v in values]
+    terms += [v for values in columns.values() for v in values if v is not None]
+    ids = vocab.intern_many(terms)
+    
+    encoded = dict(data)
+    for field, values in lists.items():
+        encoded[field] = [ids[v] for v in values]
+    if isinstance(table, dict):
+        encoded_table = dict(table)
+        for column, values in columns.items():
+            encoded_table[column] = [None if v is None else ids[v] for v in values]
+        encoded["observation_table"] = encoded_table
+    encoded["_encoding"] = ENCODING_MARKER
+    return encoded
+
+def decode_patient_record(data: Dict[str, Any], vocab: Vocabulary) -> Dict[str, Any]:
+    """
+    Inverse of encode_patient_record. Plain records are returned with known
+    strings replaced by the vocabulary's shared string objects.
+    """
+    if not is_encoded(data):
+        decoded = dict(data)
+        for field in STRING_LIST_FIELDS:
+            values = data.get(field)
+            if isinstance(values, list):
+                decoded[field] = [vocab.canonical(v) if isinstance(v, str) else v for v in values]
+        table = data.get("observation_table")
+        if isinstance(table, dict):
+            decoded_table = dict(table)
+            for column in TABLE_STRING_COLUMNS:
+                if isinstance(table.get(column), list):
+                    decoded_table[column] = [vocab.canonical(v) if isinstance(v, str) else v
+                                             for v in table[column]]
+            decoded["observation_table"] = decoded_table
+        return decoded
+
+    decoded = {k: v for k, v in data.items() if k != "_encoding"}
+    for field in STRING_LIST_FIELDS + LEGACY_ENCODED_FIELDS:
+        values = data.get(field)
+        if isinstance(values, list):
+            decoded[field] = [vocab.lookup(v) if isinstance(v, int) else v for v in values]
+    table = data.get("observation_table")
+    if isinstance(table, dict):
+        decoded_table = dict(table)
+        for column in TABLE_STRING_COLUMNS:
+            if column in table:
+                decoded_table[column] = [None if v is None else vocab.lookup(v) for v in table[column]]
+        decoded["observation_table"] = decoded_table
+    return decoded
+
+def save_patient_record(file_path: str, data: Dict[str, Any], encode: bool = True) -> None:
+    """
+    Write a patient data file, encoding strings against the vocabulary of its directory.
+    New terms reach the vocabulary file before the record, so IDs on disk always resolve.
+    """
+    if encode:
+        vocab = get_vocabulary(os.path.dirname(os.path.abspath(file_path)))
+        encoded = encode_patient_record(data, vocab)
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(encoded, f, separators=(",", ":"))
+    else:
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+def load_patient_record(file_path: str) -> Optional[Dict[str, Any]]:
+    """Read a patient data file written by save_patient_record (encoded or plain)"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        return data
+    vocab = get_vocabulary(os.path.dirname(os.path.abspath(file_path)))
+    return decode_patient_record(data, vocab)